@@ -0,0 +1,250 @@
+from datetime import datetime
+
+from sqlalchemy import and_, case, exists, func, insert, or_, select, update
+
+import occupancy
+import rollups
+from models import db, AdvanceReservation, Booking, ParkingLot, ParkingSpot, Reservation
+
+# A competing writer can take the candidate spot between our sub-select and
+# the update (Postgres READ COMMITTED); in that case we simply pick another.
+CLAIM_ATTEMPTS = 5
+
+# Spots removed from a lot keep their row, so reservation history and revenue
+# still join to the lot; nothing reads or claims them any more.
+RETIRED = 'X'
+
+
+def _adjust_filled(lot_id, delta):
+    filled = ParkingLot.spots_filled + delta
+    filled = db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id == lot_id)
+        .values(spots_filled=case((filled < 0, 0), else_=filled))
+        .returning(ParkingLot.spots_filled)
+    ).scalar()
+    if delta > 0 and filled is not None:
+        rollups.record_occupancy(lot_id, datetime.utcnow(), filled)
+
+
+def claim_spot(lot_id=None, spot_id=None, exclude=()):
+    """Flip one free spot to occupied with a single compare-and-set UPDATE.
+
+    Pass ``spot_id`` to claim that exact spot, or ``lot_id`` to take the
+    lowest-numbered free spot of the lot that is not in ``exclude``. Returns
+    the claimed spot id, or None when nothing could be claimed. The caller
+    owns the commit.
+    """
+    candidate = select(ParkingSpot.id).where(ParkingSpot.status == 'A')
+    if spot_id is not None:
+        candidate = candidate.where(ParkingSpot.id == spot_id)
+    if lot_id is not None:
+        candidate = candidate.where(ParkingSpot.lot_id == lot_id)
+    if exclude:
+        candidate = candidate.where(ParkingSpot.id.notin_(exclude))
+    candidate = candidate.order_by(ParkingSpot.id).limit(1).scalar_subquery()
+
+    stmt = (
+        update(ParkingSpot)
+        .where(ParkingSpot.id == candidate, ParkingSpot.status == 'A')
+        .values(status='O')
+        .returning(ParkingSpot.id, ParkingSpot.lot_id)
+    )
+
+    attempts = 1 if spot_id is not None else CLAIM_ATTEMPTS
+    for _ in range(attempts):
+        row = db.session.execute(stmt).first()
+        if row is not None:
+            _adjust_filled(row.lot_id, 1)
+            occupancy.mark(row.lot_id, row.id, True)
+            return row.id
+    return None
+
+
+def free_spot(spot_id):
+    """Flip an occupied spot back to available. Returns False if it was not occupied."""
+    row = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id == spot_id, ParkingSpot.status == 'O')
+        .values(status='A')
+        .returning(ParkingSpot.lot_id)
+    ).first()
+    if row is None:
+        return False
+    _adjust_filled(row.lot_id, -1)
+    occupancy.mark(row.lot_id, spot_id, False)
+    return True
+
+
+def claim_lot(lot_id):
+    """Occupy every free spot of a lot in one UPDATE. Returns the number claimed."""
+    claimed = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A')
+        .values(status='O')
+    ).rowcount
+    if claimed:
+        _adjust_filled(lot_id, claimed)
+        occupancy.mark_lot(lot_id, True)
+    return claimed
+
+
+def release_lot(lot_id):
+    """Free the spots a lot booking occupied in one UPDATE. Returns the number freed.
+
+    Close the booking first. Spots held by an active reservation stay
+    occupied, and nothing is freed while another booking of the lot is active.
+    """
+    freed = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'O',
+               ~_has_active_reservation(), ~_lot_booked(lot_id))
+        .values(status='A')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if freed:
+        _adjust_filled(lot_id, -freed)
+        occupancy.forget(lot_id)
+    return freed
+
+
+def provision_spots(lot_id, count):
+    """Insert ``count`` free spots for a lot as one executemany."""
+    if count > 0:
+        db.session.execute(insert(ParkingSpot), [{'lot_id': lot_id, 'status': 'A'}] * count)
+        occupancy.forget(lot_id)
+
+
+def resize_spots(lot_id, max_spots):
+    """Grow or shrink a lot's spots to ``max_spots``.
+
+    Shrinking retires free spots without an active reservation or an upcoming
+    advance booking, highest ids first; their history stays. Returns False
+    when there are not enough such spots; the caller then rolls back.
+    """
+    # Writing the lot row first serialises concurrent resizes, so the count
+    # below cannot go stale before the spots are added or retired.
+    db.session.execute(update(ParkingLot).where(ParkingLot.id == lot_id).values(max_spots=max_spots)
+                       .execution_options(synchronize_session=False))
+    current = db.session.query(func.count(ParkingSpot.id)) \
+        .filter(ParkingSpot.lot_id == lot_id, ParkingSpot.status != RETIRED).scalar()
+    if max_spots >= current:
+        provision_spots(lot_id, max_spots - current)
+        return True
+
+    surplus = current - max_spots
+    candidates = select(ParkingSpot.id).where(ParkingSpot.lot_id == lot_id, _removable()) \
+        .order_by(ParkingSpot.id.desc()).limit(surplus).correlate(None)
+    # The UPDATE re-checks every condition, so a spot claimed since the
+    # sub-select is skipped, and then the whole shrink is undone.
+    savepoint = db.session.begin_nested()
+    retired = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id.in_(candidates), _removable())
+        .values(status=RETIRED)
+        .returning(ParkingSpot.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if len(retired) < surplus:
+        savepoint.rollback()
+        return False
+    savepoint.commit()
+    occupancy.forget(lot_id)
+    return True
+
+
+def _selected(lot_id, ranges, ids):
+    """Spots of a lot picked by inclusive id ``ranges`` and/or an id set."""
+    picked = [ParkingSpot.id.between(low, high) for low, high in ranges]
+    if ids:
+        picked.append(ParkingSpot.id.in_(ids))
+    return and_(ParkingSpot.lot_id == lot_id, ParkingSpot.status != RETIRED, or_(*picked))
+
+
+def _has_active_reservation():
+    return exists().where(Reservation.spot_id == ParkingSpot.id, Reservation.leaving_timestamp.is_(None))
+
+
+def _lot_booked(lot_id):
+    return exists().where(Booking.parking_lot_id == lot_id, Booking.end_time.is_(None))
+
+
+def _has_upcoming_booking():
+    # A booked window that has already ended (a no-show) no longer holds the spot.
+    return exists().where(AdvanceReservation.spot_id == ParkingSpot.id, AdvanceReservation.status == 'B',
+                          AdvanceReservation.end_time > datetime.utcnow())
+
+
+def _removable():
+    return and_(ParkingSpot.status == 'A', ~_has_active_reservation(), ~_has_upcoming_booking())
+
+
+def _count(selection):
+    return db.session.query(func.count(ParkingSpot.id)).filter(selection).scalar()
+
+
+def block_spots(lot_id, ranges=(), ids=()):
+    """Take free spots out of service in one UPDATE. Returns (selected, changed)."""
+    selection = _selected(lot_id, ranges, ids)
+    changed = db.session.execute(
+        update(ParkingSpot)
+        .where(selection, ParkingSpot.status == 'A')
+        .values(status='O')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if changed:
+        _adjust_filled(lot_id, changed)
+        occupancy.forget(lot_id)
+    return _count(selection), changed
+
+
+def unblock_spots(lot_id, ranges=(), ids=()):
+    """Return blocked spots to service in one UPDATE. Returns (selected, changed).
+
+    Spots held by an active reservation, or by an active lot booking, stay occupied.
+    """
+    selection = _selected(lot_id, ranges, ids)
+    changed = db.session.execute(
+        update(ParkingSpot)
+        .where(selection, ParkingSpot.status == 'O', ~_has_active_reservation(), ~_lot_booked(lot_id))
+        .values(status='A')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if changed:
+        _adjust_filled(lot_id, -changed)
+        occupancy.forget(lot_id)
+    return _count(selection), changed
+
+
+def delete_spots(lot_id, ranges=(), ids=()):
+    """Retire selected spots, keeping their history. Returns (selected, changed).
+
+    Spots with an active reservation or an upcoming advance booking are kept;
+    the check is part of each UPDATE, so a spot reserved meanwhile is skipped.
+    The lot's max_spots and spots_filled shrink by what was removed.
+    """
+    selection = _selected(lot_id, ranges, ids)
+    selected = _count(selection)
+
+    def retire(status):
+        return db.session.execute(
+            update(ParkingSpot)
+            .where(selection, ParkingSpot.status == status,
+                   ~_has_active_reservation(), ~_has_upcoming_booking())
+            .values(status=RETIRED)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    occupied = retire('O')
+    removed = occupied + retire('A')
+    if not removed:
+        return selected, 0
+
+    filled = ParkingLot.spots_filled - occupied
+    db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id == lot_id)
+        .values(max_spots=ParkingLot.max_spots - removed, spots_filled=case((filled < 0, 0), else_=filled))
+    )
+    occupancy.forget(lot_id)
+    return selected, removed
@@ -0,0 +1,235 @@
+import zlib
+from datetime import datetime
+from functools import wraps
+
+from flask import Blueprint, Response, jsonify, request, session
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from werkzeug.http import is_resource_modified
+
+import auth
+import billing
+import occupancy
+import parking
+import schedule
+from models import db, Booking, ParkingLot, ParkingSpot, Reservation
+
+# Versioned JSON API for kiosk and mobile clients. It uses the same session
+# cookie as the HTML pages and the same lifecycle code in parking.py.
+#
+# Lot and spot-map responses carry an ETag built from the lot row's stored
+# spot and hold versions and its updated_at, plus the spots held right now,
+# so every worker agrees on it. A poll that matches is answered with 304
+# after one query on parking_lot.
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+_EPOCH = datetime(1970, 1, 1)
+
+ERROR_STATUS = {
+    parking.OCCUPIED: 409,
+    parking.HELD: 409,
+    parking.ALREADY_ACTIVE: 409,
+    parking.ALREADY_CONFIRMED: 409,
+    parking.NOT_FOUND: 404,
+}
+
+
+def _error(message, status):
+    return jsonify(error=message), status
+
+
+def login_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not session.get('user_id'):
+            return _error("Authentication required.", 401)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _lot_rows(*criteria):
+    return db.session.query(
+        ParkingLot.id, ParkingLot.prime_location_name, ParkingLot.address, ParkingLot.pin_code,
+        ParkingLot.price_per_hour, ParkingLot.updated_at,
+        func.coalesce(ParkingLot.spot_version, 0).label('spot_version'),
+        func.coalesce(ParkingLot.hold_version, 0).label('hold_version')
+    ).filter(*criteria).order_by(ParkingLot.id).all()
+
+
+def _lot_validator(lot):
+    """ETag and Last-Modified for a lot row from _lot_rows(), plus its held spot ids."""
+    # Holds start and end with the clock, not only on commit.
+    held = sorted(schedule.held_now(lot.id, lot.hold_version))
+    updated_at = lot.updated_at or _EPOCH
+    etag = (f'{lot.id}-{lot.spot_version}-{lot.hold_version}-{updated_at:%Y%m%d%H%M%S%f}-'
+            f'{zlib.crc32(repr(held).encode()):x}')
+    return etag, updated_at, held
+
+
+def _not_modified(etag, last_modified):
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+
+def _conditional(payload, etag, last_modified):
+    response = jsonify(payload)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def _not_modified_response(etag, last_modified):
+    response = Response(status=304)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def _lot_json(lot, held):
+    index = occupancy.for_lot(lot.id, lot.spot_version)
+    held_free = sum(1 for spot_id in held if not index.is_occupied(spot_id)) if held else 0
+    return {
+        'id': lot.id,
+        'name': lot.prime_location_name,
+        'address': lot.address,
+        'pin_code': lot.pin_code,
+        'price_per_hour': lot.price_per_hour,
+        'total_spots': index.total_count,
+        'occupied_spots': index.filled_count,
+        'held_spots': len(held),
+        'available_spots': index.free_count - held_free,
+    }
+
+
+@api.route('/session', methods=['POST'])
+def login():
+    data = request.get_json(silent=True) or request.form
+    try:
+        user = auth.authenticate(data.get('username'), data.get('password') or '')
+    except auth.AuthBusy:
+        return _error("Too many sign-ins, retry shortly.", 503)
+    if not user:
+        return _error("Invalid credentials.", 401)
+    auth.login_user(user)
+    return jsonify(id=user.id, username=user.username, is_admin=user.is_admin)
+
+
+@api.route('/session', methods=['DELETE'])
+def logout():
+    session.pop('user_id', None)
+    session.pop('is_admin', None)
+    session.pop('name', None)
+    return '', 204
+
+
+@api.route('/lots')
+@login_required
+def lots():
+    rows = _lot_rows()
+    validators = [_lot_validator(lot) for lot in rows]
+    # The lot list has no usable Last-Modified (a deleted lot leaves no
+    # timestamp behind), so only the ETag validates it.
+    etag = f'lots-{zlib.crc32(" ".join(v[0] for v in validators).encode()):x}-{len(rows)}'
+    if _not_modified(etag, None):
+        return _not_modified_response(etag, None)
+    payload = {'lots': [_lot_json(lot, v[2]) for lot, v in zip(rows, validators)]}
+    return _conditional(payload, etag, None)
+
+
+@api.route('/lots/<int:lot_id>')
+@login_required
+def lot(lot_id):
+    rows = _lot_rows(ParkingLot.id == lot_id)
+    if not rows:
+        return _error("Parking lot not found.", 404)
+    etag, last_modified, held = _lot_validator(rows[0])
+    if _not_modified(etag, last_modified):
+        return _not_modified_response(etag, last_modified)
+    return _conditional(_lot_json(rows[0], held), etag, last_modified)
+
+
+@api.route('/lots/<int:lot_id>/spots')
+@login_required
+def lot_spots(lot_id):
+    rows = _lot_rows(ParkingLot.id == lot_id)
+    if not rows:
+        return _error("Parking lot not found.", 404)
+    etag, last_modified, held = _lot_validator(rows[0])
+    if _not_modified(etag, last_modified):
+        return _not_modified_response(etag, last_modified)
+
+    held = set(held)
+    spots = [{'id': spot.id, 'status': 'H' if spot.id in held and spot.status == 'A' else spot.status}
+             for spot in occupancy.for_lot(lot_id, rows[0].spot_version).occupancy_map()]
+    return _conditional({'lot_id': lot_id, 'spots': spots}, etag, last_modified)
+
+
+def _reservation_json(reservation):
+    return {
+        'id': reservation.id,
+        'spot_id': reservation.spot_id,
+        'lot_id': reservation.spot.lot_id,
+        'parking_timestamp': reservation.parking_timestamp.isoformat() if reservation.parking_timestamp else None,
+        'leaving_timestamp': reservation.leaving_timestamp.isoformat() if reservation.leaving_timestamp else None,
+        'has_parked': bool(reservation.has_parked),
+        'price_per_hour': reservation.price_per_hour,
+        'cost': reservation.calculate_total_price(),
+    }
+
+
+def _lifecycle_response(reservation, error, status=200):
+    if error:
+        db.session.rollback()
+        return _error(parking.MESSAGES[error], ERROR_STATUS[error])
+    db.session.commit()
+    return jsonify(_reservation_json(reservation)), status
+
+
+@api.route('/spots/<int:spot_id>/reserve', methods=['POST'])
+@login_required
+def reserve(spot_id):
+    spot = db.session.get(ParkingSpot, spot_id)
+    if spot is None:
+        return _error("Parking spot not found.", 404)
+    reservation, error = parking.reserve(session['user_id'], spot)
+    return _lifecycle_response(reservation, error, 201)
+
+
+@api.route('/spots/<int:spot_id>/confirm', methods=['POST'])
+@login_required
+def confirm(spot_id):
+    return _lifecycle_response(*parking.confirm(session['user_id'], spot_id))
+
+
+@api.route('/spots/<int:spot_id>/release', methods=['POST'])
+@login_required
+def release(spot_id):
+    return _lifecycle_response(*parking.release(session['user_id'], spot_id))
+
+
+@api.route('/history')
+@login_required
+def history():
+    user_id = session['user_id']
+    reservations = Reservation.query.options(joinedload(Reservation.spot)) \
+        .filter_by(user_id=user_id).order_by(Reservation.parking_timestamp.desc()).all()
+    bookings = Booking.query.options(joinedload(Booking.parking_lot)) \
+        .filter_by(user_id=user_id).order_by(Booking.start_time.desc()).all()
+
+    total_cost = round(billing.total(*billing.closed_booking_columns(Booking.user_id == user_id))
+                       + billing.total(*billing.closed_reservation_columns(Reservation.user_id == user_id)), 2)
+    return jsonify(
+        reservations=[_reservation_json(reservation) for reservation in reservations],
+        bookings=[{
+            'id': booking.id,
+            'lot_id': booking.parking_lot_id,
+            'start_time': booking.start_time.isoformat(),
+            'end_time': booking.end_time.isoformat() if booking.end_time else None,
+            'cost': booking.calculate_price(),
+        } for booking in bookings],
+        total_cost=total_cost,
+    )
@@ -1,36 +1,102 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from flask_sqlalchemy import SQLAlchemy
-from models import db, User, ParkingLot, Booking,ParkingSpot,Reservation
-from flask import session
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
-
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///parking.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = 'your-secret-key'
-
-db.init_app(app)
-
-with app.app_context():
-    db.create_all()
-    existing_admin = User.query.filter_by(username='admin').first()
-    if not existing_admin:
-        admin = User(
-            username='admin',
-            passhash=generate_password_hash('admin'),
-            name='Admin User',  
-            is_admin=True,
-            created_at=datetime.utcnow()
-        )
-        db.session.add(admin)
-        db.session.commit()
-
-
+from flask import Flask, render_template, request, redirect, url_for, flash, session, Response, stream_with_context, \
+    current_app, abort
+from flask.cli import AppGroup
+from models import db, User, ParkingLot, Booking,ParkingSpot,Reservation, AdvanceReservation, TariffBand
+from allocation import claim_spot, claim_lot, release_lot, provision_spots, resize_spots, \
+    block_spots, unblock_spots, delete_spots
+import occupancy
+import schema
+from database import configure_database
+import rollups
+import catalog
+import search
+import export
+import perf
+import waitlist
+import schedule
+import expiry
+import audit
+import parking
+import auth
+import pricing
+import pages
+from api import api
+from datetime import datetime, timedelta
+import click
+import json
+import os
+import queue
+import threading
+from sqlalchemy import and_, cast, func, or_, update
+from sqlalchemy.orm import joinedload
+
+# Views and CLI commands below are collected at import and attached to each
+# app create_app() builds, keeping their plain endpoint names. Building an
+# app does not touch the database; `flask init-db` and `flask seed-admin`
+# prepare it. Servers use serve(), which also starts the background workers,
+# so CLI commands and tests never run them.
+
+_routes = []
+cli = AppGroup('parking')
+
+
+def route(rule, **options):
+    def decorator(view):
+        _routes.append((rule, view, options))
+        return view
+    return decorator
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    configure_database(app)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = 'your-secret-key'
+    app.config.update(config or {})
+
+    db.init_app(app)
+    perf.init_app(app)
+    for rule, view, options in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    app.register_blueprint(api)
+    for command in cli.commands.values():
+        app.cli.add_command(command)
+    return app
+
+
+def start_workers(app):
+    """Start the waitlist scheduler, expiry sweeper and occupancy auditor threads."""
+    waitlist.start(app)
+    expiry.start(app)
+    audit.start(app)
+
+
+def serve(config=None):
+    """App factory for servers, e.g. ``gunicorn 'app:serve()'``."""
+    app = create_app(config)
+    start_workers(app)
+    return app
+
+
+@cli.command('init-db')
+def init_db():
+    """Create missing tables, columns, indexes and the search index."""
+    schema.init_db()
+    click.echo("Database is up to date.")
+
+
+@cli.command('seed-admin')
+@click.option('--username', default='admin', show_default=True)
+@click.option('--password', default='admin', show_default=True)
+def seed_admin(username, password):
+    """Create the admin account unless that username already exists."""
+    if auth.ensure_admin(username, password):
+        click.echo(f"Created admin '{username}'.")
+    else:
+        click.echo(f"User '{username}' already exists.")
 
-from flask import session, redirect, url_for
 
-@app.route('/')
+@route('/')
 def home():
     
     if not session.get('has_visited_home'):
@@ -50,16 +116,19 @@ def home():
 
 
 
-@app.route('/user/login', methods=['GET', 'POST'])
+@route('/user/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
 
-        user = User.query.filter_by(username=username).first()
-        if user and user.verify_password(password):
-            session['user_id'] = user.id
-            session['is_admin'] = user.is_admin
+        try:
+            user = auth.authenticate(username, password)
+        except auth.AuthBusy:
+            flash('Too many sign-ins right now, please try again in a moment.')
+            return redirect(url_for('login'))
+        if user:
+            auth.login_user(user)
             return redirect(url_for('admin_dashboard' if user.is_admin else 'user_dashboard'))
         else:
             flash('Invalid credentials!')
@@ -68,7 +137,7 @@ def login():
     return render_template("login.html")
 
 
-@app.route('/user/register', methods=['GET', 'POST'])
+@route('/user/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -90,7 +159,7 @@ def register():
     return render_template("register.html")
 
 
-@app.route('/user/forgot-password', methods=['GET', 'POST'])
+@route('/user/forgot-password', methods=['GET', 'POST'])
 def forgot_password():
     if request.method == 'POST':
         email = request.form['email']
@@ -98,7 +167,7 @@ def forgot_password():
     return render_template("forgot_password.html")
 
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     session.clear()
     flash("Logged out successfully.")
@@ -108,16 +177,19 @@ def logout():
 
 def is_admin():
     return session.get('is_admin') is True
-@app.route('/admin/login', methods=['GET', 'POST'])
+@route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
 
-        user = User.query.filter_by(username=username).first()
-        if user and user.verify_password(password) and user.is_admin:
-            session['user_id'] = user.id
-            session['is_admin'] = True
+        try:
+            user = auth.authenticate(username, password)
+        except auth.AuthBusy:
+            flash('Too many sign-ins right now, please try again in a moment.')
+            return redirect(url_for('admin_login'))
+        if user and user.is_admin:
+            auth.login_user(user)
             flash('Welcome Admin!')
             return redirect(url_for('admin_dashboard'))
         else:
@@ -126,7 +198,7 @@ def admin_login():
 
     return render_template("admin_login.html")
 
-@app.route('/admin/promote/<int:user_id>', methods=['POST'])
+@route('/admin/promote/<int:user_id>', methods=['POST'])
 def promote_user(user_id):
     if not is_admin():
         flash("Unauthorized access.")
@@ -142,7 +214,7 @@ def promote_user(user_id):
 
     return redirect(url_for('admin_users'))
 
-@app.route('/admin/create-admin', methods=['GET', 'POST'])
+@route('/admin/create-admin', methods=['GET', 'POST'])
 def create_admin():
     if not is_admin():
         flash("Unauthorized access.")
@@ -171,7 +243,7 @@ def create_admin():
 
 
 
-@app.route('/admin/dashboard')
+@route('/admin/dashboard')
 def admin_dashboard():
     if not is_admin():
         flash("Unauthorized access.")
@@ -182,7 +254,7 @@ def admin_dashboard():
 
 
 
-@app.route('/admin/add-parking', methods=['GET', 'POST'])
+@route('/admin/add-parking', methods=['GET', 'POST'])
 def add_parking():
     if not is_admin():
         flash("Unauthorized access.")
@@ -192,7 +264,7 @@ def add_parking():
         return redirect(url_for('admin_dashboard'))
     return render_template("add_parking_lot.html")
 
-@app.route('/admin/edit-parking/<int:lot_id>', methods=['GET', 'POST'])
+@route('/admin/edit-parking/<int:lot_id>', methods=['GET', 'POST'])
 def edit_parking(lot_id):
     if not is_admin():
         flash("Unauthorized access.")
@@ -201,21 +273,33 @@ def edit_parking(lot_id):
     lot = ParkingLot.query.get_or_404(lot_id)
 
     if request.method == 'POST':
+        max_spots = int(request.form['max_spots'])
+        if not resize_spots(lot.id, max_spots):
+            db.session.rollback()
+            flash("Cannot reduce spots below the number currently in use or booked.")
+            return redirect(url_for('edit_parking', lot_id=lot.id))
+
         lot.prime_location_name = request.form['prime_location_name']
         lot.price_per_hour = request.form['price_per_hour']
         lot.address = request.form['address']
         lot.pin_code = request.form['pin_code']
-        lot.max_spots = request.form['max_spots']
+        lot.max_spots = max_spots
+        catalog.touch()
         db.session.commit()
         flash("Parking lot updated successfully!")
         return redirect(url_for('view_parking_lots'))
 
     return render_template('edit_parking.html', lot=lot)
 
-@app.route('/admin/delete-parking/<int:lot_id>', methods=['POST', 'GET'])
+@route('/admin/delete-parking/<int:lot_id>', methods=['POST', 'GET'])
 def delete_parking(lot_id):
     lot = ParkingLot.query.get_or_404(lot_id)
     db.session.delete(lot)
+    waitlist.cancel_lot(lot_id)
+    occupancy.forget(lot_id)
+    schedule.forget(lot_id)
+    pricing.touch()
+    catalog.touch()
     db.session.commit()
     flash('Parking lot deleted successfully.', 'success')
     return redirect(url_for('view_parking_lots'))
@@ -223,7 +307,7 @@ def delete_parking(lot_id):
 
 
 
-@app.route('/admin/create-parking', methods=['POST'])
+@route('/admin/create-parking', methods=['POST'])
 def create_parking():
     if not is_admin():
         flash("Unauthorized access.")
@@ -239,69 +323,42 @@ def create_parking():
     )
 
     db.session.add(parking_lot)
-    db.session.commit()
-
-    
-    for i in range(parking_lot.max_spots):
-        spot = ParkingSpot(
-            lot_id=parking_lot.id,
-            status='A'  
-        )
-        db.session.add(spot)
+    db.session.flush()
 
+    provision_spots(parking_lot.id, parking_lot.max_spots)
+    catalog.touch()
     db.session.commit()
 
     flash("Parking lot and spots created successfully!")
     return redirect(url_for('admin_dashboard'))
 
 
-from flask import request
-
-@app.route('/admin/view-parking')
+@route('/admin/view-parking')
 def view_parking_lots():
     q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
     
     if q:
-        parking_lots = ParkingLot.query.filter(
-            (ParkingLot.prime_location_name.ilike(f'%{q}%')) | 
-            (ParkingLot.pin_code.ilike(f'%{q}%'))
-        ).all()
+        parking_lots, has_next = search.search_lots(q, page)
+        context = {'parking_lots': parking_lots, 'page': page, 'has_next': has_next}
     else:
-        parking_lots = ParkingLot.query.all()
+        context = pages.run(pages.lots(page))
 
-    return render_template('view_parking_lots.html', parking_lots=parking_lots)
+    return render_template('view_parking_lots.html', **context)
 
 
-@app.route('/user/history')
+@route('/user/history')
 def user_history():
     user_id = session.get('user_id')
     if not user_id:
         flash("Please log in to view history.")
         return redirect(url_for('login'))
 
-    
-    bookings     = Booking.query.filter_by(user_id=user_id).all()
-    reservations = Reservation.query.filter_by(user_id=user_id).all()
-
-   
-    total_booking_cost     = sum(
-        b.calculate_price() for b in bookings if b.end_time
-    )
-    total_reservation_cost = sum(
-        r.calculate_total_price() for r in reservations if r.leaving_timestamp
-    )
-    total_cost = round(total_booking_cost + total_reservation_cost, 2)
-
-    return render_template(
-        "user_history.html",
-        bookings=bookings,
-        reservations=reservations,
-        total_cost=total_cost
-    )
+    return render_template("user_history.html", **pages.run(pages.history(user_id)))
 
 
 
-@app.route('/admin/users')
+@route('/admin/users')
 def admin_users():
     if not is_admin():
         flash("Unauthorized access.")
@@ -311,45 +368,143 @@ def admin_users():
     return render_template('admin_users.html', users=users)
 
 
-@app.route('/admin/reports')
+@route('/admin/tariffs', methods=['GET', 'POST'])
+def admin_tariffs():
+    if not is_admin():
+        flash("Unauthorized access.")
+        return redirect(url_for('login'))
+
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        lot_id = request.form.get('lot_id', type=int)
+        multiplier = request.form.get('multiplier', type=float)
+        try:
+            if kind == 'T':
+                starts = datetime.strptime(request.form.get('starts', ''), '%H:%M')
+                threshold = starts.hour * 60 + starts.minute
+            else:
+                threshold = int(request.form.get('starts', ''))
+        except ValueError:
+            threshold = None
+        if kind == 'O' and threshold is not None and not 0 <= threshold <= 100:
+            threshold = None
+        if kind not in ('T', 'O') or threshold is None or multiplier is None or multiplier <= 0:
+            flash("Enter a start time (HH:MM) or occupancy percent (0-100) and a positive multiplier.")
+            return redirect(url_for('admin_tariffs'))
+        if lot_id and not db.session.get(ParkingLot, lot_id):
+            flash("Parking lot not found.")
+            return redirect(url_for('admin_tariffs'))
+
+        db.session.add(TariffBand(lot_id=lot_id or None, kind=kind, threshold=threshold, multiplier=multiplier))
+        pricing.touch()
+        db.session.commit()
+        flash("Tariff band added.")
+        return redirect(url_for('admin_tariffs'))
+
+    bands = TariffBand.query.options(joinedload(TariffBand.lot)) \
+        .order_by(TariffBand.lot_id, TariffBand.kind, TariffBand.threshold).all()
+    lots = ParkingLot.query.order_by(ParkingLot.prime_location_name).all()
+    return render_template('admin_tariffs.html', bands=bands, lots=lots)
+
+
+@route('/admin/tariffs/<int:band_id>/delete', methods=['POST'])
+def delete_tariff_band(band_id):
+    if not is_admin():
+        flash("Unauthorized access.")
+        return redirect(url_for('login'))
+
+    band = TariffBand.query.get_or_404(band_id)
+    db.session.delete(band)
+    pricing.touch()
+    db.session.commit()
+    flash("Tariff band removed.")
+    return redirect(url_for('admin_tariffs'))
+
+
+REPORT_DEFAULT_DAYS = 30
+
+
+@route('/admin/reports')
 def admin_reports():
     if not is_admin():
         flash("Unauthorized access.")
         return redirect(url_for('login'))
 
-    users = User.query.all()
-    admins = [u for u in users if u.is_admin]
+    total_users = User.query.count()
+    total_admins = User.query.filter_by(is_admin=True).count()
     total_bookings = Booking.query.count()
     total_lots = ParkingLot.query.count()
 
+    today = datetime.utcnow().date()
+    try:
+        end_day = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else today
+        start_day = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') \
+            else end_day - timedelta(days=REPORT_DEFAULT_DAYS - 1)
+    except ValueError:
+        flash("Dates must be in YYYY-MM-DD format.")
+        return redirect(url_for('admin_reports'))
+
     return render_template('admin_reports.html',
-                           total_users=len(users),
-                           total_admins=len(admins),
+                           total_users=total_users,
+                           total_admins=total_admins,
                            total_lots=total_lots,
-                           total_bookings=total_bookings)
+                           total_bookings=total_bookings,
+                           start_day=start_day,
+                           end_day=end_day,
+                           daily=rollups.daily_usage(start_day, end_day),
+                           per_lot=rollups.lot_usage(start_day, end_day),
+                           catalog_stats=catalog.stats())
+
+
+@cli.command('backfill-rollups')
+def backfill_rollups():
+    """Rebuild the hourly/daily usage rollups from existing history."""
+    buckets = rollups.backfill()
+    db.session.commit()
+    click.echo(f"Rebuilt {buckets} hourly usage buckets.")
+
+
+@cli.command('expire-reservations')
+def expire_reservations():
+    """Release reservations left unconfirmed past the grace period."""
+    reclaimed = expiry.sweep()
+    click.echo(f"Reclaimed {reclaimed} spots.")
+
+
+@cli.command('audit-occupancy')
+@click.option('--repair', is_flag=True, help='Rewrite spots_filled for lots that drifted.')
+def audit_occupancy(repair):
+    """Compare every lot's spots_filled with its occupied spots."""
+    drift = audit.run(fix=repair)
+    for row in drift:
+        click.echo(f"Lot {row.lot_id} ({row.prime_location_name}): spots_filled={row.spots_filled}, "
+                   f"occupied={row.actual_filled}")
+    click.echo(f"{len(drift)} lots drifted" + (", repaired." if repair and drift else "."))
 
 
 
 def get_current_user():
-    user_id = session.get('user_id')
-    if user_id:
-        return User.query.get(user_id)
-    return None
+    return auth.current_principal()
 
-@app.route('/user/dashboard')
+@route('/user/dashboard')
 def user_dashboard():
     user = get_current_user()
-    parking_lots = ParkingLot.query.all()
+    if user:
+        for entry in waitlist.pending_notifications(user.id):
+            flash(f"Good news! Spot {entry.assigned_spot_id} in {entry.lot.prime_location_name} "
+                  f"has been reserved for you from the waitlist.")
+        db.session.commit()
+    parking_lots = catalog.lots()
     return render_template('user_dashboard.html', user=user, parking_lots=parking_lots)
 
-@app.route('/user/book-parking', methods=['GET', 'POST'])
+@route('/user/book-parking', methods=['GET', 'POST'])
 def book_parking():
     user_id = session.get('user_id')
     if not user_id:
         flash("Please login to book a parking lot.")
         return redirect(url_for('login'))
 
-    parking_lots = ParkingLot.query.all()
+    parking_lots = catalog.lots()
 
     if request.method == 'POST':
         selected_lot_id = request.form.get('parking_lot_id')
@@ -373,10 +528,7 @@ def book_parking():
 
         booking = Booking(user_id=user_id, parking_lot_id=lot.id)
         db.session.add(booking)
-        for spot in lot.spots:
-            if spot.status == 'A':
-               spot.status = 'O'
-               lot.spots_filled += 1
+        claim_lot(lot.id)
         db.session.commit()
         flash(f'Lot {lot.prime_location_name} booked successfully!')
         return redirect(url_for('user_dashboard'))
@@ -385,7 +537,7 @@ def book_parking():
 
 
 
-@app.route('/user/release-parking', methods=['GET', 'POST'])
+@route('/user/release-parking', methods=['GET', 'POST'])
 def release_parking():
     user_id = session.get('user_id')
     if not user_id:
@@ -397,11 +549,9 @@ def release_parking():
     if request.method == 'POST':
         if booking:
             booking.end_time = datetime.utcnow()  
-            lot = ParkingLot.query.get(booking.parking_lot_id)
-            if lot:
-               for spot in lot.spots:
-                  spot.status = 'A'
-               lot.spots_filled = 0
+            release_lot(booking.parking_lot_id)
+            rollups.record_booking(booking)
+            waitlist.notify(booking.parking_lot_id)
 
             db.session.commit()
             flash('Lot booking released.')
@@ -413,43 +563,88 @@ def release_parking():
 
 
 
-@app.route('/user/view_spots/<int:lot_id>')
+@route('/user/view_spots/<int:lot_id>')
 def view_spots(lot_id):
     user_id = session.get('user_id')
     if not user_id:
         flash("Please login to continue.")
         return redirect(url_for('login'))
 
-    lot = ParkingLot.query.get_or_404(lot_id)
-    spots = ParkingSpot.query.filter_by(lot_id=lot_id).all()
+    context = pages.run(pages.spots(lot_id, user_id))
+    if context is None:
+        abort(404)
+    return render_template('view_spots.html', **context)
 
-    
-    filled_count = sum(1 for spot in spots if spot.status == 'O')
-    total_spots = len(spots)
-    available_spots = total_spots - filled_count
 
-    has_booking = Booking.query.filter_by(user_id=user_id, end_time=None).first() is not None
 
 
-    return render_template(
-    'view_spots.html',
-    lot=lot,
-    spots=spots,
-    filled_count=filled_count,
-    total_spots=total_spots,
-    available_spots=available_spots,
-    has_booking=has_booking
-)
-
 
 
 
 
 
+STREAM_KEEPALIVE_SECONDS = 15
+# A stream served here holds a server thread while its page is open, so each
+# process serves at most STREAM_LIMIT at once and answers 503 past that; the
+# page then shows its initial state without live updates. Serve streams
+# through asgi.py (or a gevent worker) where many pages stay open.
+STREAM_LIMIT = int(os.environ.get('STREAM_LIMIT', 8))
+_stream_slots = threading.BoundedSemaphore(STREAM_LIMIT)
 
 
+@route('/lots/<int:lot_id>/occupancy/stream')
+def occupancy_stream(lot_id):
+    if not session.get('user_id'):
+        flash("Please login to continue.")
+        return redirect(url_for('login'))
 
-@app.route('/user/book-spot', methods=['GET', 'POST'])
+    ParkingLot.query.get_or_404(lot_id)
+    if not _stream_slots.acquire(blocking=False):
+        return Response("Too many live views are open, retry shortly.", 503,
+                        headers={'Retry-After': str(STREAM_KEEPALIVE_SECONDS)})
+    try:
+        # Subscribe before taking the snapshot so no commit falls in between.
+        updates = occupancy.subscribe(lot_id)
+        index = occupancy.for_lot(lot_id)
+    except Exception:
+        _stream_slots.release()
+        raise
+    snapshot = index.snapshot()
+
+    app = current_app._get_current_object()
+
+    def events():
+        seen = index.version
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(snapshot)}\n\n"
+            while True:
+                try:
+                    message = updates.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Deltas only come from this process; catch other workers' commits.
+                    with app.app_context():
+                        version = occupancy.stored_version(lot_id)
+                    if version is not None and version > seen:
+                        yield f"data: {json.dumps({'reload': True})}\n\n"
+                        seen = version
+                    yield ": keepalive\n\n"
+                    continue
+                version = message.get('version')
+                if occupancy.missed(seen, version):
+                    message = {'reload': True}
+                seen = max(seen, version or 0)
+                yield f"data: {json.dumps(message)}\n\n"
+        finally:
+            occupancy.unsubscribe(lot_id, updates)
+
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs even if the body is never iterated, unlike the generator's finally.
+    response.call_on_close(_stream_slots.release)
+    return response
+
+
+@route('/user/book-spot', methods=['GET', 'POST'])
 def book_spot():
     user_id = session.get('user_id')
     if not user_id:
@@ -461,18 +656,19 @@ def book_spot():
         flash("You already have a parking lot booking. Release it to reserve a spot.")
         return redirect(url_for('user_dashboard'))
 
-    parking_lots = ParkingLot.query.all()
+    parking_lots = catalog.lots()
     spots = []
 
     if request.method == 'POST':
         selected_lot_id = request.form.get('parking_lot_id')
         if selected_lot_id:
-            spots = ParkingSpot.query.filter_by(lot_id=int(selected_lot_id), status='A').all()
+            held = schedule.held_now(int(selected_lot_id))
+            spots = [spot for spot in occupancy.for_lot(int(selected_lot_id)).free_spots() if spot.id not in held]
 
         spot_id = request.form.get('spot_id')
         if spot_id:
             spot = ParkingSpot.query.get(int(spot_id))
-            if not spot or spot.status != 'A':
+            if not spot or not spot.is_available():
                 flash("Selected spot is not available.")
                 return redirect(url_for('book_spot'))
 
@@ -481,9 +677,11 @@ def book_spot():
                 flash('You already have a reserved spot.')
                 return redirect(url_for('user_dashboard'))
 
-            spot.status = 'O'
-            spot.lot.spots_filled += 1
-            reservation = Reservation(user_id=user_id, spot_id=spot.id, price_per_hour=spot.lot.price_per_hour)
+            price = pricing.quote(spot.lot)
+            if not claim_spot(spot_id=spot.id):
+                flash("Selected spot is not available.")
+                return redirect(url_for('book_spot'))
+            reservation = Reservation(user_id=user_id, spot_id=spot.id, price_per_hour=price)
             db.session.add(reservation)
             db.session.commit()
             flash('Spot reserved successfully.')
@@ -492,17 +690,18 @@ def book_spot():
     return render_template('book_spot.html', parking_lots=parking_lots, spots=spots)
 
 
-@app.route('/admin/view_spots/<int:lot_id>', methods=['GET', 'POST'])
+@route('/admin/view_spots/<int:lot_id>', methods=['GET', 'POST'])
 def admin_view_spots(lot_id):
     if not is_admin():
         flash("Unauthorized access.")
         return redirect(url_for('login'))
 
     lot = ParkingLot.query.get_or_404(lot_id)
-    spots = ParkingSpot.query.filter_by(lot_id=lot_id).all()
+    index = occupancy.for_lot(lot_id)
+    spots = index.occupancy_map()
 
-    filled_count = ParkingSpot.query.filter_by(lot_id=lot_id, status='O').count()
-    actual_spot_count = len(spots)
+    filled_count = index.filled_count
+    actual_spot_count = index.total_count
 
     return render_template(
         'admin_view_spots.html',
@@ -514,7 +713,7 @@ def admin_view_spots(lot_id):
 
 
 
-@app.route('/admin/toggle-spot/<int:spot_id>', methods=['POST'])
+@route('/admin/toggle-spot/<int:spot_id>', methods=['POST'])
 def toggle_spot_status(spot_id):
     if not is_admin():
         flash("Unauthorized access.")
@@ -524,19 +723,23 @@ def toggle_spot_status(spot_id):
     lot = spot.lot  
 
     if spot.status == 'A':
-        spot.status = 'O'
-        lot.spots_filled += 1
-    elif spot.status == 'O':
-        spot.status = 'A'
-        if lot.spots_filled > 0:
-            lot.spots_filled -= 1
+        _, toggled = block_spots(lot.id, ids=[spot.id])
+    else:
+        _, toggled = unblock_spots(lot.id, ids=[spot.id])
+        if toggled:
+            waitlist.notify(lot.id)
+    if not toggled:
+        # Reserved, booked, retired or changed since the page was drawn.
+        db.session.rollback()
+        flash(f"Spot {spot.id} cannot be toggled right now.")
+        return redirect(url_for('admin_view_spots', lot_id=lot.id))
 
     db.session.commit()
     flash(f"Spot {spot.id} status updated.")
     return redirect(url_for('admin_view_spots', lot_id=lot.id))
 
 
-@app.route('/admin/delete-spot/<int:spot_id>', methods=['POST'])
+@route('/admin/delete-spot/<int:spot_id>', methods=['POST'])
 def delete_spot(spot_id):
     if not is_admin():
         flash("Unauthorized access.")
@@ -545,18 +748,109 @@ def delete_spot(spot_id):
     spot = ParkingSpot.query.get_or_404(spot_id)
     lot = spot.lot  
 
-    
-    if spot.status == 'O' and lot.spots_filled > 0:
-        lot.spots_filled -= 1
-
-    db.session.delete(spot)
+    _, deleted = delete_spots(lot.id, ids=[spot.id])
+    if not deleted:
+        db.session.rollback()
+        flash(f"Spot {spot.id} cannot be deleted while it is reserved or booked.")
+        return redirect(url_for('admin_view_spots', lot_id=lot.id))
+    schedule.forget(lot.id)
+    catalog.touch()
     db.session.commit()
 
     flash(f"Spot {spot.id} deleted.")
     return redirect(url_for('admin_view_spots', lot_id=lot.id))
 
 
-@app.route('/user/reserve/<int:spot_id>', methods=['POST'])
+def parse_spot_selection(text):
+    """Parse "1-20, 25, 30-40" into ([(1, 20), (30, 40)], [25]). Raises ValueError."""
+    ranges, ids = [], []
+    for part in text.replace(' ', '').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            low, high = (int(bound) for bound in part.split('-', 1))
+            ranges.append((min(low, high), max(low, high)))
+        else:
+            ids.append(int(part))
+    if not ranges and not ids:
+        raise ValueError("empty selection")
+    return ranges, ids
+
+
+BULK_SPOT_ACTIONS = {
+    'block': (block_spots, 'Blocked'),
+    'unblock': (unblock_spots, 'Unblocked'),
+    'delete': (delete_spots, 'Deleted'),
+}
+
+
+@route('/admin/lots/<int:lot_id>/spots/bulk', methods=['POST'])
+def bulk_spots(lot_id):
+    if not is_admin():
+        flash("Unauthorized access.")
+        return redirect(url_for('login'))
+
+    lot = ParkingLot.query.get_or_404(lot_id)
+    action = request.form.get('action')
+    if action not in BULK_SPOT_ACTIONS:
+        flash("Unknown bulk action.")
+        return redirect(url_for('admin_view_spots', lot_id=lot.id))
+
+    try:
+        text = ','.join([request.form.get('selection', '')] + request.form.getlist('spot_ids'))
+        ranges, ids = parse_spot_selection(text)
+    except ValueError:
+        flash("Select spots or enter spot ids such as 1-20, 25.")
+        return redirect(url_for('admin_view_spots', lot_id=lot.id))
+
+    operation, verb = BULK_SPOT_ACTIONS[action]
+    selected, changed = operation(lot.id, ranges, ids)
+    if action == 'unblock' and changed:
+        waitlist.notify(lot.id)
+    if action == 'delete' and changed:
+        schedule.forget(lot.id)
+        catalog.touch()
+    db.session.commit()
+
+    skipped = selected - changed
+    flash(f"{verb} {changed} of {selected} selected spots" + (f" ({skipped} skipped)." if skipped else "."))
+    return redirect(url_for('admin_view_spots', lot_id=lot.id))
+
+
+@route('/admin/lots/bulk-edit', methods=['POST'])
+def bulk_edit_lots():
+    if not is_admin():
+        flash("Unauthorized access.")
+        return redirect(url_for('login'))
+
+    lot_ids = request.form.getlist('lot_ids', type=int)
+    price = request.form.get('price_per_hour', type=float)
+    percent = request.form.get('price_percent', type=float)
+    if not lot_ids or (price is None and percent is None):
+        flash("Select lots and enter a new price or a percentage change.")
+        return redirect(url_for('view_parking_lots'))
+    if (price is not None and price <= 0) or (price is None and percent <= -100):
+        flash("Prices must stay above zero.")
+        return redirect(url_for('view_parking_lots'))
+
+    if price is not None:
+        new_price = price
+    else:
+        # Postgres only rounds numeric to a number of places, not double precision.
+        new_price = func.round(cast(ParkingLot.price_per_hour * (1 + percent / 100), db.Numeric), 2)
+    updated = db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id.in_(lot_ids))
+        .values(price_per_hour=new_price)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    catalog.touch()
+    db.session.commit()
+    flash(f"Updated the price of {updated} parking lots.")
+    return redirect(url_for('view_parking_lots'))
+
+
+@route('/user/reserve/<int:spot_id>', methods=['POST'])
 def reserve_spot(spot_id):
     user_id = session.get('user_id')
     if not user_id:
@@ -565,29 +859,155 @@ def reserve_spot(spot_id):
 
     spot = ParkingSpot.query.get_or_404(spot_id)
 
-    if spot.status != 'A':
-        flash("This spot is already occupied.")
+    reservation, error = parking.reserve(user_id, spot)
+    if error:
+        db.session.rollback()
+        flash(parking.MESSAGES[error])
+        if error == parking.ALREADY_ACTIVE:
+            return redirect(url_for('user_dashboard'))
         return redirect(url_for('view_spots', lot_id=spot.lot_id))
+    db.session.commit()
 
-    existing = Reservation.query.filter_by(user_id=user_id, leaving_timestamp=None).first()
-    if existing:
+    flash(f"Spot {spot.id} reserved successfully!")
+    return redirect(url_for('user_dashboard'))
+
+@route('/user/waitlist/<int:lot_id>', methods=['POST'])
+def join_waitlist(lot_id):
+    user_id = session.get('user_id')
+    if not user_id:
+        flash("Please login to join the waitlist.")
+        return redirect(url_for('login'))
+
+    ParkingLot.query.get_or_404(lot_id)
+    if Reservation.query.filter_by(user_id=user_id, leaving_timestamp=None).first():
         flash("You already have an active reservation.")
         return redirect(url_for('user_dashboard'))
 
-    
-    spot.status = 'O'
-    spot.lot.spots_filled += 1
-    reservation = Reservation(
-        user_id=user_id,
-        spot_id=spot.id,
-        price_per_hour=spot.lot.price_per_hour
-    )
-    db.session.add(reservation)
+    entry = waitlist.join(user_id, lot_id)
+    waitlist.notify(lot_id)
     db.session.commit()
+    flash(f"You are #{waitlist.position(entry)} on the waitlist. We will reserve a spot for you as soon as one frees up.")
+    return redirect(url_for('view_spots', lot_id=lot_id))
 
-    flash(f"Spot {spot.id} reserved successfully!")
+
+@route('/user/waitlist/<int:lot_id>/leave', methods=['POST'])
+def leave_waitlist(lot_id):
+    user_id = session.get('user_id')
+    if not user_id:
+        flash("Please login to continue.")
+        return redirect(url_for('login'))
+
+    if waitlist.leave(user_id, lot_id):
+        flash("You have left the waitlist.")
+    db.session.commit()
+    return redirect(url_for('view_spots', lot_id=lot_id))
+
+def parse_window(form):
+    try:
+        start = datetime.fromisoformat(form.get('start_time', ''))
+        end = datetime.fromisoformat(form.get('end_time', ''))
+    except ValueError:
+        return None
+    return (start, end) if start < end else None
+
+
+@route('/user/advance-booking', methods=['GET', 'POST'])
+def advance_booking():
+    user_id = session.get('user_id')
+    if not user_id:
+        flash("Please login to book ahead.")
+        return redirect(url_for('login'))
+
+    parking_lots = catalog.lots()
+    selected_lot_id = request.form.get('parking_lot_id', type=int)
+    window = None
+    free_spot_ids = []
+
+    if request.method == 'POST':
+        window = parse_window(request.form)
+        if not selected_lot_id or not window:
+            flash("Please choose a lot and a valid time window.")
+            return redirect(url_for('advance_booking'))
+        start, end = window
+        if start < datetime.utcnow():
+            flash("Advance reservations must start in the future.")
+            return redirect(url_for('advance_booking'))
+
+        spot_id = request.form.get('spot_id', type=int)
+        if spot_id:
+            spot = ParkingSpot.query.get(spot_id)
+            if not spot or spot.lot_id != selected_lot_id:
+                flash("Selected spot is not available.")
+                return redirect(url_for('advance_booking'))
+            if not schedule.book(user_id, spot.id, start, end, spot.lot.price_per_hour):
+                db.session.rollback()
+                flash("That spot was just booked for an overlapping time. Please pick another.")
+            else:
+                db.session.commit()
+                flash(f"Spot {spot.id} booked from {start:%d %b %H:%M} to {end:%d %b %H:%M}.")
+                return redirect(url_for('advance_booking'))
+
+        free_spot_ids = schedule.free_spots(selected_lot_id, start, end)
+
+    upcoming = AdvanceReservation.query.options(joinedload(AdvanceReservation.spot)) \
+        .filter(AdvanceReservation.user_id == user_id, AdvanceReservation.status == 'B',
+                AdvanceReservation.end_time > datetime.utcnow()) \
+        .order_by(AdvanceReservation.start_time).all()
+
+    return render_template('advance_booking.html', parking_lots=parking_lots, selected_lot_id=selected_lot_id,
+                           window=window, free_spot_ids=free_spot_ids, upcoming=upcoming, now=datetime.utcnow())
+
+
+@route('/user/advance-booking/<int:reservation_id>/cancel', methods=['POST'])
+def cancel_advance_booking(reservation_id):
+    user_id = session.get('user_id')
+    if not user_id:
+        flash("Please login to continue.")
+        return redirect(url_for('login'))
+
+    reservation = AdvanceReservation.query.filter_by(id=reservation_id, user_id=user_id, status='B').first()
+    if reservation:
+        schedule.close(reservation, 'C')
+        waitlist.notify(reservation.spot.lot_id)
+        db.session.commit()
+        flash("Advance reservation cancelled.")
+    return redirect(url_for('advance_booking'))
+
+
+@route('/user/advance-booking/<int:reservation_id>/check-in', methods=['POST'])
+def check_in_advance_booking(reservation_id):
+    user_id = session.get('user_id')
+    if not user_id:
+        flash("Please login to continue.")
+        return redirect(url_for('login'))
+
+    reservation = AdvanceReservation.query.filter_by(id=reservation_id, user_id=user_id).first_or_404()
+    if not reservation.can_check_in():
+        flash("This reservation is not open for check-in.")
+        return redirect(url_for('advance_booking'))
+
+    if Reservation.query.filter_by(user_id=user_id, leaving_timestamp=None).first():
+        flash("You already have an active reservation.")
+        return redirect(url_for('user_dashboard'))
+
+    lot_id = reservation.spot.lot_id
+    spot_id = claim_spot(spot_id=reservation.spot_id)
+    if spot_id is None:
+        # An earlier open-ended reservation is still on the booked spot; move
+        # the holder to another spot nobody else has booked for right now.
+        spot_id = claim_spot(lot_id=lot_id, exclude=schedule.held_now(lot_id) - {reservation.spot_id})
+    if spot_id is None:
+        db.session.rollback()
+        flash("Your spot is still occupied and the lot is full. Please try again shortly.")
+        return redirect(url_for('advance_booking'))
+
+    schedule.close(reservation, 'U')
+    db.session.add(Reservation(user_id=user_id, spot_id=spot_id, price_per_hour=reservation.price_per_hour))
+    db.session.commit()
+    flash(f"Checked in to spot {spot_id}.")
     return redirect(url_for('user_dashboard'))
-@app.route('/user/confirm/<int:spot_id>', methods=['POST'])
+
+@route('/user/confirm/<int:spot_id>', methods=['POST'])
 def confirm_parking(spot_id):
     user_id = session.get('user_id')
     if not user_id:
@@ -596,71 +1016,170 @@ def confirm_parking(spot_id):
 
     spot = ParkingSpot.query.get_or_404(spot_id)
 
-    reservation = Reservation.query.filter_by(
-        user_id=user_id,
-        spot_id=spot.id,
-        leaving_timestamp=None
-    ).first()
-
-    if not reservation:
-        flash("No active reservation found for this spot.")
+    reservation, error = parking.confirm(user_id, spot.id)
+    if error == parking.NOT_FOUND:
+        flash(parking.MESSAGES[error])
         return redirect(url_for('view_spots', lot_id=spot.lot_id))
 
-    if hasattr(reservation, 'has_parked') and reservation.has_parked:
-        flash("Parking already confirmed.")
+    if error:
+        flash(parking.MESSAGES[error])
     else:
-        reservation.has_parked = True
         db.session.commit()
         flash("Parking confirmed successfully.")
 
     return redirect(url_for('user_dashboard'))
 
-@app.route('/user/release/<int:spot_id>', methods=['POST'])
+@route('/user/release/<int:spot_id>', methods=['POST'])
 def release_spot(spot_id):
     user_id = session.get('user_id')
     if not user_id:
         flash("Please login to release the spot.")
         return redirect(url_for('login'))
 
-    reservation = Reservation.query.filter_by(user_id=user_id, spot_id=spot_id, leaving_timestamp=None).first()
-    if not reservation:
-        flash("No active reservation found for this spot.")
+    reservation, error = parking.release(user_id, spot_id)
+    if error:
+        flash(parking.MESSAGES[error])
         return redirect(url_for('user_dashboard'))
 
-    reservation.leaving_timestamp = datetime.utcnow()
-    reservation.has_parked = False  
-    reservation.spot.status = 'A'
-    reservation.spot.lot.spots_filled = max(0, reservation.spot.lot.spots_filled - 1)
-
     db.session.commit()
     flash("Spot released successfully.")
     return redirect(url_for('user_dashboard'))
 
-@app.route('/admin/records')
+RECORDS_PER_PAGE = 50
+
+
+def parse_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        ts, row_id = cursor.rsplit('~', 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except ValueError:
+        return None
+
+
+def keyset_page(query, ts_col, id_col, cursor):
+    # Newest-first keyset pagination on (timestamp, id) so deep pages cost the
+    # same as the first one.
+    position = parse_cursor(cursor)
+    if position:
+        ts, row_id = position
+        query = query.filter(or_(ts_col < ts, and_(ts_col == ts, id_col < row_id)))
+    rows = query.order_by(ts_col.desc(), id_col.desc()).limit(RECORDS_PER_PAGE + 1).all()
+
+    next_cursor = None
+    if len(rows) > RECORDS_PER_PAGE:
+        rows = rows[:RECORDS_PER_PAGE]
+        last = rows[-1]
+        next_cursor = f"{getattr(last, ts_col.key).isoformat()}~{last.id}"
+    return rows, next_cursor
+
+
+@route('/admin/records')
 def admin_records():
     if not is_admin():
         flash("Unauthorized access.")
         return redirect(url_for('login'))
 
-    bookings     = Booking.query.order_by(Booking.start_time.desc()).all()
-    reservations = Reservation.query.order_by(Reservation.parking_timestamp.desc()).all()
+    booking_query = Booking.query.options(
+        joinedload(Booking.user),
+        joinedload(Booking.parking_lot)
+    )
+    reservation_query = Reservation.query.options(
+        joinedload(Reservation.user),
+        joinedload(Reservation.spot).joinedload(ParkingSpot.lot)
+    )
 
-    total_bookings_rev     = sum(b.calculate_price() for b in bookings if b.end_time)
-    total_reservations_rev = sum(r.calculate_total_price() for r in reservations if r.leaving_timestamp)
-    total_revenue = round(total_bookings_rev + total_reservations_rev, 2)
+    bookings, next_bookings = keyset_page(
+        booking_query, Booking.start_time, Booking.id, request.args.get('bookings_after'))
+    reservations, next_reservations = keyset_page(
+        reservation_query, Reservation.parking_timestamp, Reservation.id, request.args.get('reservations_after'))
+
+    total_revenue = round(Booking.total_revenue() + Reservation.total_revenue(), 2)
 
     return render_template(
         'admin_records.html',
         bookings=bookings,
         reservations=reservations,
+        next_bookings=next_bookings,
+        next_reservations=next_reservations,
         total_revenue=total_revenue
     )
 
 
+@route('/admin/perf')
+def admin_perf():
+    if not is_admin():
+        flash("Unauthorized access.")
+        return redirect(url_for('login'))
+
+    endpoints, profiles = perf.snapshot()
+    return render_template('admin_perf.html', endpoints=sorted(endpoints.items()), profiles=profiles,
+                           n_plus_one_threshold=perf.N_PLUS_ONE_THRESHOLD)
+
+
+@route('/metrics')
+def metrics():
+    token = os.environ.get('METRICS_TOKEN')
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    elif not is_admin():
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+
+    cache = catalog.stats()
+    sweeps = expiry.stats()
+    audits = audit.stats()
+    body = perf.prometheus_text([
+        ('parking_catalog_cache_hits', 'Lot catalog cache hits', cache['hits']),
+        ('parking_catalog_cache_misses', 'Lot catalog cache misses', cache['misses']),
+        ('parking_expiry_runs', 'Reservation expiry sweeps run', sweeps['runs']),
+        ('parking_expiry_reclaimed', 'Spots reclaimed from unconfirmed reservations', sweeps['reclaimed_total']),
+        ('parking_expiry_last_reclaimed', 'Spots reclaimed by the last sweep', sweeps['last_reclaimed']),
+        ('parking_expiry_last_seconds', 'Duration of the last sweep', sweeps['last_seconds']),
+        ('parking_audit_drifted_lots', 'Lots whose spots_filled drifted at the last audit', audits['last_drifted']),
+        ('parking_audit_repaired', 'Lots repaired by the occupancy auditor', audits['repaired_total']),
+    ])
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+@route('/admin/export/<kind>.<fmt>')
+def export_records(kind, fmt):
+    if not is_admin():
+        flash("Unauthorized access.")
+        return redirect(url_for('login'))
+
+    if kind not in ('bookings', 'reservations') or fmt not in export.FORMATS:
+        flash("Unknown export.")
+        return redirect(url_for('admin_records'))
+    if fmt != 'csv' and export.pa is None:
+        flash("Parquet and Arrow exports need pyarrow installed on the server.")
+        return redirect(url_for('admin_records'))
+
+    try:
+        start_day = datetime.strptime(request.args['start'], '%Y-%m-%d') if request.args.get('start') else None
+        end_day = datetime.strptime(request.args['end'], '%Y-%m-%d') if request.args.get('end') else None
+    except ValueError:
+        flash("Dates must be in YYYY-MM-DD format.")
+        return redirect(url_for('admin_records'))
+    lot_id = request.args.get('lot_id', type=int)
+
+    body = export.stream(kind, fmt, start_day, end_day, lot_id)
+    return Response(
+        stream_with_context(body),
+        mimetype=export.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'}
+    )
+
+
 
 
 
 if __name__ == '__main__':
+    app = create_app()
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Only the reloader's serving child, not the process watching files.
+        start_workers(app)
     app.run(debug=True)
 
 
@@ -0,0 +1,224 @@
+"""Optional ASGI entry point for high-concurrency serving.
+
+    pip install "uvicorn[standard]" a2wsgi aiosqlite "sqlalchemy[asyncio]"
+    uvicorn asgi:application --workers 4
+
+The read-heavy pages (lot list, spot map, user history) and the occupancy
+stream run as coroutines on an async engine, so a slow query or an idle
+stream parks a coroutine instead of holding a worker thread. Every other
+route, the JSON API's spot map included, is the unchanged Flask app behind
+a WSGI adapter. Pages load their
+data through the same pages.py loaders as app.py, awaited here, and are
+then rendered by the app.py views inside Flask's usual request handling,
+so both halves look the same to clients.
+"""
+import asyncio
+import inspect
+import io
+import json
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import Response, abort, flash, g, redirect, request, session, url_for
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import occupancy
+import pages
+from app import create_app, start_workers, STREAM_KEEPALIVE_SECONDS
+from database import async_database_url, sqlite_pragmas
+from models import ParkingLot
+
+flask_app = create_app()
+
+engine = create_async_engine(async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI']),
+                             **flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+if engine.dialect.name == 'sqlite':
+    event.listen(engine.sync_engine, 'connect', sqlite_pragmas)
+sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+wsgi = WSGIMiddleware(flask_app)
+
+
+async def _load(loader):
+    """Drive a pages.py loader on the async engine."""
+    async with sessions() as s:
+        try:
+            step = next(loader)
+            while True:
+                if isinstance(step, pages.Cached):
+                    # The in-process indexes answer from memory once warm, but a
+                    # cold one loads through the sync session; keep that off the loop.
+                    result = await asyncio.to_thread(step.fn, *step.args)
+                else:
+                    result = await s.execute(step)
+                step = loader.send(result)
+        except StopIteration as done:
+            return done.value
+
+
+# Async views load a page's data and leave it in g, then return None so the
+# Flask view in app.py renders it; one may instead return a response itself.
+
+async def view_parking_lots():
+    g.page = await _load(pages.lots(max(request.args.get('page', 1, type=int), 1)))
+
+
+async def view_spots(lot_id):
+    if session.get('user_id'):
+        g.page = await _load(pages.spots(lot_id, session['user_id']))
+
+
+async def user_history():
+    if session.get('user_id'):
+        g.page = await _load(pages.history(session['user_id']))
+
+
+class _LoopQueue:
+    """Hands occupancy changes published by request threads to one event loop."""
+
+    def __init__(self, loop, maxsize=1000):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def put_nowait(self, message):
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Same as the sync stream: a stalled client only loses deltas.
+            pass
+
+
+async def occupancy_stream(lot_id):
+    if not session.get('user_id'):
+        flash("Please login to continue.")
+        return redirect(url_for('login'))
+
+    async with sessions() as s:
+        if await s.get(ParkingLot, lot_id) is None:
+            abort(404)
+    stored_version = select(func.coalesce(ParkingLot.spot_version, 0)).where(ParkingLot.id == lot_id)
+    # Subscribe before taking the snapshot so no commit falls in between.
+    updates = _LoopQueue(asyncio.get_running_loop())
+    occupancy.subscribe(lot_id, updates)
+    index = await asyncio.to_thread(occupancy.for_lot, lot_id)
+    snapshot = index.snapshot()
+
+    async def events():
+        seen = index.version
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(snapshot)}\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(updates.queue.get(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    async with sessions() as s:
+                        version = await s.scalar(stored_version)
+                    if version is not None and version > seen:
+                        yield f"data: {json.dumps({'reload': True})}\n\n"
+                        seen = version
+                    yield ": keepalive\n\n"
+                    continue
+                version = message.get('version')
+                if occupancy.missed(seen, version):
+                    message = {'reload': True}
+                seen = max(seen, version or 0)
+                yield f"data: {json.dumps(message)}\n\n"
+        finally:
+            occupancy.unsubscribe(lot_id, updates)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# Flask endpoint -> coroutine serving it. A view may still defer to the sync
+# route for requests it does not cover (full-text search stays on FTS5).
+ASYNC_VIEWS = {
+    'view_parking_lots': view_parking_lots,
+    'view_spots': view_spots,
+    'user_history': user_history,
+    'occupancy_stream': occupancy_stream,
+}
+SYNC_FALLBACK = {
+    'view_parking_lots': lambda: bool(request.args.get('q', '').strip()),
+}
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _send(response, send, receive):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.to_wsgi_list()],
+    })
+    body = response.response
+    if not inspect.isasyncgen(body):
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+        return
+
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        async for chunk in body:
+            if disconnected.done():
+                break
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        else:
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        await body.aclose()
+
+
+async def _dispatch(view, scope, receive, send, ctx):
+    # Flask's own full_dispatch_request(), with the async view awaited first.
+    try:
+        try:
+            rv = flask_app.preprocess_request()
+            if rv is None:
+                rv = await view(**request.view_args)
+            if rv is None:
+                rv = flask_app.dispatch_request()
+        except Exception as e:
+            rv = flask_app.handle_user_exception(e)
+        response = flask_app.finalize_request(rv)
+    except Exception as e:
+        response = flask_app.handle_exception(e)
+    finally:
+        # Templates are rendered; the stream body only needs the loop from here.
+        ctx.pop()
+    await _send(response, send, receive)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Once per server worker, after any fork.
+            start_workers(flask_app)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        ctx = flask_app.request_context(build_environ(scope, io.BytesIO()))
+        ctx.push()
+        view = ASYNC_VIEWS.get(request.endpoint)
+        fallback = SYNC_FALLBACK.get(request.endpoint)
+        if view is not None and not (fallback and fallback()):
+            return await _dispatch(view, scope, receive, send, ctx)
+        ctx.pop()
+    return await wsgi(scope, receive, send)
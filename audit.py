@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import case, func, select, update
+
+from models import db, ParkingLot, ParkingSpot
+
+# parking_lot.spots_filled is a denormalised counter kept in step by every
+# allocation path. The auditor recomputes it for all lots from parking_spot
+# with one grouped query and can rewrite the drifted lots in one UPDATE. It
+# runs from `flask audit-occupancy` and, optionally, on a background timer.
+
+AUDIT_INTERVAL_SECONDS = int(os.environ.get('AUDIT_INTERVAL_SECONDS', 3600))
+AUDIT_REPAIR = os.environ.get('AUDIT_REPAIR', '0') == '1'
+
+logger = logging.getLogger(__name__)
+
+Drift = namedtuple('Drift', 'lot_id prime_location_name spots_filled actual_filled')
+
+_lock = threading.Lock()
+_stats = {'runs': 0, 'last_drifted': 0, 'repaired_total': 0, 'last_seconds': 0.0, 'last_run_at': None}
+_auditor = None
+
+
+def _occupied_count():
+    return func.coalesce(func.sum(case((ParkingSpot.status == 'O', 1), else_=0)), 0)
+
+
+def find_drift():
+    """Lots whose spots_filled disagrees with their occupied spots, by lot id."""
+    occupied = _occupied_count()
+    rows = db.session.query(
+        ParkingLot.id, ParkingLot.prime_location_name, ParkingLot.spots_filled, occupied
+    ).outerjoin(ParkingSpot, ParkingSpot.lot_id == ParkingLot.id) \
+        .group_by(ParkingLot.id, ParkingLot.prime_location_name, ParkingLot.spots_filled) \
+        .having(ParkingLot.spots_filled != occupied) \
+        .order_by(ParkingLot.id).all()
+    return [Drift(*row) for row in rows]
+
+
+def repair(lot_ids):
+    """Reset spots_filled from parking_spot for ``lot_ids``. Returns the rows changed."""
+    if not lot_ids:
+        return 0
+    occupied = select(func.count(ParkingSpot.id)) \
+        .where(ParkingSpot.lot_id == ParkingLot.id, ParkingSpot.status == 'O') \
+        .scalar_subquery()
+    return db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id.in_(lot_ids), ParkingLot.spots_filled != occupied)
+        .values(spots_filled=occupied)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def run(fix=False):
+    """Audit every lot, repairing the drift when ``fix`` is set. Returns the drift found."""
+    started = time.perf_counter()
+    drift = find_drift()
+    repaired = 0
+    if fix and drift:
+        repaired = repair([row.lot_id for row in drift])
+        db.session.commit()
+    elapsed = time.perf_counter() - started
+
+    with _lock:
+        _stats['runs'] += 1
+        _stats['last_drifted'] = len(drift)
+        _stats['repaired_total'] += repaired
+        _stats['last_seconds'] = elapsed
+        _stats['last_run_at'] = datetime.utcnow()
+    for row in drift:
+        logger.warning("Lot %s (%s): spots_filled=%s but %s spots are occupied%s",
+                       row.lot_id, row.prime_location_name, row.spots_filled, row.actual_filled,
+                       ' - repaired' if fix else '')
+    return drift
+
+
+def stats():
+    with _lock:
+        return dict(_stats)
+
+
+class Auditor(threading.Thread):
+
+    def __init__(self, app):
+        super().__init__(name='occupancy-auditor', daemon=True)
+        self.app = app
+
+    def run(self):
+        while True:
+            time.sleep(AUDIT_INTERVAL_SECONDS)
+            with self.app.app_context():
+                try:
+                    run(fix=AUDIT_REPAIR)
+                except Exception:
+                    logger.exception("Occupancy audit failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+def start(app):
+    global _auditor
+    if os.environ.get('AUDIT_SCHEDULER', '1') == '0' or _auditor is not None:
+        return
+    _auditor = Auditor(app)
+    _auditor.start()
@@ -0,0 +1,100 @@
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from flask import session
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from models import db, PASSWORD_HASH_METHOD, User
+
+# Password hashing is deliberately slow. Checks run on a small dedicated pool
+# (hashlib releases the GIL while hashing, so they do run in parallel) with a
+# bound on how many may queue, so a login spike is refused early instead of
+# piling up behind the hasher. After login the principal (id, admin flag,
+# name) lives in the signed session cookie, so pages need no User lookup.
+
+HASH_WORKERS = int(os.environ.get('AUTH_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+HASH_QUEUE_LIMIT = int(os.environ.get('AUTH_HASH_QUEUE_LIMIT', 64))
+HASH_TIMEOUT_SECONDS = float(os.environ.get('AUTH_HASH_TIMEOUT_SECONDS', 10))
+
+Principal = namedtuple('Principal', 'id is_admin name')
+
+_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='auth-hash')
+_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+_dummy_hash = None
+
+
+class AuthBusy(Exception):
+    """Too many password checks are already queued, or one waited too long."""
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise AuthBusy()
+    future = _pool.submit(fn, *args)
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT_SECONDS)
+    except FutureTimeout:
+        # Still queued behind the hasher: drop it rather than hash for nobody.
+        future.cancel()
+        raise AuthBusy()
+
+
+def _check_unknown_user(password):
+    # Spend the same time as a real check so usernames cannot be probed.
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = generate_password_hash('', method=PASSWORD_HASH_METHOD)
+    _run(check_password_hash, _dummy_hash, password)
+
+
+def authenticate(username, password):
+    """Return the user for valid credentials, else None. Raises AuthBusy when saturated.
+
+    A valid password stored with outdated hash parameters is rehashed and
+    committed on the way.
+    """
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        _check_unknown_user(password)
+        return None
+    if not _run(check_password_hash, user.passhash, password):
+        return None
+    if user.needs_rehash():
+        user.passhash = _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+        db.session.commit()
+    return user
+
+
+def ensure_admin(username, password):
+    """Create an admin account unless ``username`` is taken. Returns whether it was created."""
+    if User.query.filter_by(username=username).first():
+        return False
+    admin = User(username=username, name='Admin User', is_admin=True)
+    admin.password = password
+    db.session.add(admin)
+    db.session.commit()
+    return True
+
+
+def login_user(user):
+    session['user_id'] = user.id
+    session['is_admin'] = bool(user.is_admin)
+    session['name'] = user.name
+
+
+def current_principal():
+    """The logged-in user as stored in the session, or None."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+    name = session.get('name')
+    if name is None:
+        # Session from before the principal was cached; fill it in once.
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        session['name'] = name = user.name
+    return Principal(user_id, session.get('is_admin') is True, name)
@@ -0,0 +1,569 @@
+"""Benchmark the booking lifecycle against a freshly seeded local database.
+
+    python bench.py --lots 10 --spots 50 --users 200 --iterations 500 --concurrency 8
+    python bench.py --output after.json --baseline before.json
+
+Each iteration is one virtual user going register -> login -> view_spots ->
+reserve_spot -> confirm_parking -> release_spot through the Flask test
+client; every few iterations an admin reads admin_records and admin_reports.
+Per-route p50/p95/p99 latency and throughput are printed and written as JSON
+so runs from different commits can be compared.
+
+    python bench.py --scenario login --iterations 400 --concurrency 8
+
+The login scenario signs pre-seeded users in and loads their dashboard, to
+measure password-check throughput of a single worker process.
+
+    python bench.py --scenario capacity --streams 200 --concurrency 50 --iterations 2000
+
+The capacity scenario serves the seeded database over real sockets: with
+the thread-per-connection server app.py uses, under a gunicorn gthread
+worker with a bounded pool of --threads threads, then under uvicorn via
+asgi.py (servers that are not installed are skipped).
+Against each it holds --streams occupancy streams open and meanwhile loads
+view_spots --iterations times from --concurrency connections, reporting
+how many streams were held, failed requests and page latency.
+
+    python bench.py --scenario writes --processes 4 --iterations 800
+
+The writes scenario runs --processes worker processes against the same
+database file, each with its own app, reserving and releasing random spots
+for --iterations reservations in total. It reports write latency, total
+reservations per second across processes, spots lost to another writer
+and requests that failed (e.g. on a lock timeout).
+
+    python bench.py --scenario billing --rows 100000 --iterations 5
+
+The billing scenario inserts --rows closed reservations and totals them
+--iterations times each way: loading and billing every row, and through
+billing.py's column query and vectorised total (after checking both agree).
+
+    python bench.py --scenario provision --spots 10000 --iterations 5
+
+The provision scenario has an admin create a lot of --spots spots, grow it
+by a tenth and shrink it back, --iterations times, and reports spots
+written per second for each step.
+
+    python bench.py --scenario startup --iterations 20
+
+The startup scenario launches fresh interpreters against the seeded
+database and times importing app.py, create_app() and the first request.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+SEED_PASSWORD = 'bench'
+CAPACITY_TIMEOUT_SECONDS = 30
+# A page slower than this counts as a failed request; a starved pool fails fast.
+CAPACITY_PAGE_TIMEOUT_SECONDS = 5
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest rank: the smallest value with at least pct% of samples at or below it.
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Recorder:
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.conflicts = 0
+        self.lock = threading.Lock()
+
+    def call(self, route, fn, *args, **kwargs):
+        started = time.perf_counter()
+        response = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.samples[route].append(elapsed)
+        if response.status_code >= 500:
+            raise RuntimeError(f"{route} returned {response.status_code}")
+        return response
+
+    def summary(self, wall_seconds):
+        routes = {}
+        for route, values in sorted(self.samples.items()):
+            if not values:
+                # e.g. a starved server that answered no page in time
+                continue
+            values = sorted(values)
+            routes[route] = {
+                'count': len(values),
+                'mean_ms': sum(values) / len(values) * 1000,
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'throughput_rps': len(values) / wall_seconds,
+            }
+        return routes
+
+
+def seed(db, models, lots, spots, users):
+    from werkzeug.security import generate_password_hash
+    from allocation import provision_spots
+
+    passhash = generate_password_hash(SEED_PASSWORD, method=models.PASSWORD_HASH_METHOD)
+    db.session.execute(models.User.__table__.insert(), [
+        {'username': f'seed{i}', 'passhash': passhash, 'name': f'seed{i}@example.com', 'is_admin': False,
+         'created_at': datetime.utcnow()}
+        for i in range(users)
+    ])
+    for i in range(lots):
+        lot = models.ParkingLot(prime_location_name=f'Bench Lot {i}', price_per_hour=random.choice([20, 30, 40]),
+                                address=f'{i} Bench Road', pin_code=str(600000 + i), max_spots=spots)
+        db.session.add(lot)
+        db.session.flush()
+        provision_spots(lot.id, spots)
+    db.session.commit()
+
+
+def lifecycle(app, recorder, n, lot_ids):
+    client = app.test_client()
+    username = f'bench{n}-{random.randrange(1 << 30)}'
+    recorder.call('register', client.post, '/user/register',
+                  data={'username': username, 'email': f'{username}@example.com', 'password': SEED_PASSWORD})
+    expect(client, 'Registered successfully', f"register {username}")
+    response = recorder.call('login', client.post, '/user/login',
+                             data={'username': username, 'password': SEED_PASSWORD})
+    if 'dashboard' not in response.headers.get('Location', ''):
+        raise RuntimeError(f"login for {username} failed")
+
+    lot_id = random.choice(lot_ids)
+    page = recorder.call('view_spots', client.get, f'/user/view_spots/{lot_id}')
+    free = re.findall(rb'/user/reserve/(\d+)', page.data)
+    if not free:
+        return
+    spot_id = int(random.choice(free))
+    recorder.call('reserve_spot', client.post, f'/user/reserve/{spot_id}')
+    if 'reserved successfully' not in ' '.join(flashes(client)):
+        # Another virtual user took the spot since the page was read.
+        with recorder.lock:
+            recorder.conflicts += 1
+        return
+    recorder.call('confirm_parking', client.post, f'/user/confirm/{spot_id}')
+    expect(client, 'confirmed successfully', f"confirm spot {spot_id}")
+    recorder.call('release_spot', client.post, f'/user/release/{spot_id}')
+    expect(client, 'released successfully', f"release spot {spot_id}")
+
+
+def flashes(client):
+    """Messages flashed by the client's last requests."""
+    with client.session_transaction() as sess:
+        return [message for _, message in sess.pop('_flashes', [])]
+
+
+def expect(client, text, step):
+    messages = flashes(client)
+    if not any(text in message for message in messages):
+        raise RuntimeError(f"{step} failed: {messages}")
+
+
+def _write_worker(worker, processes, iterations, user_ids, spot_ids, seed_value):
+    # Runs in a fresh interpreter; DATABASE_URL is inherited from the parent.
+    from app import create_app
+
+    app = create_app({'TESTING': True})
+    recorder = Recorder()
+    rng = random.Random(seed_value + worker)
+    users = user_ids[worker::processes]
+    counts = {'reserved': 0, 'conflicts': 0, 'failed': 0}
+    for n in range(worker, iterations, processes):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = users[n // processes % len(users)]
+        spot_id = rng.choice(spot_ids)
+        try:
+            recorder.call('reserve', client.post, f'/user/reserve/{spot_id}')
+            if 'reserved successfully' not in ' '.join(flashes(client)):
+                counts['conflicts'] += 1
+                continue
+            recorder.call('release', client.post, f'/user/release/{spot_id}')
+            if 'released successfully' not in ' '.join(flashes(client)):
+                raise RuntimeError(f"release of spot {spot_id} failed")
+        except RuntimeError:
+            counts['failed'] += 1
+            continue
+        counts['reserved'] += 1
+    return dict(recorder.samples), counts
+
+
+def writes(recorder, args, user_ids, spot_ids):
+    """Reserve and release from --processes processes at once; returns the summed counts."""
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.processes) as pool:
+        results = pool.starmap(_write_worker, [
+            (worker, args.processes, args.iterations, user_ids, spot_ids, args.seed)
+            for worker in range(args.processes)
+        ])
+    totals = defaultdict(int)
+    for samples, counts in results:
+        for route, values in samples.items():
+            recorder.samples[route].extend(values)
+        for name, value in counts.items():
+            totals[name] += value
+    return dict(totals)
+
+
+def login_flow(app, recorder, n, users):
+    client = app.test_client()
+    response = recorder.call('login', client.post, '/user/login',
+                             data={'username': f'seed{n % users}', 'password': SEED_PASSWORD})
+    if response.status_code != 302 or 'dashboard' not in response.headers.get('Location', ''):
+        raise RuntimeError(f"login for seed{n % users} failed")
+    recorder.call('user_dashboard', client.get, '/user/dashboard')
+
+
+def admin_reads(app, recorder):
+    client = app.test_client()
+    recorder.call('admin_login', client.post, '/admin/login', data={'username': 'admin', 'password': 'admin'})
+    recorder.call('admin_records', client.get, '/admin/records')
+    recorder.call('admin_reports', client.get, '/admin/reports')
+
+
+def billing_totals(app, recorder, rows, iterations):
+    """Time totalling ``rows`` closed reservations row by row and through billing.py."""
+    import billing
+    from models import db, ParkingSpot, Reservation, User
+
+    with app.app_context():
+        user_id = db.session.query(User.id).filter_by(is_admin=False).limit(1).scalar()
+        spot_id = db.session.query(ParkingSpot.id).limit(1).scalar()
+        starts = [datetime(2026, 1, 1) + timedelta(seconds=random.randrange(86400 * 365)) for _ in range(rows)]
+        db.session.execute(Reservation.__table__.insert(), [
+            {'user_id': user_id, 'spot_id': spot_id, 'parking_timestamp': start,
+             'leaving_timestamp': start + timedelta(seconds=random.randrange(60, 86400)),
+             'price_per_hour': random.choice([20, 30, 40, 33.33])}
+            for start in starts
+        ])
+        db.session.commit()
+
+        def per_row():
+            # What the views did before billing.py: load every row, bill each one.
+            closed = Reservation.query.filter(Reservation.leaving_timestamp.isnot(None))
+            return round(sum(reservation.calculate_total_price() for reservation in closed), 2)
+
+        def vectorised():
+            return billing.total(*billing.closed_reservation_columns())
+
+        if per_row() != vectorised():
+            raise RuntimeError("billing.py's total differs from the per-row one")
+        for route, fn in (('per-row total', per_row), ('vectorised total', vectorised)):
+            for _ in range(iterations):
+                db.session.expunge_all()
+                started = time.perf_counter()
+                fn()
+                recorder.samples[route].append(time.perf_counter() - started)
+
+
+def provision(app, recorder, spots):
+    """Create a lot of ``spots`` spots, grow it by a tenth, then shrink it back."""
+    client = app.test_client()
+    client.post('/admin/login', data={'username': 'admin', 'password': 'admin'})
+    name = f'Provision {random.randrange(1 << 30)}'
+    form = {'prime_location_name': name, 'price_per_hour': 30, 'address': '1 Bench Road', 'pin_code': '600000'}
+    recorder.call('create_parking', client.post, '/admin/create-parking', data={**form, 'max_spots': spots})
+    with app.app_context():
+        from models import ParkingLot
+        lot_id = ParkingLot.query.filter_by(prime_location_name=name).one().id
+    for route, size in (('grow_lot', spots + spots // 10), ('shrink_lot', spots)):
+        response = recorder.call(route, client.post, f'/admin/edit-parking/{lot_id}', data={**form, 'max_spots': size})
+        if 'view-parking' not in response.headers.get('Location', ''):
+            raise RuntimeError(f"{route} to {size} spots was refused")
+
+
+# Server name -> (module it needs, command line for a port and pool size).
+CAPACITY_SERVERS = {
+    'wsgi': (None, lambda port, threads: [
+        sys.executable, '-c', f'from app import create_app; create_app().run(port={port}, threaded=True)']),
+    'gthread': ('gunicorn', lambda port, threads: [
+        sys.executable, '-m', 'gunicorn', '--worker-class', 'gthread', '--workers', '1', '--threads', str(threads),
+        '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:serve()']),
+    'asgi': ('uvicorn', lambda port, threads: [
+        sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port), '--log-level', 'warning']),
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process):
+    deadline = time.monotonic() + CAPACITY_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not listen on port {port}")
+
+
+async def _get(port, path, cookie, read_body=True):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nCookie: session={cookie}\r\n'
+                 f'Connection: close\r\n\r\n'.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    if not read_body:
+        return status, writer
+    await reader.read()
+    writer.close()
+    return status, None
+
+
+async def _capacity_run(port, cookie, lot_ids, streams, concurrency, iterations):
+    opened = await asyncio.gather(*[
+        asyncio.wait_for(_get(port, f'/lots/{lot_ids[n % len(lot_ids)]}/occupancy/stream', cookie, False),
+                         CAPACITY_TIMEOUT_SECONDS)
+        for n in range(streams)
+    ], return_exceptions=True)
+    writers = [result[1] for result in opened if not isinstance(result, BaseException)]
+    held = sum(1 for result in opened if not isinstance(result, BaseException) and result[0] == 200)
+
+    latencies = []
+    errors = 0
+    pending = iter(range(iterations))
+
+    async def client():
+        nonlocal errors
+        for n in pending:
+            started = time.perf_counter()
+            try:
+                status, _ = await asyncio.wait_for(
+                    _get(port, f'/user/view_spots/{lot_ids[n % len(lot_ids)]}', cookie), CAPACITY_PAGE_TIMEOUT_SECONDS)
+            except (OSError, IndexError, ValueError, asyncio.TimeoutError):
+                errors += 1
+                continue
+            if status != 200:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    wall = time.perf_counter() - started
+    for writer in writers:
+        writer.close()
+    return held, errors, latencies, wall
+
+
+def capacity(app, user_id, lot_ids, args):
+    """Run the capacity scenario against each server; returns (routes, per-server counts)."""
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'user_id': user_id})
+    env = dict(os.environ, WAITLIST_SCHEDULER='0', EXPIRY_SWEEPER='0', AUDIT_SCHEDULER='0')
+    routes, servers = {}, {}
+    for name, (module, command) in CAPACITY_SERVERS.items():
+        if module and importlib.util.find_spec(module) is None:
+            print(f"{name}: skipped, {module} is not installed")
+            continue
+        port = _free_port()
+        process = subprocess.Popen(command(port, args.threads), cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_for_port(port, process)
+            held, errors, latencies, wall = asyncio.run(
+                _capacity_run(port, cookie, lot_ids, args.streams, args.concurrency, args.iterations))
+        finally:
+            process.terminate()
+            process.wait()
+        recorder = Recorder()
+        recorder.samples[f'{name} view_spots'] = latencies
+        routes.update(recorder.summary(wall))
+        servers[name] = {'streams_requested': args.streams, 'streams_held': held, 'errors': errors}
+    return routes, servers
+
+
+STARTUP_PROBE = """
+import time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+app.test_client().get('/user/login')
+print(imported - started, created - imported, time.perf_counter() - created)
+"""
+
+
+def startup(recorder, iterations):
+    """Time cold worker boots, one fresh interpreter per iteration."""
+    for _ in range(iterations):
+        started = time.perf_counter()
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_PROBE],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        recorder.samples['process'].append(time.perf_counter() - started)
+        for stage, seconds in zip(('import app', 'create_app', 'first request'), output.split()):
+            recorder.samples[stage].append(float(seconds))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(routes, baseline=None):
+    print(f"{'route':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+          + (f"{'p95 vs base':>14}" if baseline else ''))
+    for route, stats in routes.items():
+        line = (f"{route:<18}{stats['count']:>7}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+                f"{stats['p99_ms']:>10.2f}{stats['throughput_rps']:>10.1f}")
+        base = (baseline or {}).get(route)
+        if base and base['p95_ms']:
+            line += f"{(stats['p95_ms'] / base['p95_ms'] - 1) * 100:>+13.1f}%"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', default='lifecycle',
+                        choices=['lifecycle', 'login', 'capacity', 'startup', 'provision', 'writes', 'billing'])
+    parser.add_argument('--lots', type=int, default=10)
+    parser.add_argument('--spots', type=int, default=50, help='spots per lot')
+    parser.add_argument('--users', type=int, default=200, help='pre-seeded users')
+    parser.add_argument('--iterations', type=int, default=200, help='virtual user lifecycles to run')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--streams', type=int, default=200, help='occupancy streams held open (capacity)')
+    parser.add_argument('--rows', type=int, default=100000, help='reservations to total (billing)')
+    parser.add_argument('--processes', type=int, default=4, help='writer processes (writes)')
+    parser.add_argument('--threads', type=int, default=16, help='request threads of the gthread worker (capacity)')
+    parser.add_argument('--admin-every', type=int, default=20, help='admin read pass every N iterations')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='bench-results.json')
+    parser.add_argument('--baseline', help='earlier results JSON to compare against')
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory(prefix='parking-bench-') as workdir:
+        return run(args, workdir)
+
+
+def run(args, workdir):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from app import create_app, start_workers
+    from models import db
+    import auth
+    import models
+    import schema
+
+    app = create_app({'TESTING': True})
+    with app.app_context():
+        schema.init_db()
+        auth.ensure_admin('admin', 'admin')
+        seed(db, models, args.lots, args.spots, args.users)
+        lot_ids = [lot.id for lot in models.ParkingLot.query.all()]
+        first_user_id = models.User.query.filter_by(username='seed0').first().id
+        user_ids = [user_id for user_id, in db.session.query(models.User.id).filter_by(is_admin=False)]
+        spot_ids = [spot_id for spot_id, in db.session.query(models.ParkingSpot.id)]
+    start_workers(app)
+
+    servers = None
+    started = time.perf_counter()
+    if args.scenario == 'capacity':
+        routes, servers = capacity(app, first_user_id, lot_ids, args)
+        wall = time.perf_counter() - started
+    elif args.scenario == 'startup':
+        recorder = Recorder()
+        startup(recorder, args.iterations)
+        wall = time.perf_counter() - started
+        routes = recorder.summary(wall)
+    elif args.scenario == 'writes':
+        recorder = Recorder()
+        counts = writes(recorder, args, user_ids, spot_ids)
+        wall = time.perf_counter() - started
+        routes = recorder.summary(wall)
+        print(f"{args.processes} processes: {counts['reserved']} reservations "
+              f"({counts['reserved'] / wall:.1f}/s), {counts['conflicts']} conflicts, {counts['failed']} failed")
+    elif args.scenario == 'billing':
+        recorder = Recorder()
+        billing_totals(app, recorder, args.rows, args.iterations)
+        wall = time.perf_counter() - started
+        routes = recorder.summary(wall)
+    elif args.scenario == 'provision':
+        recorder = Recorder()
+        for _ in range(args.iterations):
+            provision(app, recorder, args.spots)
+        wall = time.perf_counter() - started
+        routes = recorder.summary(wall)
+        for route, written in (('create_parking', args.spots), ('grow_lot', args.spots // 10),
+                               ('shrink_lot', args.spots // 10)):
+            print(f"{route}: {written / (routes[route]['mean_ms'] / 1000):.0f} spots/s")
+    else:
+        recorder = Recorder()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            if args.scenario == 'login':
+                futures = [pool.submit(login_flow, app, recorder, n, args.users) for n in range(args.iterations)]
+            else:
+                futures = [pool.submit(lifecycle, app, recorder, n, lot_ids) for n in range(args.iterations)]
+                futures += [pool.submit(admin_reads, app, recorder)
+                            for _ in range(0, args.iterations, max(1, args.admin_every))]
+            for future in futures:
+                future.result()
+        wall = time.perf_counter() - started
+        routes = recorder.summary(wall)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'params': vars(args),
+            'wall_seconds': wall,
+            'requests': sum(stats['count'] for stats in routes.values()),
+        },
+        'routes': routes,
+    }
+    if args.scenario == 'lifecycle':
+        results['meta']['conflicts'] = recorder.conflicts
+    if servers:
+        results['servers'] = servers
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)['routes']
+    print_table(routes, baseline)
+    for name, counts in (servers or {}).items():
+        print(f"{name}: held {counts['streams_held']}/{counts['streams_requested']} streams, "
+              f"{counts['errors']} failed requests")
+    print(f"\n{results['meta']['requests']} requests in {wall:.2f}s "
+          f"({results['meta']['requests'] / wall:.1f} req/s overall)")
+    if 'conflicts' in results['meta']:
+        print(f"{results['meta']['conflicts']} reservations lost to another user")
+
+    with open(args.output, 'w') as fh:
+        json.dump(results, fh, indent=2)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
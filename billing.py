@@ -0,0 +1,99 @@
+import math
+
+from sqlalchemy import cast, select
+
+from models import db, charge, Booking, ParkingLot, Reservation
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; fall back to the per-row billing path.
+    np = None
+
+# Batch version of Reservation.calculate_total_price / Booking.calculate_price.
+# Inputs are parallel columns (start, end, rate[, amount]) such as one SELECT
+# returns; results match the per-row methods exactly. A non-null amount is a
+# charge the pricing engine already fixed and is used as is.
+
+_MICROSECONDS_PER_SECOND = 1_000_000
+
+
+def _column(column):
+    # Timestamps come back as ISO text, which NumPy parses far faster than
+    # it converts datetime objects.
+    return cast(column, db.String) if np is not None else column
+
+
+def columns(result, width):
+    """Transpose a result of ``width``-column rows into parallel columns."""
+    rows = result.all()
+    if not rows:
+        return ([],) * width
+    return tuple(zip(*rows))
+
+
+def closed_reservations(*criteria):
+    """SELECT of (start, end, rate, amount) for finished reservations matching ``criteria``."""
+    return select(
+        _column(Reservation.parking_timestamp), _column(Reservation.leaving_timestamp), Reservation.price_per_hour,
+        Reservation.amount
+    ).where(Reservation.leaving_timestamp.isnot(None), *criteria)
+
+
+def closed_bookings(*criteria):
+    """SELECT of (start, end, rate) for finished lot bookings matching ``criteria``."""
+    return select(
+        _column(Booking.start_time), _column(Booking.end_time), ParkingLot.price_per_hour
+    ).join(ParkingLot, ParkingLot.id == Booking.parking_lot_id) \
+        .where(Booking.end_time.isnot(None), *criteria)
+
+
+def closed_reservation_columns(*criteria):
+    """(starts, ends, rates, amounts) of finished reservations matching ``criteria``."""
+    return columns(db.session.execute(closed_reservations(*criteria)), 4)
+
+
+def closed_booking_columns(*criteria):
+    """(starts, ends, rates) of finished lot bookings matching ``criteria``."""
+    return columns(db.session.execute(closed_bookings(*criteria)), 3)
+
+
+def _as_datetime64(values):
+    return np.asarray(values, dtype='datetime64[us]')
+
+
+def billed_minutes(starts, ends):
+    """Ceil-minute durations, as math.ceil(delta.total_seconds() / 60)."""
+    if np is None:
+        return [math.ceil((end - start).total_seconds() / 60) for start, end in zip(starts, ends)]
+    elapsed = (_as_datetime64(ends) - _as_datetime64(starts)).astype(np.int64)
+    return np.ceil(elapsed / _MICROSECONDS_PER_SECOND / 60).astype(np.int64)
+
+
+def charges(starts, ends, rates, amounts=None):
+    """Per-row charges rounded to paise, identical to models.charge() unless an amount is fixed."""
+    if np is None:
+        if amounts is None:
+            amounts = [None] * len(rates)
+        return [charge(start, end, rate) if amount is None else amount
+                for start, end, rate, amount in zip(starts, ends, rates, amounts)]
+    rates = np.asarray(rates, dtype=np.float64)
+    cost = (rates / 60) * billed_minutes(starts, ends)
+    rounded = np.round(cost, 2)
+    # np.round scales by 100 before rounding, which can land on the other side
+    # of a half-paisa tie than Python's correctly rounded round(); redo those
+    # few borderline rows the exact way.
+    scaled = cost * 100
+    borderline = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for i in borderline:
+        rounded[i] = round(float(cost[i]), 2)
+    if amounts is not None and len(amounts):
+        fixed = np.asarray([np.nan if amount is None else amount for amount in amounts], dtype=np.float64)
+        rounded = np.where(np.isnan(fixed), rounded, fixed)
+    return rounded
+
+
+def total(starts, ends, rates, amounts=None):
+    """Sum of charges(), rounded to paise."""
+    if np is None:
+        return round(sum(charges(starts, ends, rates, amounts)), 2)
+    return round(float(np.sum(charges(starts, ends, rates, amounts))), 2)
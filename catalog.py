@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, ParkingLot
+
+# Lot metadata changes rarely but is listed on most logged-in pages. Entries
+# are keyed by a catalog version that create/edit/delete_parking bump after
+# commit; the TTL bounds how long another worker's edits can go unseen.
+
+CACHE_TTL_SECONDS = 30
+CACHE_SIZE = 128
+
+_DIRTY_KEY = 'catalog_dirty'
+
+LotSummary = namedtuple('LotSummary', 'id prime_location_name price_per_hour address pin_code max_spots')
+
+
+class TTLCache:
+    """Small thread-safe LRU whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = TTLCache(CACHE_SIZE, CACHE_TTL_SECONDS)
+_version = 0
+_version_lock = threading.Lock()
+
+
+def version():
+    return _version
+
+
+def lots():
+    """All lots as immutable summaries, ordered by id."""
+    key = ('lots', _version)
+    cached = _cache.get(key)
+    if cached is None:
+        rows = db.session.query(
+            ParkingLot.id, ParkingLot.prime_location_name, ParkingLot.price_per_hour,
+            ParkingLot.address, ParkingLot.pin_code, ParkingLot.max_spots
+        ).order_by(ParkingLot.id).all()
+        cached = tuple(LotSummary(*row) for row in rows)
+        _cache.put(key, cached)
+    return cached
+
+
+def stats():
+    return dict(_cache.stats(), version=_version)
+
+
+def touch():
+    """Invalidate the catalog once the current transaction commits."""
+    db.session.info[_DIRTY_KEY] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_version(session):
+    global _version
+    if session.info.pop(_DIRTY_KEY, False):
+        with _version_lock:
+            _version += 1
+        _cache.clear()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_touch(session):
+    session.info.pop(_DIRTY_KEY, None)
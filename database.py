@@ -0,0 +1,61 @@
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+DEFAULT_DATABASE_URL = 'sqlite:///parking.db'
+
+# Drivers the ASGI entry point uses for the same database.
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+def database_url():
+    url = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL)
+    # Heroku-style URLs still use the scheme SQLAlchemy dropped in 1.4.
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def async_database_url(url):
+    """``url`` with its driver swapped for an asyncio one; ASYNC_DATABASE_URL overrides it."""
+    if 'ASYNC_DATABASE_URL' in os.environ:
+        return make_url(os.environ['ASYNC_DATABASE_URL'])
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def engine_options(url):
+    options = {'pool_pre_ping': True}
+    if 'DB_POOL_SIZE' in os.environ:
+        options['pool_size'] = int(os.environ['DB_POOL_SIZE'])
+    if 'DB_MAX_OVERFLOW' in os.environ:
+        options['max_overflow'] = int(os.environ['DB_MAX_OVERFLOW'])
+    if 'DB_POOL_RECYCLE' in os.environ:
+        options['pool_recycle'] = int(os.environ['DB_POOL_RECYCLE'])
+    return options
+
+
+def configure_database(app):
+    url = database_url()
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        sqlite_pragmas(dbapi_connection, connection_record)
+
+
+def sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune a new SQLite connection; also registered on the aiosqlite engine."""
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers carry on while one worker writes; NORMAL sync is safe
+    # under WAL and skips an fsync per commit.
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+    cursor.execute(f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))}")
+    cursor.close()
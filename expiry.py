@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, update
+
+import occupancy
+import rollups
+import waitlist
+from models import db, ParkingLot, ParkingSpot, Reservation
+
+# A reservation that is never confirmed holds its spot until someone notices.
+# A background sweeper closes reservations left unconfirmed past the grace
+# period, in batches: each batch is one UPDATE on reservation, one on
+# parking_spot and one on parking_lot, committed on its own. No-shows are
+# closed at their start time, so they are never billed.
+
+GRACE_MINUTES = int(os.environ.get('RESERVATION_GRACE_MINUTES', 30))
+SWEEP_INTERVAL_SECONDS = int(os.environ.get('EXPIRY_SWEEP_SECONDS', 60))
+EXPIRY_BATCH = int(os.environ.get('EXPIRY_BATCH', 500))
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_stats = {'runs': 0, 'reclaimed_total': 0, 'last_reclaimed': 0, 'last_seconds': 0.0, 'last_run_at': None}
+_sweeper = None
+
+
+def _expire_batch(cutoff):
+    candidates = db.session.query(Reservation.id, ParkingSpot.lot_id) \
+        .join(ParkingSpot, ParkingSpot.id == Reservation.spot_id) \
+        .filter(Reservation.leaving_timestamp.is_(None),
+                Reservation.has_parked.is_(False),
+                Reservation.parking_timestamp < cutoff) \
+        .order_by(Reservation.id).limit(EXPIRY_BATCH).all()
+    if not candidates:
+        return None
+    lot_of = dict(candidates)
+
+    # Re-check the predicate so a reservation confirmed meanwhile is left alone.
+    expired = db.session.execute(
+        update(Reservation)
+        .where(Reservation.id.in_(lot_of),
+               Reservation.leaving_timestamp.is_(None),
+               Reservation.has_parked.is_(False))
+        .values(leaving_timestamp=Reservation.parking_timestamp)
+        .returning(Reservation.id, Reservation.spot_id, Reservation.parking_timestamp)
+    ).all()
+    if not expired:
+        return 0
+
+    freed = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id.in_([row.spot_id for row in expired]), ParkingSpot.status == 'O')
+        .values(status='A')
+        .returning(ParkingSpot.id, ParkingSpot.lot_id)
+    ).all()
+
+    per_lot = Counter(row.lot_id for row in freed)
+    if per_lot:
+        filled = ParkingLot.spots_filled - case(per_lot, value=ParkingLot.id, else_=0)
+        db.session.execute(
+            update(ParkingLot)
+            .where(ParkingLot.id.in_(per_lot))
+            .values(spots_filled=case((filled < 0, 0), else_=filled))
+        )
+    for row in freed:
+        occupancy.mark(row.lot_id, row.id, False)
+    for lot_id in per_lot:
+        waitlist.notify(lot_id)
+
+    rollups.record_sessions((lot_of[row.id], row.parking_timestamp, row.parking_timestamp, 0.0) for row in expired)
+    return len(freed)
+
+
+def sweep(now=None):
+    """Release every unconfirmed reservation older than the grace period.
+
+    Returns the number of spots reclaimed.
+    """
+    started = time.perf_counter()
+    cutoff = (now or datetime.utcnow()) - timedelta(minutes=GRACE_MINUTES)
+    reclaimed = 0
+    while True:
+        count = _expire_batch(cutoff)
+        if count is None:
+            break
+        db.session.commit()
+        reclaimed += count
+
+    elapsed = time.perf_counter() - started
+    with _lock:
+        _stats['runs'] += 1
+        _stats['reclaimed_total'] += reclaimed
+        _stats['last_reclaimed'] = reclaimed
+        _stats['last_seconds'] = elapsed
+        _stats['last_run_at'] = datetime.utcnow()
+    if reclaimed:
+        logger.info("Expired %d unconfirmed reservations in %.3fs", reclaimed, elapsed)
+    return reclaimed
+
+
+def stats():
+    with _lock:
+        return dict(_stats)
+
+
+class Sweeper(threading.Thread):
+
+    def __init__(self, app):
+        super().__init__(name='reservation-expiry', daemon=True)
+        self.app = app
+
+    def run(self):
+        while True:
+            time.sleep(SWEEP_INTERVAL_SECONDS)
+            with self.app.app_context():
+                try:
+                    sweep()
+                except Exception:
+                    logger.exception("Reservation expiry sweep failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+def start(app):
+    global _sweeper
+    if os.environ.get('EXPIRY_SWEEPER', '1') == '0' or _sweeper is not None:
+        return
+    _sweeper = Sweeper(app)
+    _sweeper.start()
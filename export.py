@@ -0,0 +1,167 @@
+import csv
+import io
+import math
+from datetime import timedelta
+
+from models import db, charge, Booking, ParkingLot, ParkingSpot, Reservation, User
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet/Arrow export is optional.
+    pa = None
+    pq = None
+
+# Record exports stream rows from a server-side cursor in batches and encode
+# each batch as it arrives, so memory stays flat regardless of table size.
+
+EXPORT_BATCH = 5000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+BOOKING_COLUMNS = [
+    ('booking_id', 'int64'), ('username', 'string'), ('lot_id', 'int64'), ('lot_name', 'string'),
+    ('start_time', 'timestamp'), ('end_time', 'timestamp'), ('billed_minutes', 'int64'),
+    ('price_per_hour', 'float64'), ('cost', 'float64'),
+]
+RESERVATION_COLUMNS = [
+    ('reservation_id', 'int64'), ('username', 'string'), ('lot_id', 'int64'), ('lot_name', 'string'),
+    ('spot_id', 'int64'), ('parking_timestamp', 'timestamp'), ('leaving_timestamp', 'timestamp'),
+    ('has_parked', 'bool'), ('billed_minutes', 'int64'), ('price_per_hour', 'float64'), ('cost', 'float64'),
+]
+
+
+def _minutes(start, end):
+    return math.ceil((end - start).total_seconds() / 60) if end else None
+
+
+def _filtered(query, ts_column, lot_column, start_day, end_day, lot_id):
+    if start_day:
+        query = query.filter(ts_column >= start_day)
+    if end_day:
+        query = query.filter(ts_column < end_day + timedelta(days=1))
+    if lot_id:
+        query = query.filter(lot_column == lot_id)
+    return query.order_by(ts_column).execution_options(stream_results=True, yield_per=EXPORT_BATCH)
+
+
+def booking_rows(start_day=None, end_day=None, lot_id=None):
+    query = db.session.query(
+        Booking.id, User.username, ParkingLot.id, ParkingLot.prime_location_name,
+        Booking.start_time, Booking.end_time, ParkingLot.price_per_hour
+    ).join(User, User.id == Booking.user_id).join(ParkingLot, ParkingLot.id == Booking.parking_lot_id)
+    for booking_id, username, lot, name, start, end, rate in _filtered(
+            query, Booking.start_time, Booking.parking_lot_id, start_day, end_day, lot_id):
+        yield (booking_id, username, lot, name, start, end, _minutes(start, end), rate,
+               charge(start, end, rate) if end else None)
+
+
+def reservation_rows(start_day=None, end_day=None, lot_id=None):
+    query = db.session.query(
+        Reservation.id, User.username, ParkingSpot.lot_id, ParkingLot.prime_location_name, Reservation.spot_id,
+        Reservation.parking_timestamp, Reservation.leaving_timestamp, Reservation.has_parked,
+        Reservation.price_per_hour, Reservation.amount
+    ).join(User, User.id == Reservation.user_id) \
+        .join(ParkingSpot, ParkingSpot.id == Reservation.spot_id) \
+        .join(ParkingLot, ParkingLot.id == ParkingSpot.lot_id)
+    for reservation_id, username, lot, name, spot_id, start, end, has_parked, rate, amount in _filtered(
+            query, Reservation.parking_timestamp, ParkingSpot.lot_id, start_day, end_day, lot_id):
+        if amount is None and end:
+            amount = charge(start, end, rate)
+        yield (reservation_id, username, lot, name, spot_id, start, end, has_parked, _minutes(start, end), rate,
+               amount)
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == EXPORT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for batch in _batches(rows):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _arrow_schema(columns):
+    types = {
+        'int64': pa.int64(), 'string': pa.string(), 'timestamp': pa.timestamp('us'),
+        'float64': pa.float64(), 'bool': pa.bool_(),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def _arrow_batches(schema, rows):
+    for batch in _batches(rows):
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for field, values in zip(schema, zip(*batch))], schema=schema)
+
+
+def stream_parquet(columns, rows):
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    for batch in _arrow_batches(schema, rows):
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def stream_arrow(columns, rows):
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema)
+    for batch in _arrow_batches(schema, rows):
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def stream(kind, fmt, start_day=None, end_day=None, lot_id=None):
+    if kind == 'bookings':
+        columns, rows = BOOKING_COLUMNS, booking_rows(start_day, end_day, lot_id)
+    else:
+        columns, rows = RESERVATION_COLUMNS, reservation_rows(start_day, end_day, lot_id)
+    if fmt == 'parquet':
+        return stream_parquet(columns, rows)
+    if fmt == 'arrow':
+        return stream_arrow(columns, rows)
+    return stream_csv(columns, rows)
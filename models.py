@@ -2,11 +2,66 @@ from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from datetime import timedelta
 import math
+import os
+
+from sqlalchemy import case, cast, func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+# Hash parameters for new and upgraded passwords; older hashes are rehashed on login.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+
+
+class elapsed_seconds(FunctionElement):
+    type = db.Float()
+    inherit_cache = True
+
+
+def _sqlite_microseconds(timestamp):
+    # Whole seconds plus the stored '.ffffff' (padded when shorter or absent).
+    # julianday() is a float of days and loses the sub-millisecond part.
+    return "(strftime('%%s', %s) * 1000000 + cast(substr(%s || '000000', 21, 6) as integer))" % (
+        timestamp, timestamp)
+
+
+@compiles(elapsed_seconds)
+def _elapsed_seconds_sqlite(element, compiler, **kw):
+    # Same float steps as timedelta.total_seconds(), so ceil() agrees with charge().
+    start, end = (compiler.process(clause, **kw) for clause in element.clauses)
+    return "((%s - %s) / 1000000.0)" % (_sqlite_microseconds(end), _sqlite_microseconds(start))
+
+
+@compiles(elapsed_seconds, 'postgresql')
+def _elapsed_seconds_postgresql(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return "EXTRACT(EPOCH FROM (%s - %s))" % (
+        compiler.process(end, **kw), compiler.process(start, **kw))
+
+
+def billed_minutes(start, end):
+    # SQL twin of math.ceil(delta.total_seconds() / 60), so sums can be pushed
+    # down to the database instead of looping over rows in Python.
+    seconds = elapsed_seconds(start, end)
+    minutes = seconds / 60
+    whole = cast(minutes, db.Integer)
+    return whole + case((minutes > whole, 1), else_=0)
+
+
+def charge(start, end, price_per_hour):
+    total_minutes = math.ceil((end - start).total_seconds() / 60)
+    cost = (price_per_hour / 60) * total_minutes
+    return round(cost, 2)
+
+
+def sum_billed(groups):
+    # Rows come back grouped by (rate, minutes), so per-row rounding stays
+    # exactly the same as calculate_price()/calculate_total_price().
+    return sum(round((rate / 60) * minutes, 2) * count for rate, minutes, count in groups)
+
 
 class User(db.Model):
     __tablename__ = 'user'
@@ -27,11 +82,14 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
-        self.passhash = generate_password_hash(password)
+        self.passhash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
 
     def verify_password(self, password):
         return check_password_hash(self.passhash, password)
 
+    def needs_rehash(self):
+        return not self.passhash.startswith(PASSWORD_HASH_METHOD + '$')
+
     def has_active_reservation(self):
         return any(res.leaving_timestamp is None for res in self.reservations)
 
@@ -44,6 +102,9 @@ class User(db.Model):
 
 class ParkingLot(db.Model):
     __tablename__ = 'parking_lot'
+    __table_args__ = (
+        db.Index('ix_parking_lot_pin_code', 'pin_code'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     prime_location_name = db.Column(db.String(128), nullable=False)
@@ -52,8 +113,14 @@ class ParkingLot(db.Model):
     pin_code = db.Column(db.String(10), nullable=False)
     max_spots = db.Column(db.Integer, nullable=False)
     spots_filled = db.Column(db.Integer, nullable=False, default=0)  
+    # Bumped by every transaction that changes the lot's spots (occupancy.py) or
+    # its advance holds (schedule.py), so other workers can spot stale indexes.
+    spot_version = db.Column(db.Integer, default=0)
+    hold_version = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     spots = db.relationship('ParkingSpot', backref='lot', cascade="all, delete-orphan")
+    tariff_bands = db.relationship('TariffBand', backref='lot', cascade="all, delete-orphan")
     bookings = db.relationship('Booking', backref='parking_lot', lazy=True)
 
     def available_spots(self):
@@ -62,7 +129,7 @@ class ParkingLot(db.Model):
     def has_available_spot(self):
         return self.spots_filled < self.max_spots
     def actual_filled_count(self):
-        return sum(1 for spot in self.spots if spot.status == 'O')
+        return ParkingSpot.query.filter_by(lot_id=self.id, status='O').count()
 
 
     def __repr__(self):
@@ -72,15 +139,20 @@ class ParkingLot(db.Model):
 
 class ParkingSpot(db.Model):
     __tablename__ = 'parking_spot'
+    __table_args__ = (
+        db.Index('ix_parking_spot_lot_status', 'lot_id', 'status'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), nullable=False)
     status = db.Column(db.String(1), default='A')  
 
     reservations = db.relationship('Reservation', backref='spot', cascade="all, delete-orphan")
+    advance_reservations = db.relationship('AdvanceReservation', backref='spot', cascade="all, delete-orphan")
 
     def is_available(self):
-        return self.status == 'A'
+        import schedule
+        return self.status == 'A' and not schedule.is_held(self.lot_id, self.id)
 
     def __repr__(self):
         return f"<ParkingSpot {self.id} in Lot {self.lot_id} - Status: {self.status}>"
@@ -88,6 +160,13 @@ class ParkingSpot(db.Model):
 
 class Reservation(db.Model):
     __tablename__ = 'reservation'
+    __table_args__ = (
+        db.Index('ix_reservation_user_leaving_spot', 'user_id', 'leaving_timestamp', 'spot_id'),
+        db.Index('ix_reservation_parking_timestamp', 'parking_timestamp', 'id'),
+        db.Index('ix_reservation_active_spot', 'spot_id',
+                 sqlite_where=db.text('leaving_timestamp IS NULL'),
+                 postgresql_where=db.text('leaving_timestamp IS NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -96,6 +175,7 @@ class Reservation(db.Model):
     leaving_timestamp = db.Column(db.DateTime, nullable=True)
     price_per_hour = db.Column(db.Float, nullable=False)
     has_parked = db.Column(db.Boolean, default=False)  
+    amount = db.Column(db.Float, nullable=True)  # charge fixed at release by the pricing engine
 
     def is_active(self):
         return self.leaving_timestamp is None
@@ -117,10 +197,19 @@ class Reservation(db.Model):
     def calculate_total_price(self):
         if not self.leaving_timestamp:
             return 0.0
-        delta = self.leaving_timestamp - self.parking_timestamp
-        total_minutes = math.ceil(delta.total_seconds() / 60)
-        cost = (self.price_per_hour / 60) * total_minutes
-        return round(cost, 2)
+        if self.amount is not None:
+            return self.amount
+        return charge(self.parking_timestamp, self.leaving_timestamp, self.price_per_hour)
+
+    @classmethod
+    def total_revenue(cls):
+        minutes = billed_minutes(cls.parking_timestamp, cls.leaving_timestamp)
+        groups = db.session.query(cls.price_per_hour, minutes, func.count(cls.id)) \
+            .filter(cls.leaving_timestamp.isnot(None), cls.amount.is_(None)) \
+            .group_by(cls.price_per_hour, minutes)
+        priced = db.session.query(func.sum(cls.amount)) \
+            .filter(cls.leaving_timestamp.isnot(None), cls.amount.isnot(None)).scalar()
+        return sum_billed(groups) + (priced or 0.0)
 
     def __repr__(self):
         return f"<Reservation {self.id} - User {self.user_id} - Spot {self.spot_id}>"
@@ -129,6 +218,14 @@ class Reservation(db.Model):
 
 class Booking(db.Model):
     __tablename__ = 'booking'
+    __table_args__ = (
+        db.Index('ix_booking_user_end', 'user_id', 'end_time'),
+        db.Index('ix_booking_start_time', 'start_time', 'id'),
+        db.Index('ix_booking_parking_lot', 'parking_lot_id'),
+        db.Index('ix_booking_active_user', 'user_id',
+                 sqlite_where=db.text('end_time IS NULL'),
+                 postgresql_where=db.text('end_time IS NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -159,12 +256,113 @@ class Booking(db.Model):
     def calculate_price(self):
         if not self.end_time:
             return 0.0
-        delta = self.end_time - self.start_time
-        price_per_hour = self.parking_lot.price_per_hour  
-        total_minutes = math.ceil(delta.total_seconds() / 60)
-        cost = (price_per_hour / 60) * total_minutes
-        return round(cost, 2)
+        return charge(self.start_time, self.end_time, self.parking_lot.price_per_hour)
+
+    @classmethod
+    def total_revenue(cls):
+        minutes = billed_minutes(cls.start_time, cls.end_time)
+        groups = db.session.query(ParkingLot.price_per_hour, minutes, func.count(cls.id)) \
+            .select_from(cls) \
+            .join(ParkingLot, ParkingLot.id == cls.parking_lot_id) \
+            .filter(cls.end_time.isnot(None)) \
+            .group_by(ParkingLot.price_per_hour, minutes)
+        return sum_billed(groups)
 
 
     def __repr__(self):
         return f"<Booking {self.id} - User {self.user_id} - Lot {self.parking_lot_id}>"
+
+
+class AdvanceReservation(db.Model):
+    __tablename__ = 'advance_reservation'
+    __table_args__ = (
+        db.Index('ix_advance_reservation_booked_spot', 'spot_id', 'start_time', 'end_time',
+                 sqlite_where=db.text("status = 'B'"),
+                 postgresql_where=db.text("status = 'B'")),
+        db.Index('ix_advance_reservation_user_status', 'user_id', 'status'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    spot_id = db.Column(db.Integer, db.ForeignKey('parking_spot.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    price_per_hour = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(1), nullable=False, default='B')  # B booked, U checked in, C cancelled
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def can_check_in(self, now=None):
+        now = now or datetime.utcnow()
+        return self.status == 'B' and self.start_time <= now < self.end_time
+
+    def __repr__(self):
+        return f"<AdvanceReservation {self.id} - User {self.user_id} - Spot {self.spot_id} - Status: {self.status}>"
+
+
+class TariffBand(db.Model):
+    __tablename__ = 'tariff_band'
+
+    id = db.Column(db.Integer, primary_key=True)
+    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id', ondelete='CASCADE'), nullable=True)  # NULL: all lots
+    kind = db.Column(db.String(1), nullable=False)  # T time of day, O occupancy
+    threshold = db.Column(db.Integer, nullable=False)  # minute of day (T) or percent full (O) the band starts at
+    multiplier = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f"<TariffBand {self.id} - {self.kind}{self.threshold} x{self.multiplier} - Lot {self.lot_id}>"
+
+
+class WaitlistEntry(db.Model):
+    __tablename__ = 'waitlist_entry'
+    __table_args__ = (
+        db.Index('ix_waitlist_waiting', 'lot_id', 'priority', 'created_at', 'id',
+                 sqlite_where=db.text("status = 'W'"),
+                 postgresql_where=db.text("status = 'W'")),
+        db.Index('ix_waitlist_user_status', 'user_id', 'status'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id', ondelete='CASCADE'), nullable=False)
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(1), nullable=False, default='W')  # W waiting, A assigned, C cancelled
+    assigned_spot_id = db.Column(db.Integer, db.ForeignKey('parking_spot.id'), nullable=True)
+    assigned_at = db.Column(db.DateTime, nullable=True)
+    notified = db.Column(db.Boolean, nullable=False, default=False)
+
+    lot = db.relationship('ParkingLot')
+
+    def __repr__(self):
+        return f"<WaitlistEntry {self.id} - User {self.user_id} - Lot {self.lot_id} - Status: {self.status}>"
+
+
+class LotUsageHourly(db.Model):
+    __tablename__ = 'lot_usage_hourly'
+
+    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id', ondelete='CASCADE'), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    occupied_minutes = db.Column(db.Float, nullable=False, default=0.0)
+    peak_occupancy = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<LotUsageHourly Lot {self.lot_id} - {self.bucket}>"
+
+
+class LotUsageDaily(db.Model):
+    __tablename__ = 'lot_usage_daily'
+    __table_args__ = (
+        db.Index('ix_lot_usage_daily_bucket', 'bucket'),
+    )
+
+    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id', ondelete='CASCADE'), primary_key=True)
+    bucket = db.Column(db.Date, primary_key=True)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    occupied_minutes = db.Column(db.Float, nullable=False, default=0.0)
+    peak_occupancy = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<LotUsageDaily Lot {self.lot_id} - {self.bucket}>"
@@ -0,0 +1,224 @@
+import queue
+import threading
+from collections import namedtuple
+
+from sqlalchemy import and_, event, func, update
+from sqlalchemy.orm import Session
+
+from models import db, ParkingLot, ParkingSpot
+
+# Process-local view of which spots are occupied, so availability pages do not
+# have to re-read parking_spot. Writers go through allocation.py, which queues
+# changes on the session; they are applied here only once the transaction
+# commits. The database stays the source of truth for allocation itself.
+#
+# The transaction that changes a lot's spots also bumps parking_lot.spot_version.
+# A reader compares that version with its index's and reloads the lot when
+# another worker has moved it on, so every process converges on the database.
+
+_PENDING_KEY = 'occupancy_pending'
+_VERSIONS_KEY = 'occupancy_versions'
+
+_lots = {}
+_subscribers = {}
+_lock = threading.Lock()
+
+
+class SpotState(namedtuple('SpotState', 'id status')):
+
+    def is_available(self):
+        return self.status == 'A'
+
+
+class LotOccupancy:
+    """Bitmap over a lot's spots: bit i is set when the i-th spot (by id) is occupied."""
+
+    def __init__(self, spot_ids, occupied_ids, version=0):
+        self.version = version
+        self.spot_ids = sorted(spot_ids)
+        self.position = {spot_id: i for i, spot_id in enumerate(self.spot_ids)}
+        self.full_mask = (1 << len(self.spot_ids)) - 1
+        self.bits = 0
+        for spot_id in occupied_ids:
+            self.bits |= 1 << self.position[spot_id]
+        self.filled_count = bin(self.bits).count('1')
+
+    @property
+    def total_count(self):
+        return len(self.spot_ids)
+
+    @property
+    def free_count(self):
+        return self.total_count - self.filled_count
+
+    def is_occupied(self, spot_id):
+        return bool(self.bits >> self.position[spot_id] & 1)
+
+    def free_spots(self):
+        free = ~self.bits & self.full_mask
+        return [SpotState(spot_id, 'A') for i, spot_id in enumerate(self.spot_ids) if free >> i & 1]
+
+    def occupancy_map(self):
+        return [SpotState(spot_id, 'O' if self.bits >> i & 1 else 'A')
+                for i, spot_id in enumerate(self.spot_ids)]
+
+    def snapshot(self):
+        """The first event of an occupancy stream."""
+        occupied = [spot_id for i, spot_id in enumerate(self.spot_ids) if self.bits >> i & 1]
+        return {'total': self.total_count, 'occupied': occupied}
+
+    def set(self, spot_id, occupied):
+        i = self.position.get(spot_id)
+        if i is None or bool(self.bits >> i & 1) == occupied:
+            return
+        self.bits ^= 1 << i
+        self.filled_count += 1 if occupied else -1
+
+    def set_all(self, occupied):
+        self.bits = self.full_mask if occupied else 0
+        self.filled_count = self.total_count if occupied else 0
+
+
+def _load(lot_id):
+    # One statement, so the spots and the version come from the same snapshot.
+    # Retired spots ('X') are no longer part of the lot.
+    rows = db.session.query(ParkingLot.spot_version, ParkingSpot.id, ParkingSpot.status) \
+        .outerjoin(ParkingSpot, and_(ParkingSpot.lot_id == ParkingLot.id, ParkingSpot.status != 'X')) \
+        .filter(ParkingLot.id == lot_id).all()
+    if not rows:
+        return None
+    spots = [r for r in rows if r.id is not None]
+    return LotOccupancy([r.id for r in spots], [r.id for r in spots if r.status == 'O'], rows[0].spot_version or 0)
+
+
+def stored_version(lot_id):
+    """The lot's committed spot version, or None if the lot does not exist."""
+    return db.session.query(func.coalesce(ParkingLot.spot_version, 0)).filter(ParkingLot.id == lot_id).scalar()
+
+
+def for_lot(lot_id, version=None):
+    """The lot's index, reloaded if it is behind ``version`` (by default the stored one)."""
+    index = _lots.get(lot_id)
+    if index is not None and index.version >= ((stored_version(lot_id) or 0) if version is None else version):
+        return index
+    index = _load(lot_id)
+    if index is None:
+        return LotOccupancy([], [])
+    with _lock:
+        cached = _lots.get(lot_id)
+        # A commit in this process may already have moved the cached index on.
+        if cached is not None and cached.version >= index.version:
+            return cached
+        _lots[lot_id] = index
+    return index
+
+
+def missed(seen, version):
+    """Whether a stream that has seen ``seen`` skipped another worker's commit to reach ``version``."""
+    return version is not None and version > seen + 1
+
+
+def invalidate(lot_id=None):
+    with _lock:
+        if lot_id is None:
+            _lots.clear()
+        else:
+            _lots.pop(lot_id, None)
+
+
+def subscribe(lot_id, updates=None):
+    """Return a queue that receives this lot's committed status changes.
+
+    ``updates`` may be any object with a non-blocking ``put_nowait``.
+    """
+    if updates is None:
+        updates = queue.Queue(maxsize=1000)
+    with _lock:
+        _subscribers.setdefault(lot_id, set()).add(updates)
+    return updates
+
+
+def unsubscribe(lot_id, updates):
+    with _lock:
+        listeners = _subscribers.get(lot_id)
+        if listeners is not None:
+            listeners.discard(updates)
+            if not listeners:
+                del _subscribers[lot_id]
+
+
+def _publish(lot_id, message):
+    for updates in _subscribers.get(lot_id, ()):
+        try:
+            updates.put_nowait(message)
+        except queue.Full:
+            # A stalled client only loses deltas; it resyncs on reconnect.
+            pass
+
+
+def _queue(change):
+    db.session.info.setdefault(_PENDING_KEY, []).append(change)
+
+
+def mark(lot_id, spot_id, occupied):
+    _queue(('spot', lot_id, spot_id, occupied))
+
+
+def mark_lot(lot_id, occupied):
+    _queue(('lot', lot_id, None, occupied))
+
+
+def forget(lot_id):
+    """Drop a lot's index after commit, e.g. when its set of spots changes."""
+    _queue(('forget', lot_id, None, None))
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_versions(session):
+    lot_ids = {change[1] for change in session.info.get(_PENDING_KEY, ())}
+    if lot_ids:
+        rows = session.execute(
+            update(ParkingLot)
+            .where(ParkingLot.id.in_(lot_ids))
+            .values(spot_version=func.coalesce(ParkingLot.spot_version, 0) + 1)
+            .returning(ParkingLot.id, ParkingLot.spot_version)
+            .execution_options(synchronize_session=False)
+        )
+        session.info[_VERSIONS_KEY] = dict(rows.all())
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_pending(session):
+    changes = session.info.pop(_PENDING_KEY, [])
+    versions = session.info.pop(_VERSIONS_KEY, {})
+    with _lock:
+        for lot_id, version in versions.items():
+            index = _lots.get(lot_id)
+            # Deltas only apply on top of the version just before ours; an
+            # index that missed another worker's commit is reloaded instead.
+            if index is not None and index.version != version - 1:
+                del _lots[lot_id]
+        for kind, lot_id, spot_id, occupied in changes:
+            version = versions.get(lot_id)
+            if kind == 'forget':
+                _lots.pop(lot_id, None)
+                _publish(lot_id, {'reload': True, 'version': version})
+                continue
+            status = 'O' if occupied else 'A'
+            message = {'all': status} if kind == 'lot' else {'spot': spot_id, 'status': status}
+            _publish(lot_id, dict(message, version=version))
+            index = _lots.get(lot_id)
+            if index is None:
+                continue
+            if kind == 'lot':
+                index.set_all(occupied)
+            else:
+                index.set(spot_id, occupied)
+        for lot_id, version in versions.items():
+            if lot_id in _lots:
+                _lots[lot_id].version = version
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
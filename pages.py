@@ -0,0 +1,98 @@
+from collections import namedtuple
+
+from flask import g
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+import billing
+import occupancy
+import pricing
+import schedule
+import search
+import waitlist
+from models import db, Booking, ParkingLot, ParkingSpot, Reservation, WaitlistEntry
+
+# What the read-heavy pages load, written once for both servers. A loader is
+# a generator: it yields a SELECT and is sent back its Result, or yields a
+# Cached call into the in-process indexes, and finally returns the template
+# context (None when the page does not exist). The views in app.py drive
+# loaders on the Flask-SQLAlchemy session with run(); asgi.py drives the
+# same loaders on an async session and leaves the context in ``g`` for the
+# view to pick up.
+
+
+class Cached(namedtuple('Cached', 'fn args')):
+    """A call into an in-process index; it touches the sync session when cold."""
+
+    def __new__(cls, fn, *args):
+        return super().__new__(cls, fn, args)
+
+
+def run(loader):
+    """Run ``loader`` on the current session, unless asgi.py already has."""
+    if 'page' in g:
+        return g.pop('page')
+    try:
+        step = next(loader)
+        while True:
+            result = step.fn(*step.args) if isinstance(step, Cached) else db.session.execute(step)
+            step = loader.send(result)
+    except StopIteration as done:
+        return done.value
+
+
+def lots(page):
+    offset = (page - 1) * search.SEARCH_PAGE_SIZE
+    parking_lots = (yield select(ParkingLot).order_by(ParkingLot.id)
+                    .offset(offset).limit(search.SEARCH_PAGE_SIZE + 1)).scalars().all()
+    return {
+        'parking_lots': parking_lots[:search.SEARCH_PAGE_SIZE],
+        'page': page,
+        'has_next': len(parking_lots) > search.SEARCH_PAGE_SIZE,
+    }
+
+
+def _lot_state(lot):
+    return occupancy.for_lot(lot.id), schedule.held_now(lot.id), pricing.rate_now(lot)
+
+
+def spots(lot_id, user_id):
+    lot = (yield select(ParkingLot).where(ParkingLot.id == lot_id)).scalar()
+    if lot is None:
+        return None
+    active_reservations = {r.spot_id: r for r in (yield select(Reservation).join(ParkingSpot).where(
+        ParkingSpot.lot_id == lot_id, Reservation.leaving_timestamp.is_(None))).scalars()}
+    booking_id = (yield select(Booking.id).filter_by(user_id=user_id, end_time=None).limit(1)).scalar()
+    waitlist_entry = (yield select(WaitlistEntry).filter_by(user_id=user_id, lot_id=lot_id, status='W')
+                      .limit(1)).scalar()
+    waitlist_position = (yield waitlist.ahead_of(waitlist_entry)).scalar() + 1 if waitlist_entry else None
+
+    index, held, current_rate = yield Cached(_lot_state, lot)
+    spot_states = [spot._replace(status='H') if spot.id in held and spot.status == 'A' else spot
+                   for spot in index.occupancy_map()]
+    return {
+        'lot': lot,
+        'spots': spot_states,
+        'filled_count': index.filled_count,
+        'total_spots': index.total_count,
+        'actual_spot_count': index.total_count,
+        'available_spots': index.free_count - sum(1 for spot in spot_states if spot.status == 'H'),
+        'current_rate': current_rate,
+        'active_reservations': active_reservations,
+        'has_booking': booking_id is not None,
+        'waitlist_position': waitlist_position,
+    }
+
+
+def history(user_id):
+    bookings = (yield select(Booking).options(joinedload(Booking.parking_lot))
+                .filter_by(user_id=user_id)).scalars().all()
+    reservations = (yield select(Reservation).options(joinedload(Reservation.spot).joinedload(ParkingSpot.lot))
+                    .filter_by(user_id=user_id)).scalars().all()
+    booking_columns = billing.columns((yield billing.closed_bookings(Booking.user_id == user_id)), 3)
+    reservation_columns = billing.columns((yield billing.closed_reservations(Reservation.user_id == user_id)), 4)
+    return {
+        'bookings': bookings,
+        'reservations': reservations,
+        'total_cost': round(billing.total(*booking_columns) + billing.total(*reservation_columns), 2),
+    }
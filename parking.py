@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import pricing
+import rollups
+import waitlist
+from allocation import claim_spot, free_spot
+from models import db, Reservation
+
+# The reserve -> confirm -> release lifecycle of a single spot, shared by the
+# HTML routes and the JSON API. Each step returns ``(reservation, error)``
+# where ``error`` is one of the codes below; the caller owns the commit.
+
+OCCUPIED = 'occupied'
+HELD = 'held'
+ALREADY_ACTIVE = 'already_active'
+NOT_FOUND = 'not_found'
+ALREADY_CONFIRMED = 'already_confirmed'
+
+MESSAGES = {
+    OCCUPIED: "This spot is already occupied.",
+    HELD: "This spot is held for an advance reservation.",
+    ALREADY_ACTIVE: "You already have an active reservation.",
+    NOT_FOUND: "No active reservation found for this spot.",
+    ALREADY_CONFIRMED: "Parking already confirmed.",
+}
+
+
+def active_reservation(user_id, spot_id=None):
+    query = Reservation.query.filter_by(user_id=user_id, leaving_timestamp=None)
+    if spot_id is not None:
+        query = query.filter_by(spot_id=spot_id)
+    return query.first()
+
+
+def reserve(user_id, spot):
+    if spot.status != 'A':
+        return None, OCCUPIED
+    if not spot.is_available():
+        return None, HELD
+    if active_reservation(user_id):
+        return None, ALREADY_ACTIVE
+    price = pricing.quote(spot.lot)
+    if not claim_spot(spot_id=spot.id):
+        return None, OCCUPIED
+
+    reservation = Reservation(user_id=user_id, spot_id=spot.id, price_per_hour=price)
+    db.session.add(reservation)
+    return reservation, None
+
+
+def confirm(user_id, spot_id):
+    reservation = active_reservation(user_id, spot_id)
+    if not reservation:
+        return None, NOT_FOUND
+    if reservation.has_parked:
+        return reservation, ALREADY_CONFIRMED
+    reservation.has_parked = True
+    return reservation, None
+
+
+def release(user_id, spot_id):
+    reservation = active_reservation(user_id, spot_id)
+    if not reservation:
+        return None, NOT_FOUND
+
+    reservation.leaving_timestamp = datetime.utcnow()
+    reservation.has_parked = False
+    pricing.bill(reservation)
+    free_spot(reservation.spot_id)
+    rollups.record_reservation(reservation)
+    waitlist.notify(reservation.spot.lot_id)
+    return reservation, None
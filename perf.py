@@ -0,0 +1,164 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from collections import Counter, deque
+
+from flask import g, has_request_context, request, session, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-request instrumentation: wall time, SQL statement count and time,
+# template render time and repeated-statement (N+1) warnings, aggregated per
+# endpoint. Admins can profile a single request with ?_profile=1, and
+# PERF_PROFILE_SAMPLE_RATE profiles a random fraction of all requests.
+
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('PERF_N_PLUS_ONE_THRESHOLD', 10))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PERF_PROFILE_SAMPLE_RATE', 0))
+RECENT_PROFILES = 20
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_endpoints = {}
+_profiles = deque(maxlen=RECENT_PROFILES)
+
+
+def _new_totals():
+    return {
+        'requests': 0, 'wall_seconds': 0.0, 'max_wall_seconds': 0.0,
+        'sql_queries': 0, 'sql_seconds': 0.0, 'template_seconds': 0.0, 'n_plus_one': 0,
+    }
+
+
+def _start_request():
+    g.perf_started = time.perf_counter()
+    g.perf_sql_queries = 0
+    g.perf_sql_seconds = 0.0
+    g.perf_template_seconds = 0.0
+    g.perf_statements = Counter()
+
+    wants_profile = request.args.get('_profile') and session.get('is_admin')
+    if wants_profile or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another request is already being profiled on this interpreter.
+            return
+        g.perf_profiler = profiler
+
+
+def _finish_request(response):
+    started = g.pop('perf_started', None)
+    if started is None:
+        return response
+    wall = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+
+    repeated = [(statement, count) for statement, count in g.perf_statements.items()
+                if count >= N_PLUS_ONE_THRESHOLD]
+    for statement, count in repeated:
+        logger.warning("Possible N+1 in %s: statement ran %d times: %s",
+                       endpoint, count, ' '.join(statement.split())[:200])
+
+    with _lock:
+        totals = _endpoints.setdefault(endpoint, _new_totals())
+        totals['requests'] += 1
+        totals['wall_seconds'] += wall
+        totals['max_wall_seconds'] = max(totals['max_wall_seconds'], wall)
+        totals['sql_queries'] += g.perf_sql_queries
+        totals['sql_seconds'] += g.perf_sql_seconds
+        totals['template_seconds'] += g.perf_template_seconds
+        totals['n_plus_one'] += len(repeated)
+
+    profiler = g.pop('perf_profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+        with _lock:
+            _profiles.appendleft({
+                'endpoint': endpoint, 'path': request.full_path, 'wall_seconds': wall,
+                'sql_queries': g.perf_sql_queries, 'stats': out.getvalue(),
+            })
+
+    response.headers['Server-Timing'] = (
+        f'app;dur={wall * 1000:.1f}, sql;dur={g.perf_sql_seconds * 1000:.1f}, '
+        f'tpl;dur={g.perf_template_seconds * 1000:.1f}'
+    )
+    return response
+
+
+def _in_instrumented_request():
+    return has_request_context() and 'perf_started' in g
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _in_instrumented_request():
+        conn.info.setdefault('perf_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('perf_query_started')
+    if not started or not _in_instrumented_request():
+        return
+    g.perf_sql_seconds += time.perf_counter() - started.pop()
+    g.perf_sql_queries += 1
+    g.perf_statements[statement] += 1
+
+
+def _before_render(sender, template, context, **extra):
+    if _in_instrumented_request():
+        g.perf_render_started = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    started = g.pop('perf_render_started', None) if _in_instrumented_request() else None
+    if started is not None:
+        g.perf_template_seconds += time.perf_counter() - started
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+
+def snapshot():
+    with _lock:
+        endpoints = {name: dict(totals) for name, totals in _endpoints.items()}
+        profiles = list(_profiles)
+    return endpoints, profiles
+
+
+def prometheus_text(extra_gauges=()):
+    """Render the per-endpoint totals in the Prometheus text exposition format."""
+    endpoints, _ = snapshot()
+    metrics = [
+        ('parking_requests_total', 'counter', 'Requests served', 'requests'),
+        ('parking_request_seconds_total', 'counter', 'Wall time spent in requests', 'wall_seconds'),
+        ('parking_request_seconds_max', 'gauge', 'Slowest request seen', 'max_wall_seconds'),
+        ('parking_sql_queries_total', 'counter', 'SQL statements executed', 'sql_queries'),
+        ('parking_sql_seconds_total', 'counter', 'Time spent executing SQL', 'sql_seconds'),
+        ('parking_template_seconds_total', 'counter', 'Time spent rendering templates', 'template_seconds'),
+        ('parking_n_plus_one_warnings_total', 'counter', 'Repeated-statement warnings', 'n_plus_one'),
+    ]
+    lines = []
+    for name, kind, help_text, key in metrics:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for endpoint, totals in sorted(endpoints.items()):
+            lines.append(f'{name}{{endpoint="{endpoint}"}} {totals[key]}')
+    for name, help_text, value in extra_gauges:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
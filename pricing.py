@@ -0,0 +1,192 @@
+import bisect
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, charge, TariffBand
+
+# Dynamic pricing. A lot's hourly rate is its base price scaled by
+#   * an occupancy multiplier, chosen from how full the lot is when the spot
+#     is reserved and locked into Reservation.price_per_hour, and
+#   * time-of-day multipliers applied while the car is parked. Bands start at
+#     a minute of the day and run until the next one, wrapping past midnight.
+# Bands with a lot_id override the all-lots bands of the same kind. They are
+# compiled into sorted arrays, so a rate lookup is a bisect and billing a
+# stay of any length is two prefix-sum lookups.
+#
+# Band times are wall-clock times in TARIFF_TIMEZONE, while timestamps are
+# stored in UTC; a stay is converted before it is weighted, and split where
+# the zone's UTC offset changes so a DST shift is billed by real minutes.
+
+MINUTES_PER_DAY = 24 * 60
+TARIFF_TTL_SECONDS = 30
+TARIFF_TIMEZONE = ZoneInfo(os.environ.get('TARIFF_TIMEZONE', 'UTC'))
+# Assumed to hold at most one UTC offset change; any longer span is halved.
+STEADY_SPAN = timedelta(days=7)
+
+_DIRTY_KEY = 'pricing_dirty'
+
+_lock = threading.Lock()
+_bands = None
+_loaded_at = 0.0
+_tariffs = {}
+
+
+class Tariff:
+
+    def __init__(self, time_bands=(), occupancy_bands=(), zone=None):
+        self.zone = zone
+        time_bands = sorted(time_bands)
+        if time_bands and time_bands[0][0] != 0:
+            # The last band of the day carries on past midnight.
+            time_bands.insert(0, (0, time_bands[-1][1]))
+        self.time_starts = [start for start, _ in time_bands]
+        self.time_multipliers = [multiplier for _, multiplier in time_bands]
+
+        # Weighted minutes from midnight to the start of each band.
+        self._prefix = []
+        weighted = 0.0
+        for i, start in enumerate(self.time_starts):
+            self._prefix.append(weighted)
+            end = self.time_starts[i + 1] if i + 1 < len(self.time_starts) else MINUTES_PER_DAY
+            weighted += (end - start) * self.time_multipliers[i]
+        self.day_weight = weighted
+
+        occupancy_bands = sorted(occupancy_bands)
+        if not occupancy_bands or occupancy_bands[0][0] > 0:
+            occupancy_bands.insert(0, (0, 1.0))
+        self.occupancy_starts = [start for start, _ in occupancy_bands]
+        self.occupancy_multipliers = [multiplier for _, multiplier in occupancy_bands]
+
+    def occupancy_multiplier(self, filled, capacity):
+        percent = 100.0 * filled / capacity if capacity else 100.0
+        return self.occupancy_multipliers[bisect.bisect_right(self.occupancy_starts, percent) - 1]
+
+    def _offset(self, at):
+        return at.replace(tzinfo=timezone.utc).astimezone(self.zone).utcoffset()
+
+    def _local_spans(self, start, end):
+        """Split UTC [start, end) into wall-clock spans, each with a single UTC offset."""
+        offset = self._offset(start)
+        if end - start <= STEADY_SPAN and self._offset(end) == offset:
+            return [(start + offset, end + offset)]
+        if end - start <= timedelta(minutes=1):
+            # Offsets change on a whole minute, so at the one this span may contain.
+            middle = start.replace(second=0, microsecond=0) + timedelta(minutes=1)
+            if middle >= end:
+                return [(start + offset, end + offset)]
+        else:
+            middle = start + (end - start) / 2
+        return self._local_spans(start, middle) + self._local_spans(middle, end)
+
+    def time_multiplier(self, at):
+        """The multiplier in force at UTC time ``at``."""
+        if not self.time_starts:
+            return 1.0
+        if self.zone is not None:
+            at += self._offset(at)
+        return self.time_multipliers[bisect.bisect_right(self.time_starts, at.hour * 60 + at.minute) - 1]
+
+    def _since_midnight(self, minute_of_day):
+        i = bisect.bisect_right(self.time_starts, minute_of_day) - 1
+        return self._prefix[i] + (minute_of_day - self.time_starts[i]) * self.time_multipliers[i]
+
+    def _wall_weighted_minutes(self, start, end):
+        def minute_of_day(at):
+            return at.hour * 60 + at.minute + (at.second + at.microsecond / 1e6) / 60
+
+        days = (end.date() - start.date()).days
+        return (days * self.day_weight
+                + self._since_midnight(minute_of_day(end)) - self._since_midnight(minute_of_day(start)))
+
+    def weighted_minutes(self, start, end):
+        """Minutes in UTC [start, end), each weighted by its time-of-day multiplier."""
+        if self.zone is None:
+            return self._wall_weighted_minutes(start, end)
+        return sum(self._wall_weighted_minutes(a, b) for a, b in self._local_spans(start, end))
+
+    def charge(self, start, end, rate):
+        """Bill [start, end) at ``rate`` per hour, rounding the stay up to whole minutes like charge()."""
+        if not self.time_starts:
+            return charge(start, end, rate)
+        minutes = math.ceil((end - start).total_seconds() / 60)
+        return round(rate / 60 * self.weighted_minutes(start, start + timedelta(minutes=minutes)), 2)
+
+
+_FLAT = Tariff()
+
+
+def _load_bands():
+    global _bands, _loaded_at
+    bands = defaultdict(lambda: {'T': [], 'O': []})
+    for band in TariffBand.query.all():
+        bands[band.lot_id][band.kind].append((band.threshold, band.multiplier))
+    loaded = dict(bands)
+    with _lock:
+        _bands = loaded
+        _loaded_at = time.monotonic()
+        _tariffs.clear()
+    return loaded
+
+
+def for_lot(lot_id):
+    # Read the global once: a commit elsewhere may reset it to None meanwhile.
+    bands = _bands
+    if bands is None or time.monotonic() - _loaded_at > TARIFF_TTL_SECONDS:
+        bands = _load_bands()
+    tariff = _tariffs.get(lot_id)
+    if tariff is None:
+        shared = bands.get(None, {'T': [], 'O': []})
+        own = bands.get(lot_id, {'T': [], 'O': []})
+        time_bands = own['T'] or shared['T']
+        occupancy_bands = own['O'] or shared['O']
+        if time_bands or occupancy_bands:
+            tariff = Tariff(time_bands, occupancy_bands, TARIFF_TIMEZONE)
+        else:
+            tariff = _FLAT
+        _tariffs[lot_id] = tariff
+    return tariff
+
+
+def quote(lot):
+    """Hourly rate to lock into a new reservation, from the lot's current occupancy."""
+    multiplier = for_lot(lot.id).occupancy_multiplier(lot.spots_filled or 0, lot.max_spots)
+    return round(lot.price_per_hour * multiplier, 2)
+
+
+def rate_now(lot):
+    """What a reservation made now would pay per hour at this moment."""
+    return round(quote(lot) * for_lot(lot.id).time_multiplier(datetime.utcnow()), 2)
+
+
+def bill(reservation):
+    """Fix the charge of a reservation that has just been released."""
+    tariff = for_lot(reservation.spot.lot_id)
+    reservation.amount = tariff.charge(reservation.parking_timestamp, reservation.leaving_timestamp,
+                                       reservation.price_per_hour)
+    return reservation.amount
+
+
+def touch():
+    """Recompile tariffs once the current transaction commits."""
+    db.session.info[_DIRTY_KEY] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _reload(session):
+    global _bands
+    if session.info.pop(_DIRTY_KEY, False):
+        with _lock:
+            _bands = None
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_touch(session):
+    session.info.pop(_DIRTY_KEY, None)
@@ -0,0 +1,222 @@
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import case, delete, event, func, literal, select, union_all
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from sqlalchemy.orm import Session
+
+from models import db, charge, Booking, LotUsageDaily, LotUsageHourly, ParkingLot, ParkingSpot, Reservation
+
+# Per-lot hourly and daily usage, maintained incrementally as reservations
+# and lot bookings close so reports never have to re-bill raw history.
+# Revenue and session counts land in the bucket the session closed in;
+# occupied minutes are spread over every hour the session covered.
+#
+# Peak occupancy is written only when a claim sets a new high for its hour,
+# as far as this process has seen, so a busy lot costs a few upserts an hour
+# instead of two per claim. Peaks are maxima, so every process may write its
+# own without coordination.
+
+BACKFILL_BATCH = 1000
+
+_PEAKS_KEY = 'rollup_peaks'
+
+_peaks = {}
+_lock = threading.Lock()
+
+
+def _hour(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _new_bucket():
+    return {'revenue': 0.0, 'sessions': 0, 'occupied_minutes': 0.0, 'peak_occupancy': 0}
+
+
+def _accumulate(hourly, lot_id, start, end, amount):
+    cursor = start
+    while cursor < end:
+        boundary = min(_hour(cursor) + timedelta(hours=1), end)
+        hourly[(lot_id, _hour(cursor))]['occupied_minutes'] += (boundary - cursor).total_seconds() / 60
+        cursor = boundary
+    closing = hourly[(lot_id, _hour(end))]
+    closing['revenue'] += amount
+    closing['sessions'] += 1
+
+
+def _daily(hourly):
+    daily = defaultdict(_new_bucket)
+    for (lot_id, hour), totals in hourly.items():
+        day = daily[(lot_id, hour.date())]
+        day['revenue'] += totals['revenue']
+        day['sessions'] += totals['sessions']
+        day['occupied_minutes'] += totals['occupied_minutes']
+        day['peak_occupancy'] = max(day['peak_occupancy'], totals['peak_occupancy'])
+    return daily
+
+
+def _upsert(model, buckets):
+    insert = postgresql_insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite_insert
+    for (lot_id, bucket), totals in buckets.items():
+        stmt = insert(model).values(lot_id=lot_id, bucket=bucket, **totals)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['lot_id', 'bucket'],
+            set_={
+                'revenue': model.revenue + stmt.excluded.revenue,
+                'sessions': model.sessions + stmt.excluded.sessions,
+                'occupied_minutes': model.occupied_minutes + stmt.excluded.occupied_minutes,
+                'peak_occupancy': case(
+                    (stmt.excluded.peak_occupancy > model.peak_occupancy, stmt.excluded.peak_occupancy),
+                    else_=model.peak_occupancy
+                ),
+            }
+        )
+        db.session.execute(stmt)
+
+
+def _write(hourly):
+    _upsert(LotUsageHourly, hourly)
+    _upsert(LotUsageDaily, _daily(hourly))
+
+
+def record_session(lot_id, start, end, amount):
+    """Fold one closed reservation or lot booking into the rollups."""
+    record_sessions([(lot_id, start, end, amount)])
+
+
+def record_sessions(sessions):
+    """Fold many ``(lot_id, start, end, amount)`` sessions in with one upsert per bucket."""
+    hourly = defaultdict(_new_bucket)
+    for lot_id, start, end, amount in sessions:
+        _accumulate(hourly, lot_id, start, end, amount)
+    _write(hourly)
+
+
+def record_reservation(reservation):
+    record_session(reservation.spot.lot_id, reservation.parking_timestamp,
+                   reservation.leaving_timestamp, reservation.calculate_total_price())
+
+
+def record_booking(booking):
+    record_session(booking.parking_lot_id, booking.start_time, booking.end_time, booking.calculate_price())
+
+
+def record_occupancy(lot_id, at, filled):
+    """Raise the peak occupancy of the hour/day containing ``at`` to ``filled``."""
+    key = (lot_id, _hour(at))
+    if filled <= _peaks.get(key, 0):
+        return
+    totals = _new_bucket()
+    totals['peak_occupancy'] = filled
+    _write({key: totals})
+    pending = db.session.info.setdefault(_PEAKS_KEY, {})
+    pending[key] = max(pending.get(key, 0), filled)
+
+
+@event.listens_for(Session, 'after_commit')
+def _remember_peaks(session):
+    pending = session.info.pop(_PEAKS_KEY, None)
+    if not pending:
+        return
+    with _lock:
+        for key, filled in pending.items():
+            _peaks[key] = max(_peaks.get(key, 0), filled)
+        # Only the current hour is ever raised again.
+        newest = max(hour for _, hour in pending)
+        for key in [key for key in _peaks if key[1] < newest - timedelta(hours=1)]:
+            del _peaks[key]
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_peaks(session):
+    session.info.pop(_PEAKS_KEY, None)
+
+
+def _insert_batched(model, buckets):
+    rows = [dict(lot_id=lot_id, bucket=bucket, **totals) for (lot_id, bucket), totals in buckets.items()]
+    for i in range(0, len(rows), BACKFILL_BATCH):
+        db.session.execute(model.__table__.insert(), rows[i:i + BACKFILL_BATCH])
+
+
+def _backfill_lot(lot_id):
+    hourly = defaultdict(_new_bucket)
+    closed_reservations = Reservation.leaving_timestamp.isnot(None)
+
+    reservations = db.session.query(
+        Reservation.parking_timestamp, Reservation.leaving_timestamp, Reservation.price_per_hour,
+        Reservation.amount
+    ).join(ParkingSpot, ParkingSpot.id == Reservation.spot_id) \
+        .filter(ParkingSpot.lot_id == lot_id, closed_reservations) \
+        .execution_options(yield_per=BACKFILL_BATCH)
+    for start, end, rate, amount in reservations:
+        _accumulate(hourly, lot_id, start, end, charge(start, end, rate) if amount is None else amount)
+
+    bookings = db.session.query(Booking.start_time, Booking.end_time, ParkingLot.price_per_hour) \
+        .join(ParkingLot, ParkingLot.id == Booking.parking_lot_id) \
+        .filter(Booking.parking_lot_id == lot_id, Booking.end_time.isnot(None)) \
+        .execution_options(yield_per=BACKFILL_BATCH)
+    for start, end, rate in bookings:
+        _accumulate(hourly, lot_id, start, end, charge(start, end, rate))
+
+    # Sweep arrivals (+1) and departures (-1) in time order, sorted by the
+    # database; departures sort first on ties.
+    spot_reservations = select(Reservation.id).join(ParkingSpot, ParkingSpot.id == Reservation.spot_id) \
+        .where(ParkingSpot.lot_id == lot_id, closed_reservations)
+    edges = union_all(
+        select(Reservation.parking_timestamp.label('at'), literal(1).label('step'))
+        .where(Reservation.id.in_(spot_reservations)),
+        select(Reservation.leaving_timestamp.label('at'), literal(-1).label('step'))
+        .where(Reservation.id.in_(spot_reservations)),
+    ).order_by('at', 'step')
+    occupied = 0
+    for at, step in db.session.execute(edges.execution_options(yield_per=BACKFILL_BATCH)):
+        occupied += step
+        bucket = hourly[(lot_id, _hour(at))]
+        bucket['peak_occupancy'] = max(bucket['peak_occupancy'], occupied)
+
+    _insert_batched(LotUsageHourly, hourly)
+    _insert_batched(LotUsageDaily, _daily(hourly))
+    return len(hourly)
+
+
+def backfill():
+    """Rebuild both rollup tables from the full reservation and booking history.
+
+    Lots are rebuilt one at a time from streamed rows, so memory holds one
+    lot's buckets. Peak occupancy is reconstructed from spot reservations
+    only; how many spots a historical lot booking held is not recorded anywhere.
+    """
+    db.session.execute(delete(LotUsageHourly))
+    db.session.execute(delete(LotUsageDaily))
+    lot_ids = [lot_id for lot_id, in db.session.query(ParkingLot.id).order_by(ParkingLot.id)]
+    return sum(_backfill_lot(lot_id) for lot_id in lot_ids)
+
+
+def daily_usage(start_day, end_day):
+    """Totals across all lots for each day in [start_day, end_day]."""
+    return db.session.query(
+        LotUsageDaily.bucket,
+        func.sum(LotUsageDaily.revenue),
+        func.sum(LotUsageDaily.sessions),
+        func.sum(LotUsageDaily.occupied_minutes),
+        func.max(LotUsageDaily.peak_occupancy)
+    ).filter(LotUsageDaily.bucket.between(start_day, end_day)) \
+        .group_by(LotUsageDaily.bucket) \
+        .order_by(LotUsageDaily.bucket).all()
+
+
+def lot_usage(start_day, end_day):
+    """Totals per lot over [start_day, end_day]."""
+    return db.session.query(
+        ParkingLot.prime_location_name,
+        func.sum(LotUsageDaily.revenue),
+        func.sum(LotUsageDaily.sessions),
+        func.sum(LotUsageDaily.occupied_minutes),
+        func.max(LotUsageDaily.peak_occupancy)
+    ).join(ParkingLot, ParkingLot.id == LotUsageDaily.lot_id) \
+        .filter(LotUsageDaily.bucket.between(start_day, end_day)) \
+        .group_by(ParkingLot.id, ParkingLot.prime_location_name) \
+        .order_by(ParkingLot.prime_location_name).all()
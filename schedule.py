@@ -0,0 +1,227 @@
+import bisect
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, exists, func, insert, literal, select, update
+from sqlalchemy.orm import Session
+
+import occupancy
+from models import db, AdvanceReservation, ParkingLot, ParkingSpot
+
+# Advance reservations hold a spot for a future [start, end) window. Each lot
+# keeps a process-local interval index over its booked windows so "which
+# spots are free for this window" never scans reservation rows. Like the
+# occupancy index it is only updated after commit; the booking insert itself
+# re-checks for overlap in SQL, so the database still decides conflicts.
+# Commits bump parking_lot.hold_version, the way occupancy.py versions spots.
+
+_PENDING_KEY = 'schedule_pending'
+_VERSIONS_KEY = 'schedule_versions'
+
+_lots = {}
+_lock = threading.Lock()
+
+
+class IntervalIndex:
+    """Booked windows ``(start, end, spot_id, reservation_id)`` sorted by start.
+
+    A segment tree over the sorted list stores the latest end time below each
+    node. A window query only descends into the prefix that starts before the
+    window ends and into subtrees whose latest end is after it starts, so the
+    cost follows the number of overlaps (O(log n + k)) rather than n.
+    """
+
+    def __init__(self, windows=(), version=0):
+        self.windows = sorted(windows)
+        self.version = version
+        self._tree = None
+
+    def __len__(self):
+        return len(self.windows)
+
+    def add(self, window):
+        # Copy-on-write so concurrent readers keep a consistent list; windows
+        # that have already ended are dropped on the way.
+        now = datetime.utcnow()
+        windows = [w for w in self.windows if w[1] > now]
+        bisect.insort(windows, window)
+        self.windows, self._tree = windows, None
+
+    def remove(self, reservation_id):
+        self.windows, self._tree = [w for w in self.windows if w[3] != reservation_id], None
+
+    def _build(self, windows):
+        size = 1
+        while size < len(windows):
+            size *= 2
+        latest = [None] * (2 * size)
+        for i, window in enumerate(windows):
+            latest[size + i] = window[1]
+        for node in range(size - 1, 0, -1):
+            left, right = latest[2 * node], latest[2 * node + 1]
+            latest[node] = left if right is None or (left is not None and left >= right) else right
+        return windows, size, latest
+
+    def overlapping(self, start, end):
+        tree = self._tree
+        if tree is None or tree[0] is not self.windows:
+            tree = self._tree = self._build(self.windows)
+        windows, size, latest = tree
+        # Windows at or past this position start at/after ``end``.
+        limit = bisect.bisect_left(windows, (end,))
+
+        found = []
+        stack = [(1, 0, size)]
+        while stack:
+            node, lo, hi = stack.pop()
+            if lo >= limit or latest[node] is None or latest[node] <= start:
+                continue
+            if hi - lo == 1:
+                found.append(windows[lo])
+                continue
+            mid = (lo + hi) // 2
+            stack.append((2 * node + 1, mid, hi))
+            stack.append((2 * node, lo, mid))
+        return found
+
+
+def stored_version(lot_id):
+    return db.session.query(func.coalesce(ParkingLot.hold_version, 0)).filter(ParkingLot.id == lot_id).scalar()
+
+
+def _load(lot_id):
+    # Version first: windows committed after it only cause one more reload.
+    version = stored_version(lot_id)
+    rows = db.session.query(
+        AdvanceReservation.start_time, AdvanceReservation.end_time,
+        AdvanceReservation.spot_id, AdvanceReservation.id
+    ).join(ParkingSpot, ParkingSpot.id == AdvanceReservation.spot_id).filter(
+        ParkingSpot.lot_id == lot_id,
+        AdvanceReservation.status == 'B',
+        AdvanceReservation.end_time > datetime.utcnow(),
+    )
+    return IntervalIndex((tuple(row) for row in rows), version or 0)
+
+
+def for_lot(lot_id, version=None):
+    """The lot's index, reloaded if it is behind ``version`` (by default the stored one)."""
+    index = _lots.get(lot_id)
+    if index is not None and index.version >= ((stored_version(lot_id) or 0) if version is None else version):
+        return index
+    index = _load(lot_id)
+    with _lock:
+        cached = _lots.get(lot_id)
+        if cached is not None and cached.version >= index.version:
+            return cached
+        _lots[lot_id] = index
+    return index
+
+
+def busy_spots(lot_id, start, end, version=None):
+    """Ids of the lot's spots with a booked window overlapping [start, end)."""
+    return {window[2] for window in for_lot(lot_id, version).overlapping(start, end)}
+
+
+def held_now(lot_id, version=None):
+    now = datetime.utcnow()
+    return busy_spots(lot_id, now, now + timedelta(microseconds=1), version)
+
+
+def is_held(lot_id, spot_id):
+    return spot_id in held_now(lot_id)
+
+
+def free_spots(lot_id, start, end):
+    busy = busy_spots(lot_id, start, end)
+    return [spot_id for spot_id in occupancy.for_lot(lot_id).spot_ids if spot_id not in busy]
+
+
+def book(user_id, spot_id, start, end, price_per_hour):
+    """Insert a booked window unless it overlaps another one on the same spot.
+
+    Returns the new reservation id, or None on a conflict. The caller owns
+    the commit.
+    """
+    # Serialise bookings per spot on Postgres; SQLite already has one writer.
+    lot_id = db.session.execute(
+        select(ParkingSpot.lot_id).where(ParkingSpot.id == spot_id, ParkingSpot.status != 'X').with_for_update()
+    ).scalar()
+    if lot_id is None:
+        return None
+
+    conflict = exists().where(
+        AdvanceReservation.spot_id == spot_id,
+        AdvanceReservation.status == 'B',
+        AdvanceReservation.start_time < end,
+        AdvanceReservation.end_time > start,
+    )
+    now = datetime.utcnow()
+    reservation_id = db.session.execute(
+        insert(AdvanceReservation).from_select(
+            ['user_id', 'spot_id', 'start_time', 'end_time', 'price_per_hour', 'status', 'created_at'],
+            select(
+                literal(user_id), literal(spot_id), literal(start, db.DateTime), literal(end, db.DateTime),
+                literal(price_per_hour, db.Float), literal('B'), literal(now, db.DateTime)
+            ).where(~conflict)
+        ).returning(AdvanceReservation.id)
+    ).scalar()
+    if reservation_id is not None:
+        _queue(('add', lot_id, (start, end, spot_id, reservation_id)))
+    return reservation_id
+
+
+def close(reservation, status):
+    """Mark a booked window cancelled ('C') or checked in ('U')."""
+    reservation.status = status
+    _queue(('remove', reservation.spot.lot_id, reservation.id))
+
+
+def forget(lot_id):
+    _queue(('forget', lot_id, None))
+
+
+def _queue(change):
+    db.session.info.setdefault(_PENDING_KEY, []).append(change)
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_versions(session):
+    lot_ids = {change[1] for change in session.info.get(_PENDING_KEY, ())}
+    if lot_ids:
+        rows = session.execute(
+            update(ParkingLot)
+            .where(ParkingLot.id.in_(lot_ids))
+            .values(hold_version=func.coalesce(ParkingLot.hold_version, 0) + 1)
+            .returning(ParkingLot.id, ParkingLot.hold_version)
+            .execution_options(synchronize_session=False)
+        )
+        session.info[_VERSIONS_KEY] = dict(rows.all())
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_pending(session):
+    changes = session.info.pop(_PENDING_KEY, [])
+    versions = session.info.pop(_VERSIONS_KEY, {})
+    with _lock:
+        for lot_id, version in versions.items():
+            index = _lots.get(lot_id)
+            if index is not None and index.version != version - 1:
+                del _lots[lot_id]
+        for kind, lot_id, value in changes:
+            index = _lots.get(lot_id)
+            if index is None:
+                continue
+            if kind == 'add':
+                index.add(value)
+            elif kind == 'remove':
+                index.remove(value)
+            else:
+                _lots.pop(lot_id, None)
+        for lot_id, version in versions.items():
+            if lot_id in _lots:
+                _lots[lot_id].version = version
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
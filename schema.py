@@ -0,0 +1,48 @@
+from sqlalchemy import inspect, text
+
+import search
+from models import db
+
+
+def ensure_columns():
+    """Add nullable columns declared on the models that an existing table lacks.
+
+    db.create_all() never alters existing tables. Only nullable columns are
+    added, so rows that already exist stay valid.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present or not column.nullable:
+                    continue
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(engine.dialect)}"
+                ))
+
+
+def ensure_indexes():
+    """Create any index declared on the models that an existing database lacks.
+
+    db.create_all() only builds indexes together with brand new tables, so
+    databases created before an index was added need this to catch up.
+    """
+    engine = db.engine
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+def init_db():
+    """Bring the database schema up to date; safe to run on every deploy."""
+    db.create_all()
+    ensure_columns()
+    ensure_indexes()
+    search.install()
@@ -0,0 +1,125 @@
+import re
+
+from sqlalchemy import text
+
+from models import db, ParkingLot
+
+# Lot search: names and addresses go through an SQLite FTS5 index ranked by
+# bm25, all-digit queries are treated as PIN code prefixes and answered by a
+# range scan on the pin_code index. The FTS table is an external-content
+# index over parking_lot kept in sync by triggers, so every insert, update
+# and delete of a lot (from any code path) is reflected immediately.
+
+SEARCH_PAGE_SIZE = 25
+
+_FTS_DDL = [
+    """CREATE VIRTUAL TABLE parking_lot_fts USING fts5(
+        prime_location_name, address,
+        content='parking_lot', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER parking_lot_fts_ai AFTER INSERT ON parking_lot BEGIN
+        INSERT INTO parking_lot_fts(rowid, prime_location_name, address)
+        VALUES (new.id, new.prime_location_name, new.address);
+    END""",
+    """CREATE TRIGGER parking_lot_fts_ad AFTER DELETE ON parking_lot BEGIN
+        INSERT INTO parking_lot_fts(parking_lot_fts, rowid, prime_location_name, address)
+        VALUES ('delete', old.id, old.prime_location_name, old.address);
+    END""",
+    "INSERT INTO parking_lot_fts(parking_lot_fts) VALUES ('rebuild')",
+]
+
+# Only the indexed columns: every reserve and release updates the lot's
+# counters, and reindexing the row each time bloats the FTS segments.
+# Recreated on each install so databases with the older trigger pick it up.
+_FTS_UPDATE_TRIGGER = [
+    "DROP TRIGGER IF EXISTS parking_lot_fts_au",
+    """CREATE TRIGGER parking_lot_fts_au AFTER UPDATE OF prime_location_name, address ON parking_lot BEGIN
+        INSERT INTO parking_lot_fts(parking_lot_fts, rowid, prime_location_name, address)
+        VALUES ('delete', old.id, old.prime_location_name, old.address);
+        INSERT INTO parking_lot_fts(rowid, prime_location_name, address)
+        VALUES (new.id, new.prime_location_name, new.address);
+    END""",
+]
+
+_fts_enabled = None
+
+
+def _fts_table_exists(conn):
+    return conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'parking_lot_fts'"
+    )).first() is not None
+
+
+def install():
+    """Create the FTS index and its triggers if this database supports them."""
+    global _fts_enabled
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        _fts_enabled = False
+        return
+    with engine.begin() as conn:
+        try:
+            statements = _FTS_UPDATE_TRIGGER
+            if not _fts_table_exists(conn):
+                statements = _FTS_DDL + statements
+            for statement in statements:
+                conn.execute(text(statement))
+        except Exception:
+            # SQLite built without FTS5: fall back to plain filtering.
+            conn.rollback()
+            _fts_enabled = False
+            return
+    _fts_enabled = True
+
+
+def fts_enabled():
+    """Whether `flask init-db` built the FTS index; checked once per process."""
+    global _fts_enabled
+    if _fts_enabled is None:
+        engine = db.engine
+        if engine.dialect.name != 'sqlite':
+            _fts_enabled = False
+        else:
+            with engine.connect() as conn:
+                _fts_enabled = _fts_table_exists(conn)
+    return _fts_enabled
+
+
+def _pin_upper_bound(prefix):
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _by_pin_prefix(prefix, offset, limit):
+    return ParkingLot.query.filter(
+        ParkingLot.pin_code >= prefix,
+        ParkingLot.pin_code < _pin_upper_bound(prefix)
+    ).order_by(ParkingLot.pin_code, ParkingLot.id).offset(offset).limit(limit).all()
+
+
+def _by_text(q, offset, limit):
+    terms = re.findall(r'\w+', q)
+    if not terms:
+        return []
+    if not fts_enabled():
+        pattern = f'%{q}%'
+        return ParkingLot.query.filter(
+            ParkingLot.prime_location_name.ilike(pattern) | ParkingLot.address.ilike(pattern)
+        ).order_by(ParkingLot.id).offset(offset).limit(limit).all()
+
+    match = ' '.join(f'"{term}"*' for term in terms)
+    ids = [row[0] for row in db.session.execute(text(
+        "SELECT rowid FROM parking_lot_fts WHERE parking_lot_fts MATCH :match "
+        "ORDER BY bm25(parking_lot_fts) LIMIT :limit OFFSET :offset"
+    ), {'match': match, 'limit': limit, 'offset': offset})]
+    lots = {lot.id: lot for lot in ParkingLot.query.filter(ParkingLot.id.in_(ids))}
+    return [lots[lot_id] for lot_id in ids if lot_id in lots]
+
+
+def search_lots(q, page=1):
+    """Return one page of lots matching ``q`` and whether another page follows."""
+    offset = (page - 1) * SEARCH_PAGE_SIZE
+    if q.isdigit():
+        lots = _by_pin_prefix(q, offset, SEARCH_PAGE_SIZE + 1)
+    else:
+        lots = _by_text(q, offset, SEARCH_PAGE_SIZE + 1)
+    return lots[:SEARCH_PAGE_SIZE], len(lots) > SEARCH_PAGE_SIZE
@@ -0,0 +1,56 @@
+import pytest
+
+import catalog
+import occupancy
+import pricing
+import rollups
+import schedule
+import schema
+from allocation import provision_spots
+from app import create_app
+from models import db, ParkingLot, User
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'parking.db'}")
+    app = create_app({'TESTING': True})
+    with app.app_context():
+        schema.init_db()
+    yield app
+    # The in-process indexes are keyed by lot id, which the next database reuses.
+    occupancy.invalidate()
+    schedule._lots.clear()
+    catalog._cache.clear()
+    pricing._bands = None
+    rollups._peaks.clear()
+    with app.app_context():
+        db.engine.dispose()
+
+
+def make_lot(spots, price_per_hour=60, name='Test Lot'):
+    lot = ParkingLot(prime_location_name=name, price_per_hour=price_per_hour, address='1 Test Road',
+                     pin_code='600001', max_spots=spots, spots_filled=0)
+    db.session.add(lot)
+    db.session.flush()
+    provision_spots(lot.id, spots)
+    db.session.commit()
+    return lot.id
+
+
+def make_users(count, prefix='user'):
+    # A precomputed hash: hashing hundreds of passwords would dominate the tests.
+    users = [User(username=f'{prefix}{i}', name=f'User {i}', passhash='scrypt:32768:8:1$unused')
+             for i in range(count)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def client_for(app, user_id, is_admin=False):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['is_admin'] = is_admin
+        sess['name'] = f'User {user_id}'
+    return client
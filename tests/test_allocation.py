@@ -0,0 +1,223 @@
+import random
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func
+
+import occupancy
+from allocation import RETIRED, claim_lot, claim_spot, delete_spots, release_lot, resize_spots
+from conftest import client_for, make_lot, make_users
+from models import db, AdvanceReservation, Booking, ParkingLot, ParkingSpot, Reservation
+
+
+def assert_consistent(lot_id):
+    active = db.session.query(Reservation.spot_id, func.count(Reservation.id)) \
+        .join(ParkingSpot, ParkingSpot.id == Reservation.spot_id) \
+        .filter(ParkingSpot.lot_id == lot_id, Reservation.leaving_timestamp.is_(None)) \
+        .group_by(Reservation.spot_id).all()
+    assert all(count == 1 for _, count in active), f"double-booked spots: {active}"
+    occupied = {spot_id for spot_id, in db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id, status='O')}
+    assert {spot_id for spot_id, _ in active} <= occupied
+    assert db.session.get(ParkingLot, lot_id, populate_existing=True).spots_filled == len(occupied)
+
+
+def test_concurrent_reservations_never_double_book(app):
+    with app.app_context():
+        lot_id = make_lot(20)
+        user_ids = make_users(300)
+        spot_ids = [spot_id for spot_id, in db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id)]
+
+    # 300 users race for 20 spots; half release straight away, freeing
+    # spots for the users behind them.
+    rng = random.Random(7)
+    targets = [(user_id, rng.choice(spot_ids), rng.random() < 0.5) for user_id in user_ids]
+
+    def reserve(target):
+        user_id, spot_id, release = target
+        client = client_for(app, user_id)
+        assert client.post(f'/user/reserve/{spot_id}').status_code == 302
+        if release:
+            assert client.post(f'/user/release/{spot_id}').status_code == 302
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(reserve, targets))
+
+    with app.app_context():
+        assert_consistent(lot_id)
+        assert db.session.query(Reservation).count() >= len(spot_ids)
+
+
+def test_concurrent_lot_claims_hand_out_each_spot_once(app):
+    with app.app_context():
+        lot_id = make_lot(40)
+
+    def claim(_):
+        with app.app_context():
+            spot_id = claim_spot(lot_id=lot_id)
+            db.session.commit()
+            return spot_id
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        claimed = list(pool.map(claim, range(60)))
+
+    won = [spot_id for spot_id in claimed if spot_id is not None]
+    assert len(won) == 40
+    assert len(set(won)) == 40
+    with app.app_context():
+        assert db.session.get(ParkingLot, lot_id).spots_filled == 40
+
+
+def test_release_lot_keeps_spots_with_active_reservations(app):
+    with app.app_context():
+        lot_id = make_lot(5)
+        reserver, booker = make_users(2)
+        spot_id = claim_spot(lot_id=lot_id)
+        db.session.add(Reservation(user_id=reserver, spot_id=spot_id, price_per_hour=60))
+        booking = Booking(user_id=booker, parking_lot_id=lot_id)
+        db.session.add(booking)
+        assert claim_lot(lot_id) == 4
+        db.session.commit()
+
+        booking.end_time = booking.start_time
+        assert release_lot(lot_id) == 4
+        db.session.commit()
+
+        assert db.session.get(ParkingSpot, spot_id).status == 'O'
+        assert db.session.get(ParkingLot, lot_id).spots_filled == 1
+        assert_consistent(lot_id)
+
+
+def test_release_lot_frees_nothing_while_another_booking_is_active(app):
+    with app.app_context():
+        lot_id = make_lot(3)
+        first, second = make_users(2)
+        db.session.add(Booking(user_id=first, parking_lot_id=lot_id, end_time=None))
+        db.session.add(Booking(user_id=second, parking_lot_id=lot_id, end_time=None))
+        claim_lot(lot_id)
+        db.session.commit()
+
+        db.session.query(Booking).filter_by(user_id=first).update({'end_time': func.now()})
+        assert release_lot(lot_id) == 0
+        db.session.commit()
+        assert db.session.get(ParkingLot, lot_id).spots_filled == 3
+
+
+def test_shrinking_retires_free_spots_and_keeps_their_history(app):
+    with app.app_context():
+        lot_id = make_lot(5)
+        user_id, = make_users(1)
+        spot_ids = sorted(spot_id for spot_id, in db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id))
+        db.session.add(Reservation(user_id=user_id, spot_id=spot_ids[-1], price_per_hour=60,
+                                   leaving_timestamp=func.now(), amount=60))
+        db.session.commit()
+
+        assert resize_spots(lot_id, 3)
+        db.session.commit()
+
+        retired = {spot_id for spot_id, in db.session.query(ParkingSpot.id).filter_by(status=RETIRED)}
+        assert retired == set(spot_ids[-2:])
+        assert db.session.query(Reservation).count() == 1
+        assert Reservation.total_revenue() == 60
+        assert occupancy.for_lot(lot_id).total_count == 3
+
+
+def test_shrinking_below_the_spots_in_use_changes_nothing(app):
+    with app.app_context():
+        lot_id = make_lot(4)
+        claim_spot(lot_id=lot_id)
+        claim_spot(lot_id=lot_id)
+        db.session.commit()
+
+        assert not resize_spots(lot_id, 1)
+        db.session.rollback()
+        assert db.session.query(ParkingSpot).filter_by(status=RETIRED).count() == 0
+        assert occupancy.for_lot(lot_id).total_count == 4
+
+
+def test_shrinking_never_retires_a_spot_reserved_meanwhile(app):
+    with app.app_context():
+        lot_id = make_lot(40)
+        user_ids = make_users(30)
+        spot_ids = [spot_id for spot_id, in db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id)]
+        admin_id, = make_users(1, prefix='admin')
+
+    def reserve(target):
+        user_id, spot_id = target
+        client_for(app, user_id).post(f'/user/reserve/{spot_id}')
+
+    def shrink(size):
+        client_for(app, admin_id, is_admin=True).post(f'/admin/edit-parking/{lot_id}', data={
+            'prime_location_name': 'Test Lot', 'price_per_hour': 60, 'address': '1 Test Road',
+            'pin_code': '600001', 'max_spots': size})
+
+    rng = random.Random(11)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        jobs = [pool.submit(reserve, (user_id, rng.choice(spot_ids))) for user_id in user_ids]
+        jobs += [pool.submit(shrink, size) for size in (36, 32, 28, 24)]
+        for job in jobs:
+            job.result()
+
+    with app.app_context():
+        assert_consistent(lot_id)
+        reserved_retired = db.session.query(Reservation).join(ParkingSpot) \
+            .filter(ParkingSpot.status == RETIRED, Reservation.leaving_timestamp.is_(None)).count()
+        assert reserved_retired == 0
+        live = db.session.query(ParkingSpot).filter(ParkingSpot.lot_id == lot_id, ParkingSpot.status != RETIRED).count()
+        assert live == db.session.get(ParkingLot, lot_id).max_spots
+
+
+def test_toggle_refuses_a_retired_spot(app):
+    with app.app_context():
+        lot_id = make_lot(2)
+        admin_id, = make_users(1, prefix='admin')
+        assert resize_spots(lot_id, 1)
+        db.session.commit()
+        retired_id = db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id, status=RETIRED).scalar()
+    client = client_for(app, admin_id, is_admin=True)
+    client.post(f'/admin/toggle-spot/{retired_id}')
+    with client.session_transaction() as sess:
+        messages = [message for _, message in sess.get('_flashes', [])]
+    assert messages == [f"Spot {retired_id} cannot be toggled right now."]
+    with app.app_context():
+        assert db.session.get(ParkingSpot, retired_id).status == RETIRED
+
+
+def test_deleting_spots_skips_reserved_ones_and_keeps_history(app):
+    with app.app_context():
+        lot_id = make_lot(6)
+        first, second = make_users(2)
+        spot_ids = sorted(spot_id for spot_id, in db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id))
+        reserved = claim_spot(spot_id=spot_ids[0])
+        db.session.add(Reservation(user_id=first, spot_id=reserved, price_per_hour=60))
+        db.session.add(Reservation(user_id=second, spot_id=spot_ids[1], price_per_hour=60,
+                                   leaving_timestamp=func.now(), amount=60))
+        claim_spot(spot_id=spot_ids[2])
+        db.session.commit()
+
+        assert delete_spots(lot_id, [(spot_ids[0], spot_ids[3])]) == (4, 3)
+        db.session.commit()
+
+        assert db.session.get(ParkingSpot, reserved).status == 'O'
+        assert db.session.query(ParkingSpot).filter_by(status=RETIRED).count() == 3
+        assert db.session.query(Reservation).count() == 2
+        lot = db.session.get(ParkingLot, lot_id)
+        assert (lot.max_spots, lot.spots_filled) == (3, 1)
+        assert occupancy.for_lot(lot_id).total_count == 3
+        assert delete_spots(lot_id, [(spot_ids[0], spot_ids[3])]) == (1, 0)
+
+
+def test_only_bookings_still_ahead_keep_a_spot(app):
+    with app.app_context():
+        lot_id = make_lot(2)
+        user_id, = make_users(1)
+        past, ahead = sorted(spot_id for spot_id, in db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id))
+        now = datetime.utcnow()
+        for spot_id, start in ((past, now - timedelta(hours=3)), (ahead, now + timedelta(hours=1))):
+            db.session.add(AdvanceReservation(user_id=user_id, spot_id=spot_id, start_time=start,
+                                              end_time=start + timedelta(hours=1), price_per_hour=60))
+        db.session.commit()
+
+        assert delete_spots(lot_id, ids=[past, ahead]) == (2, 1)
+        db.session.commit()
+        assert db.session.get(ParkingSpot, past).status == RETIRED
+        assert db.session.get(ParkingSpot, ahead).status == 'A'
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import schedule
+from conftest import client_for, make_lot, make_users
+from models import db, ParkingSpot
+
+
+def spot_map(client, lot_id, etag=None):
+    headers = {'If-None-Match': etag} if etag else {}
+    return client.get(f'/api/v1/lots/{lot_id}/spots', headers=headers)
+
+
+def test_spot_map_revalidates_until_a_reserve(app):
+    with app.app_context():
+        lot_id = make_lot(3)
+        user_id, = make_users(1)
+        spot_id = db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id).first()[0]
+    client = client_for(app, user_id)
+
+    first = spot_map(client, lot_id)
+    assert first.status_code == 200 and first.headers['ETag']
+    repeat = spot_map(client, lot_id, first.headers['ETag'])
+    assert repeat.status_code == 304
+    assert repeat.headers['ETag'] == first.headers['ETag']
+
+    assert client.post(f'/api/v1/spots/{spot_id}/reserve').status_code == 201
+    after = spot_map(client, lot_id, first.headers['ETag'])
+    assert after.status_code == 200
+    assert after.headers['ETag'] != first.headers['ETag']
+
+
+def test_spot_map_etag_changes_after_a_hold(app):
+    with app.app_context():
+        lot_id = make_lot(3)
+        user_id, = make_users(1)
+        spot_id = db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id).first()[0]
+    client = client_for(app, user_id)
+    etag = spot_map(client, lot_id).headers['ETag']
+
+    with app.app_context():
+        start = datetime.utcnow() + timedelta(hours=1)
+        assert schedule.book(user_id, spot_id, start, start + timedelta(hours=2), 60) is not None
+        db.session.commit()
+    after = spot_map(client, lot_id, etag)
+    assert after.status_code == 200
+    assert after.headers['ETag'] != etag
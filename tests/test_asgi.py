@@ -0,0 +1,50 @@
+import asyncio
+import importlib
+import re
+
+import pytest
+
+from conftest import client_for, make_lot, make_users
+from models import db, Reservation
+from allocation import claim_spot
+
+pytest.importorskip('a2wsgi')
+pytest.importorskip('aiosqlite')
+
+
+def _get(asgi, path, cookie):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+             'http_version': '1.1', 'headers': [(b'cookie', f'session={cookie}'.encode())]}
+    asyncio.run(asgi.application(scope, receive, send))
+    return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+
+def test_async_pages_match_the_sync_views(app):
+    with app.app_context():
+        lot_id = make_lot(5)
+        user_id, = make_users(1)
+        db.session.add(Reservation(user_id=user_id, spot_id=claim_spot(lot_id=lot_id), price_per_hour=60))
+        db.session.commit()
+
+    # asgi.py builds its app at import, from the test database's URL.
+    asgi = importlib.reload(importlib.import_module('asgi'))
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'user_id': user_id, 'name': f'User {user_id}'})
+    client = client_for(app, user_id)
+    try:
+        for path in (f'/user/view_spots/{lot_id}', '/user/history', '/admin/view-parking', '/user/view_spots/999'):
+            status, body = _get(asgi, path, cookie)
+            expected = client.get(path)
+            assert status == expected.status_code, path
+            assert re.sub(rb'\s+', b' ', body) == re.sub(rb'\s+', b' ', expected.data), path
+    finally:
+        asyncio.run(asgi.engine.dispose())
+        with asgi.flask_app.app_context():
+            db.engine.dispose()
@@ -0,0 +1,38 @@
+import audit
+from allocation import claim_spot
+from conftest import make_lot
+from models import db, ParkingLot, ParkingSpot
+
+
+def drifted_lots():
+    with_drift = make_lot(4, name='Drifted')
+    in_step = make_lot(2, name='In step')
+    for lot_id in (with_drift, in_step):
+        claim_spot(lot_id=lot_id)
+    db.session.commit()
+    db.session.get(ParkingLot, with_drift).spots_filled = 3
+    db.session.commit()
+    return with_drift, in_step
+
+
+def test_audit_reports_drift_without_touching_it(app):
+    with app.app_context():
+        with_drift, _ = drifted_lots()
+        drift = audit.run()
+        assert [(row.lot_id, row.spots_filled, row.actual_filled) for row in drift] == [(with_drift, 3, 1)]
+        db.session.expire_all()
+        assert db.session.get(ParkingLot, with_drift).spots_filled == 3
+        assert audit.stats()['last_drifted'] == 1
+
+
+def test_audit_repairs_drift_from_the_spots(app):
+    with app.app_context():
+        with_drift, in_step = drifted_lots()
+        db.session.query(ParkingSpot).filter_by(lot_id=in_step, status='A').update({'status': 'O'})
+        db.session.commit()
+
+        assert {row.lot_id for row in audit.run(fix=True)} == {with_drift, in_step}
+        db.session.expire_all()
+        assert db.session.get(ParkingLot, with_drift).spots_filled == 1
+        assert db.session.get(ParkingLot, in_step).spots_filled == 2
+        assert audit.run() == []
@@ -0,0 +1,19 @@
+import threading
+
+import pytest
+
+import auth
+
+
+def test_a_check_stuck_behind_the_hasher_raises_auth_busy(monkeypatch):
+    monkeypatch.setattr(auth, 'HASH_TIMEOUT_SECONDS', 0.05)
+    release = threading.Event()
+    blockers = [auth._pool.submit(release.wait) for _ in range(auth.HASH_WORKERS)]
+    try:
+        with pytest.raises(auth.AuthBusy):
+            auth._run(lambda: True)
+    finally:
+        release.set()
+        for blocker in blockers:
+            blocker.result()
+    assert auth._run(lambda: True) is True
@@ -0,0 +1,52 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import billing
+from conftest import make_lot, make_users
+from models import db, charge, ParkingSpot, Reservation
+
+
+def random_rows(count, seed=5):
+    rng = random.Random(seed)
+    starts, ends, rates, amounts = [], [], [], []
+    for _ in range(count):
+        start = datetime(2026, 1, 1) + timedelta(seconds=rng.randrange(86400 * 365),
+                                                 microseconds=rng.randrange(10 ** 6))
+        starts.append(start)
+        ends.append(start + timedelta(seconds=rng.randrange(1, 86400 * 3), microseconds=rng.randrange(10 ** 6)))
+        # Rates such as 0.3 or 1.5 put many charges on a half-paisa tie.
+        rates.append(rng.choice([0.3, 1.5, 20, 33.33, 45.5, 60, 99.99]))
+        amounts.append(rng.choice([None, None, None, round(rng.uniform(1, 500), 2)]))
+    return starts, ends, rates, amounts
+
+
+@pytest.mark.parametrize('numpy', [True, False])
+def test_vectorised_charges_match_the_per_row_charge(monkeypatch, numpy):
+    if not numpy:
+        monkeypatch.setattr(billing, 'np', None)
+    elif billing.np is None:
+        pytest.skip('NumPy is not installed')
+    starts, ends, rates, amounts = random_rows(20000)
+    expected = [charge(start, end, rate) if amount is None else amount
+                for start, end, rate, amount in zip(starts, ends, rates, amounts)]
+
+    assert [float(value) for value in billing.charges(starts, ends, rates, amounts)] == expected
+    assert billing.total(starts, ends, rates, amounts) == round(sum(expected), 2)
+
+
+def test_history_total_matches_the_reservations(app):
+    starts, ends, rates, _ = random_rows(300, seed=9)
+    with app.app_context():
+        lot_id = make_lot(1)
+        user_id, = make_users(1)
+        spot_id = db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id).scalar()
+        reservations = [Reservation(user_id=user_id, spot_id=spot_id, parking_timestamp=start,
+                                    leaving_timestamp=end, price_per_hour=rate)
+                        for start, end, rate in zip(starts, ends, rates)]
+        db.session.add_all(reservations)
+        db.session.commit()
+
+        columns = billing.closed_reservation_columns(Reservation.user_id == user_id)
+        assert billing.total(*columns) == round(sum(r.calculate_total_price() for r in reservations), 2)
@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+
+import expiry
+from allocation import claim_spot
+from conftest import make_lot, make_users
+from models import db, ParkingLot, ParkingSpot, Reservation
+
+
+def test_sweep_releases_only_overdue_unconfirmed_holds(app):
+    now = datetime.utcnow()
+    with app.app_context():
+        lot_id = make_lot(3)
+        overdue, confirmed, recent = make_users(3)
+        spot_ids = sorted(spot_id for spot_id, in db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id))
+        late = now - timedelta(minutes=expiry.GRACE_MINUTES + 5)
+        for user_id, spot_id, at, has_parked in ((overdue, spot_ids[0], late, False),
+                                                 (confirmed, spot_ids[1], late, True),
+                                                 (recent, spot_ids[2], now, False)):
+            claim_spot(spot_id=spot_id)
+            db.session.add(Reservation(user_id=user_id, spot_id=spot_id, price_per_hour=60,
+                                       parking_timestamp=at, has_parked=has_parked))
+        db.session.commit()
+
+        assert expiry.sweep(now) == 1
+        assert expiry.sweep(now) == 0
+
+        expired = Reservation.query.filter_by(user_id=overdue).one()
+        assert expired.leaving_timestamp == expired.parking_timestamp
+        assert expired.calculate_total_price() == 0
+        assert [spot.status for spot in ParkingSpot.query.filter_by(lot_id=lot_id).order_by(ParkingSpot.id)] == \
+            ['A', 'O', 'O']
+        assert db.session.get(ParkingLot, lot_id).spots_filled == 2
+        assert Reservation.query.filter_by(leaving_timestamp=None).count() == 2
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+import waitlist
+from allocation import _has_active_reservation
+from models import db, AdvanceReservation, Booking, ParkingSpot, Reservation, WaitlistEntry
+
+
+def query_plan(statement):
+    compiled = statement.compile(dialect=db.engine.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).all()
+    return [row[-1] for row in rows]
+
+
+NOW = datetime(2026, 1, 1)
+HOT_QUERIES = {
+    'ix_reservation_user_leaving_spot': lambda: select(Reservation.id).where(
+        Reservation.user_id == 1, Reservation.leaving_timestamp.is_(None)),
+    'ix_reservation_active_spot': lambda: select(ParkingSpot.id).where(
+        ParkingSpot.lot_id == 1, ParkingSpot.status == 'O', ~_has_active_reservation()),
+    'ix_reservation_parking_timestamp': lambda: select(Reservation.id).order_by(
+        Reservation.parking_timestamp.desc(), Reservation.id.desc()).limit(50),
+    'ix_booking_user_end': lambda: select(Booking.id).where(Booking.user_id == 1, Booking.end_time.is_(None)),
+    'ix_parking_spot_lot_status': lambda: select(ParkingSpot.id).where(
+        ParkingSpot.lot_id == 1, ParkingSpot.status == 'A').limit(1),
+    'ix_advance_reservation_booked_spot': lambda: select(AdvanceReservation.id).where(
+        AdvanceReservation.spot_id == 1, AdvanceReservation.status == 'B',
+        AdvanceReservation.start_time < NOW, AdvanceReservation.end_time > NOW),
+    'ix_waitlist_waiting': lambda: waitlist.ahead_of(
+        WaitlistEntry(id=5, lot_id=1, priority=0, created_at=NOW)),
+}
+
+
+@pytest.mark.parametrize('index', HOT_QUERIES)
+def test_hot_queries_use_their_index(app, index):
+    with app.app_context():
+        plan = query_plan(HOT_QUERIES[index]())
+    assert any(index in step for step in plan), plan
+    assert not any(step.startswith('SCAN') and 'INDEX' not in step for step in plan), plan
@@ -0,0 +1,42 @@
+from allocation import RETIRED
+from conftest import client_for, make_lot, make_users
+from models import db, ParkingLot, ParkingSpot, Reservation
+
+
+def test_bulk_price_change_by_percent_rounds_to_paise(app):
+    with app.app_context():
+        lot_ids = [make_lot(1, price_per_hour=33.33, name='A'), make_lot(1, price_per_hour=10, name='B')]
+        admin_id, = make_users(1, prefix='admin')
+    client = client_for(app, admin_id, is_admin=True)
+    client.post('/admin/lots/bulk-edit', data={'lot_ids': lot_ids, 'price_percent': '12.5'})
+    with app.app_context():
+        prices = [db.session.get(ParkingLot, lot_id).price_per_hour for lot_id in lot_ids]
+    assert prices == [37.5, 11.25]
+
+
+def flashed(client):
+    with client.session_transaction() as sess:
+        return [message for _, message in sess.pop('_flashes', [])]
+
+
+def test_single_spot_admin_actions_leave_a_reserved_spot_alone(app):
+    with app.app_context():
+        lot_id = make_lot(3)
+        admin_id, first, second = make_users(3)
+        spot_ids = sorted(spot_id for spot_id, in db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id))
+    client_for(app, first).post(f'/user/reserve/{spot_ids[0]}')
+    admin = client_for(app, admin_id, is_admin=True)
+
+    admin.post(f'/admin/toggle-spot/{spot_ids[0]}')
+    assert flashed(admin) == [f"Spot {spot_ids[0]} cannot be toggled right now."]
+    admin.post(f'/admin/delete-spot/{spot_ids[0]}')
+    assert flashed(admin) == [f"Spot {spot_ids[0]} cannot be deleted while it is reserved or booked."]
+    client_for(app, second).post(f'/user/reserve/{spot_ids[0]}')
+
+    admin.post(f'/admin/delete-spot/{spot_ids[1]}')
+    assert flashed(admin) == [f"Spot {spot_ids[1]} deleted."]
+    with app.app_context():
+        assert db.session.query(Reservation).filter_by(spot_id=spot_ids[0]).count() == 1
+        assert db.session.get(ParkingSpot, spot_ids[1]).status == RETIRED
+        lot = db.session.get(ParkingLot, lot_id)
+        assert (lot.max_spots, lot.spots_filled) == (2, 1)
@@ -0,0 +1,28 @@
+import random
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from pricing import Tariff
+
+
+def test_time_bands_are_local_wall_clock_times():
+    night = Tariff([(22 * 60, 2.0), (6 * 60, 1.0)], zone=ZoneInfo('Asia/Kolkata'))
+    # 16:00-17:00 UTC is 21:30-22:30 in Kolkata: half an hour of each band.
+    assert night.charge(datetime(2026, 3, 1, 16), datetime(2026, 3, 1, 17), 60) == 90.0
+    assert night.time_multiplier(datetime(2026, 3, 1, 16, 29)) == 1.0
+    assert night.time_multiplier(datetime(2026, 3, 1, 16, 30)) == 2.0
+
+
+def test_stays_across_a_dst_change_are_billed_by_real_minutes():
+    zone = ZoneInfo('America/New_York')
+    rng = random.Random(3)
+    for _ in range(30):
+        bands = list({rng.randrange(24) * 60: rng.choice([0.5, 1, 1.5, 2]) for _ in range(3)}.items())
+        tariff = Tariff(bands, zone=zone)
+        # Clocks go forward at 07:00 UTC on 8 March and back at 06:00 UTC on 1 November.
+        around = rng.choice([datetime(2026, 3, 8, 7), datetime(2026, 11, 1, 6)])
+        start = around - timedelta(minutes=rng.randrange(1, 48 * 60))
+        end = around + timedelta(minutes=rng.randrange(1, 48 * 60))
+        minutes = int((end - start).total_seconds() // 60)
+        expected = sum(tariff.time_multiplier(start + timedelta(minutes=m)) for m in range(minutes))
+        assert abs(tariff.weighted_minutes(start, end) - expected) < 1e-6
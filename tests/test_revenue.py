@@ -0,0 +1,38 @@
+import random
+from datetime import datetime, timedelta
+
+from conftest import make_lot, make_users
+from models import db, billed_minutes, Booking, ParkingSpot, Reservation
+
+
+def stays(count):
+    # Mostly a hair past a whole minute, where millisecond rounding used to drop it.
+    rng = random.Random(7)
+    start = datetime(2026, 3, 1, 8, 0, 0, 250000)
+    for _ in range(count):
+        start += timedelta(seconds=rng.randrange(1, 600), microseconds=rng.randrange(1000000))
+        spill = rng.choice([1, 7, 499, 999, rng.randrange(1000000)])
+        yield start, start + timedelta(minutes=rng.randrange(1, 300), microseconds=spill)
+
+
+def test_sql_revenue_matches_the_per_row_charges(app):
+    with app.app_context():
+        lot_id = make_lot(1, price_per_hour=37)
+        user_id, = make_users(1)
+        spot_id = db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id).scalar()
+        for n, (start, end) in enumerate(stays(600)):
+            db.session.add(Booking(user_id=user_id, parking_lot_id=lot_id, start_time=start, end_time=end))
+            db.session.add(Reservation(user_id=user_id, spot_id=spot_id, price_per_hour=[20, 45.5, 60][n % 3],
+                                       parking_timestamp=start, leaving_timestamp=end))
+        db.session.commit()
+
+        reservations = Reservation.query.all()
+        bookings = Booking.query.all()
+        assert round(Reservation.total_revenue(), 2) == \
+            round(sum(r.calculate_total_price() for r in reservations), 2)
+        assert round(Booking.total_revenue(), 2) == round(sum(b.calculate_price() for b in bookings), 2)
+
+        minutes = dict(db.session.query(Reservation.id,
+                                        billed_minutes(Reservation.parking_timestamp, Reservation.leaving_timestamp)))
+        assert all(minutes[r.id] * 60 >= (r.leaving_timestamp - r.parking_timestamp).total_seconds()
+                   > (minutes[r.id] - 1) * 60 for r in reservations)
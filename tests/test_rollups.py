@@ -0,0 +1,37 @@
+from sqlalchemy import event
+
+from allocation import claim_spot, free_spot
+from conftest import make_lot
+from models import db, LotUsageHourly
+
+
+def test_only_new_hourly_highs_write_the_peak(app):
+    with app.app_context():
+        lot_id = make_lot(5)
+        upserts = []
+
+        def count(conn, cursor, statement, *args):
+            if statement.startswith('INSERT INTO lot_usage_hourly'):
+                upserts.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            spot_ids = [claim_spot(lot_id=lot_id) for _ in range(3)]
+            db.session.commit()
+            assert len(upserts) == 3
+
+            free_spot(spot_ids[0])
+            db.session.commit()
+            claim_spot(lot_id=lot_id)
+            db.session.commit()
+            assert len(upserts) == 3
+
+            claim_spot(lot_id=lot_id)
+            db.session.rollback()
+            claim_spot(lot_id=lot_id)
+            db.session.commit()
+            assert len(upserts) == 5
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+        assert db.session.query(LotUsageHourly.peak_occupancy).scalar() == 4
@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy import text
+
+import search
+from allocation import claim_spot, free_spot
+from conftest import make_lot
+from models import db, ParkingLot, ParkingSpot
+
+
+def fts_rows():
+    return db.session.execute(text("SELECT count(*) FROM parking_lot_fts_data")).scalar()
+
+
+def trigger_sql():
+    return db.session.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'parking_lot_fts_au'"
+    )).scalar()
+
+
+@pytest.fixture
+def fts(app):
+    with app.app_context():
+        if not search.fts_enabled():
+            pytest.skip("SQLite built without FTS5")
+    return app
+
+
+def test_occupancy_updates_leave_the_search_index_alone(fts):
+    with fts.app_context():
+        lot_id = make_lot(2, name='Marina Beach')
+        spot_id = db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id).first()[0]
+        before = fts_rows()
+        for _ in range(5):
+            claim_spot(spot_id=spot_id)
+            db.session.commit()
+            free_spot(spot_id)
+            db.session.commit()
+        assert fts_rows() == before
+
+        db.session.get(ParkingLot, lot_id).prime_location_name = 'Besant Nagar'
+        db.session.commit()
+        assert [lot.id for lot in search.search_lots('besant')[0]] == [lot_id]
+        assert search.search_lots('marina')[0] == []
+
+
+def test_install_replaces_the_old_update_trigger(fts):
+    with fts.app_context():
+        db.session.execute(text("DROP TRIGGER parking_lot_fts_au"))
+        db.session.execute(text("CREATE TRIGGER parking_lot_fts_au AFTER UPDATE ON parking_lot BEGIN SELECT 1; END"))
+        db.session.commit()
+        search.install()
+        assert 'UPDATE OF prime_location_name, address' in trigger_sql()
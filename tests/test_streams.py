@@ -0,0 +1,25 @@
+import threading
+
+import app as app_module
+from conftest import client_for, make_lot, make_users
+
+
+def test_sync_streams_past_the_limit_get_503(app, monkeypatch):
+    monkeypatch.setattr(app_module, '_stream_slots', threading.BoundedSemaphore(1))
+    with app.app_context():
+        lot_id = make_lot(3)
+        user_id, = make_users(1)
+    client = client_for(app, user_id)
+    path = f'/lots/{lot_id}/occupancy/stream'
+
+    first = client.get(path, buffered=False)
+    assert first.status_code == 200
+    assert next(first.response).startswith(b'event: snapshot')
+    refused = client.get(path)
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After']
+
+    first.close()
+    again = client.get(path, buffered=False)
+    assert again.status_code == 200
+    again.close()
@@ -0,0 +1,40 @@
+import queue
+
+import waitlist
+from conftest import client_for, make_lot, make_users
+from models import db, ParkingSpot, Reservation, WaitlistEntry
+
+
+def woken_lots():
+    lots = set()
+    while True:
+        try:
+            lots.add(waitlist._wakeups.get_nowait())
+        except queue.Empty:
+            return lots
+
+
+def test_a_freed_spot_goes_to_the_first_waiter(app):
+    with app.app_context():
+        lot_id = make_lot(1)
+        parked, early, urgent = make_users(3)
+        spot_id = db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id).scalar()
+    client_for(app, parked).post(f'/user/reserve/{spot_id}')
+    client_for(app, early).post(f'/user/waitlist/{lot_id}')
+    with app.app_context():
+        waitlist.join(urgent, lot_id, priority=1)
+        db.session.commit()
+        woken_lots()
+        assert waitlist.assign(lot_id) == 0
+
+    client_for(app, parked).post(f'/user/release/{spot_id}')
+    assert woken_lots() == {lot_id}
+    with app.app_context():
+        assert waitlist.assign(lot_id) == 1
+        db.session.commit()
+        assert db.session.get(ParkingSpot, spot_id).status == 'O'
+        reservation = Reservation.query.filter_by(spot_id=spot_id, leaving_timestamp=None).one()
+        assert reservation.user_id == urgent
+        entries = {entry.user_id: entry for entry in WaitlistEntry.query.filter_by(lot_id=lot_id)}
+        assert (entries[urgent].status, entries[urgent].assigned_spot_id) == ('A', spot_id)
+        assert entries[early].status == 'W'
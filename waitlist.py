@@ -0,0 +1,175 @@
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+
+from sqlalchemy import event, func, select, update
+from sqlalchemy.orm import Session
+
+import pricing
+import schedule
+from allocation import claim_spot
+from models import db, Booking, ParkingLot, Reservation, WaitlistEntry
+
+# Users queue per lot when it is full. Whenever a spot is freed the releasing
+# request pokes the scheduler after commit; a background thread then hands
+# free spots to waiting users in priority, then FIFO, order by creating
+# their reservation. A periodic sweep also catches spots freed by other
+# worker processes.
+
+SWEEP_INTERVAL_SECONDS = int(os.environ.get('WAITLIST_SWEEP_SECONDS', 30))
+
+_WAKE_KEY = 'waitlist_wake'
+
+logger = logging.getLogger(__name__)
+
+_wakeups = queue.Queue()
+_scheduler = None
+
+
+def join(user_id, lot_id, priority=0):
+    """Queue a user for a lot. Returns the existing entry if they are already waiting."""
+    entry = WaitlistEntry.query.filter_by(user_id=user_id, lot_id=lot_id, status='W').first()
+    if entry is None:
+        entry = WaitlistEntry(user_id=user_id, lot_id=lot_id, priority=priority)
+        db.session.add(entry)
+    return entry
+
+
+def leave(user_id, lot_id):
+    return WaitlistEntry.query.filter_by(user_id=user_id, lot_id=lot_id, status='W') \
+        .update({'status': 'C'}, synchronize_session=False)
+
+
+def cancel_lot(lot_id):
+    WaitlistEntry.query.filter_by(lot_id=lot_id, status='W') \
+        .update({'status': 'C'}, synchronize_session=False)
+
+
+def ahead_of(entry):
+    """SELECT counting the waiting entries served before ``entry``."""
+    return select(func.count(WaitlistEntry.id)).where(
+        WaitlistEntry.lot_id == entry.lot_id,
+        WaitlistEntry.status == 'W',
+        (WaitlistEntry.priority > entry.priority)
+        | ((WaitlistEntry.priority == entry.priority) & (WaitlistEntry.created_at < entry.created_at))
+        | ((WaitlistEntry.priority == entry.priority) & (WaitlistEntry.created_at == entry.created_at)
+           & (WaitlistEntry.id < entry.id))
+    )
+
+
+def position(entry):
+    """1-based place of a waiting entry in its lot's queue."""
+    return db.session.execute(ahead_of(entry)).scalar() + 1
+
+
+def pending_notifications(user_id):
+    """Assignments the user has not been told about yet; marks them as notified."""
+    entries = WaitlistEntry.query.filter_by(user_id=user_id, status='A', notified=False).all()
+    for entry in entries:
+        entry.notified = True
+    return entries
+
+
+def _next_waiting(lot_id):
+    return WaitlistEntry.query.filter_by(lot_id=lot_id, status='W') \
+        .order_by(WaitlistEntry.priority.desc(), WaitlistEntry.created_at, WaitlistEntry.id).first()
+
+
+def _has_active_parking(user_id):
+    return (Reservation.query.filter_by(user_id=user_id, leaving_timestamp=None).first() is not None
+            or Booking.query.filter_by(user_id=user_id, end_time=None).first() is not None)
+
+
+def assign(lot_id):
+    """Hand free spots of a lot to waiting users. Returns how many were assigned."""
+    assigned = 0
+    while True:
+        entry = _next_waiting(lot_id)
+        if entry is None:
+            return assigned
+
+        if _has_active_parking(entry.user_id):
+            # They got parked some other way; drop them from this queue.
+            entry.status = 'C'
+            db.session.commit()
+            continue
+
+        spot_id = claim_spot(lot_id=lot_id, exclude=schedule.held_now(lot_id))
+        if spot_id is None:
+            db.session.rollback()
+            return assigned
+
+        taken = db.session.execute(
+            update(WaitlistEntry)
+            .where(WaitlistEntry.id == entry.id, WaitlistEntry.status == 'W')
+            .values(status='A', assigned_spot_id=spot_id, assigned_at=datetime.utcnow())
+        ).rowcount
+        if not taken:
+            # Another worker served this entry first; give the spot back.
+            db.session.rollback()
+            continue
+
+        price = pricing.quote(db.session.get(ParkingLot, lot_id))
+        db.session.add(Reservation(user_id=entry.user_id, spot_id=spot_id, price_per_hour=price))
+        db.session.commit()
+        assigned += 1
+
+
+def _lots_with_waiters():
+    return [lot_id for lot_id, in db.session.query(WaitlistEntry.lot_id)
+            .filter_by(status='W').group_by(WaitlistEntry.lot_id)]
+
+
+def notify(lot_id):
+    """Wake the scheduler for ``lot_id`` once the current transaction commits."""
+    db.session.info.setdefault(_WAKE_KEY, set()).add(lot_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_scheduler(session):
+    for lot_id in session.info.pop(_WAKE_KEY, ()):
+        _wakeups.put(lot_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_wakeups(session):
+    session.info.pop(_WAKE_KEY, None)
+
+
+class Scheduler(threading.Thread):
+
+    def __init__(self, app):
+        super().__init__(name='waitlist-scheduler', daemon=True)
+        self.app = app
+
+    def run(self):
+        while True:
+            try:
+                lot_ids = {_wakeups.get(timeout=SWEEP_INTERVAL_SECONDS)}
+            except queue.Empty:
+                lot_ids = None
+            with self.app.app_context():
+                try:
+                    if lot_ids is None:
+                        lot_ids = _lots_with_waiters()
+                    else:
+                        # Coalesce any other wake-ups that queued meanwhile.
+                        while not _wakeups.empty():
+                            lot_ids.add(_wakeups.get_nowait())
+                    for lot_id in lot_ids:
+                        assign(lot_id)
+                except Exception:
+                    logger.exception("Waitlist assignment failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+def start(app):
+    global _scheduler
+    if os.environ.get('WAITLIST_SCHEDULER', '1') == '0' or _scheduler is not None:
+        return
+    _scheduler = Scheduler(app)
+    _scheduler.start()